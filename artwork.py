@@ -0,0 +1,77 @@
+import os
+from functools import lru_cache
+
+import gi
+
+gi.require_version('GdkPixbuf', '2.0')
+from gi.repository import GdkPixbuf, GLib
+
+from metadata import read_artwork
+from thumbnails import load_pixbuf_at_size
+
+
+ARTWORK_SIZE = 200
+
+# Checked in this order, case-insensitively
+FOLDER_IMAGE_NAMES = ("cover.jpg", "cover.jpeg", "cover.png", "folder.jpg", "folder.jpeg", "folder.png",
+                      "front.jpg", "front.png", "album.jpg", "album.png")
+
+
+def find_folder_image(directory):
+    """The cover image file in directory, None if it has none"""
+    try:
+        mtime = os.stat(directory).st_mtime_ns
+    except OSError:
+        return None
+    return _find_folder_image(directory, mtime)
+
+
+@lru_cache(maxsize=1024)
+def _find_folder_image(directory, mtime):
+    # One listing per directory, redone only when files are added or removed there
+    try:
+        names = {entry.name.lower(): entry.name for entry in os.scandir(directory) if entry.is_file()}
+    except OSError:
+        return None
+    for name in FOLDER_IMAGE_NAMES:
+        if name in names:
+            return os.path.join(directory, names[name])
+    return None
+
+
+def load_artwork(track, size=ARTWORK_SIZE):
+    """Album art for a track fitted into size x size: embedded art, else a folder image
+
+    Images are decoded straight at the target size, so memory stays bounded
+    whatever the resolution of the source.
+    """
+    if track.is_stream:
+        return None
+
+    pixbuf = None
+    if track.artwork_hash:
+        try:
+            artwork = read_artwork(track.path)
+            if artwork:
+                pixbuf = load_pixbuf_at_size(artwork, size)
+        except Exception as e:
+            print(f"Error loading artwork for {track.path}: {e}")
+
+    if pixbuf is None:
+        image_file = find_folder_image(os.path.dirname(track.path))
+        if image_file is not None:
+            try:
+                pixbuf = GdkPixbuf.Pixbuf.new_from_file_at_scale(image_file, size, size, True)
+            except GLib.Error as e:
+                print(f"Error loading {image_file}: {e.message}")
+
+    if pixbuf is None:
+        return None
+
+    # Small covers are scaled up to fill the frame, that is cheap at this size
+    width, height = pixbuf.get_width(), pixbuf.get_height()
+    if max(width, height) < size:
+        scale = size / max(width, height)
+        pixbuf = pixbuf.scale_simple(max(1, int(width * scale)), max(1, int(height * scale)),
+                                     GdkPixbuf.InterpType.BILINEAR)
+    return pixbuf
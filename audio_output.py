@@ -0,0 +1,218 @@
+import os
+import threading
+
+import gi
+
+gi.require_version('Gst', '1.0')
+from gi.repository import Gst
+
+
+# Sink choices offered in the audio output settings
+SINK_FACTORIES = {
+    "auto": "autoaudiosink",
+    "pulse": "pulsesink",
+    "pipewire": "pipewiresink",
+    "alsa": "alsasink",
+    "file": "filesink",
+    "fake": "fakesink",
+}
+
+# GstPlayFlags values used by playbin
+PLAY_FLAG_SOFT_VOLUME = 1 << 4
+PLAY_FLAG_NATIVE_AUDIO = 1 << 5
+
+
+def build_audio_sink(output_settings):
+    """Create the audio sink element described by the audio output settings"""
+    sink_type = output_settings.get("sink", "auto")
+    factory = SINK_FACTORIES.get(sink_type, "autoaudiosink")
+
+    if sink_type == "file":
+        return build_file_sink(output_settings.get("file_location", ""))
+
+    sink = Gst.ElementFactory.make(factory, "audio-output")
+    if sink is None:
+        print(f"Audio sink '{factory}' is not available, falling back to autoaudiosink")
+        return Gst.ElementFactory.make("autoaudiosink", "audio-output")
+
+    if sink_type == "fake":
+        # Consume buffers in real time so it behaves like a sound card
+        sink.set_property("sync", True)
+
+    device = output_settings.get("device", "")
+    if device and sink.find_property("device") is not None:
+        sink.set_property("device", device)
+
+    configure_sink_element(sink, output_settings)
+    return sink
+
+
+def build_file_sink(location):
+    """Build a bin that writes the decoded audio to a WAV file"""
+    if not location:
+        print("No file location set for file output, falling back to fakesink")
+        return Gst.ElementFactory.make("fakesink", "audio-output")
+
+    sink_bin = Gst.Bin.new("audio-output")
+    convert = Gst.ElementFactory.make("audioconvert", None)
+    encoder = Gst.ElementFactory.make("wavenc", None)
+    filesink = Gst.ElementFactory.make("filesink", None)
+    filesink.set_property("location", location)
+
+    for element in (convert, encoder, filesink):
+        sink_bin.add(element)
+    convert.link(encoder)
+    encoder.link(filesink)
+
+    sink_bin.add_pad(Gst.GhostPad.new("sink", convert.get_static_pad("sink")))
+    return sink_bin
+
+
+def build_audio_filter(elements):
+    """Chain elements into a bin for playbin's audio-filter property, None if there are none"""
+    elements = [element for element in elements if element is not None]
+    if not elements:
+        return None
+
+    filter_bin = Gst.Bin.new("audio-filter")
+    convert = Gst.ElementFactory.make("audioconvert", None)
+    chain = [convert] + elements + [Gst.ElementFactory.make("audioconvert", None)]
+    for element in chain:
+        filter_bin.add(element)
+    for upstream, downstream in zip(chain, chain[1:]):
+        upstream.link(downstream)
+
+    filter_bin.add_pad(Gst.GhostPad.new("sink", chain[0].get_static_pad("sink")))
+    filter_bin.add_pad(Gst.GhostPad.new("src", chain[-1].get_static_pad("src")))
+    return filter_bin
+
+
+def configure_sink_element(element, output_settings):
+    """Apply ring buffer sizes to an audio sink (no-op for elements without them)"""
+    if element.find_property("buffer-time") is None or element.find_property("latency-time") is None:
+        return False
+
+    # Let the sink post QOS messages so dropped buffers show up in the stats
+    if element.find_property("qos") is not None:
+        element.set_property("qos", True)
+
+    # Both properties are in microseconds
+    buffer_time = int(output_settings.get("buffer_time_ms", 200)) * 1000
+    latency_time = int(output_settings.get("latency_time_ms", 10)) * 1000
+    latency_time = max(1000, min(latency_time, buffer_time))
+    element.set_property("buffer-time", buffer_time)
+    element.set_property("latency-time", latency_time)
+    return True
+
+
+def apply_playbin_flags(player, output_settings):
+    """Enable or disable bit-perfect passthrough on a playbin"""
+    flags = player.get_property("flags")
+    if output_settings.get("passthrough", False):
+        # No software volume and no audioconvert/audioresample in front of the sink
+        flags &= ~PLAY_FLAG_SOFT_VOLUME
+        flags |= PLAY_FLAG_NATIVE_AUDIO
+    else:
+        flags |= PLAY_FLAG_SOFT_VOLUME
+        flags &= ~PLAY_FLAG_NATIVE_AUDIO
+    player.set_property("flags", flags)
+
+
+def renice_streaming_threads(pipeline, niceness=10):
+    """Run a background pipeline's streaming threads at a lower CPU priority"""
+    def on_sync_message(bus, message):
+        if message.type == Gst.MessageType.STREAM_STATUS:
+            status_type, owner = message.parse_stream_status()
+            if status_type == Gst.StreamStatusType.ENTER:
+                # Posted from inside the new streaming thread itself
+                try:
+                    os.setpriority(os.PRIO_PROCESS, threading.get_native_id(), niceness)
+                except (OSError, AttributeError):
+                    pass
+        return Gst.BusSyncReply.PASS
+
+    pipeline.get_bus().set_sync_handler(on_sync_message)
+
+
+class AudioOutputStats:
+    """Collects underrun and latency statistics for the active audio sink"""
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.buffers = 0
+        self.underruns = 0
+        self.qos_messages = 0
+        self.dropped = 0
+        self.min_headroom_ms = None
+        self.headroom_total_ms = 0.0
+        self.pipeline_latency_ms = 0.0
+        self.segment = None
+
+    def attach(self, sink):
+        """Install a probe on the sink pad measuring how early buffers arrive"""
+        pad = sink.get_static_pad("sink")
+        if pad is None:
+            return
+        pad.add_probe(Gst.PadProbeType.BUFFER | Gst.PadProbeType.EVENT_DOWNSTREAM,
+                      self._on_sink_probe, sink)
+
+    def _on_sink_probe(self, pad, info, sink):
+        if info.type & Gst.PadProbeType.EVENT_DOWNSTREAM:
+            event = info.get_event()
+            if event.type == Gst.EventType.SEGMENT:
+                self.segment = event.parse_segment()
+            elif event.type == Gst.EventType.FLUSH_STOP:
+                self.segment = None
+            return Gst.PadProbeReturn.OK
+
+        buffer = info.get_buffer()
+        clock = sink.get_clock()
+        if self.segment is None or clock is None or buffer.pts == Gst.CLOCK_TIME_NONE:
+            return Gst.PadProbeReturn.OK
+
+        running_time = self.segment.to_running_time(Gst.Format.TIME, buffer.pts)
+        if running_time == Gst.CLOCK_TIME_NONE:
+            return Gst.PadProbeReturn.OK
+
+        # Time left before the buffer is due; negative means it arrived too late
+        now = clock.get_time() - sink.get_base_time()
+        headroom_ms = (running_time - now) / Gst.MSECOND
+
+        self.buffers += 1
+        self.headroom_total_ms += headroom_ms
+        if headroom_ms < 0:
+            self.underruns += 1
+        if self.min_headroom_ms is None or headroom_ms < self.min_headroom_ms:
+            self.min_headroom_ms = headroom_ms
+        return Gst.PadProbeReturn.OK
+
+    def handle_message(self, message):
+        """Update counters from bus messages; returns True if the message was used"""
+        if message.type == Gst.MessageType.QOS:
+            self.qos_messages += 1
+            fmt, processed, dropped = message.parse_qos_stats()
+            if fmt == Gst.Format.BUFFERS or fmt == Gst.Format.DEFAULT:
+                self.dropped = max(self.dropped, dropped)
+            return True
+        return False
+
+    def update_latency(self, player):
+        query = Gst.Query.new_latency()
+        if player.query(query):
+            live, min_latency, max_latency = query.parse_latency()
+            self.pipeline_latency_ms = min_latency / Gst.MSECOND
+
+    def summary(self, output_settings):
+        avg_headroom = self.headroom_total_ms / self.buffers if self.buffers else 0.0
+        min_headroom = self.min_headroom_ms if self.min_headroom_ms is not None else 0.0
+        return (
+            f"Sink: {output_settings.get('sink', 'auto')}  "
+            f"buffer {output_settings.get('buffer_time_ms')} ms / "
+            f"latency {output_settings.get('latency_time_ms')} ms\n"
+            f"Pipeline latency: {self.pipeline_latency_ms:.1f} ms\n"
+            f"Buffers: {self.buffers}  underruns: {self.underruns}  "
+            f"dropped (QoS): {self.dropped}\n"
+            f"Headroom: min {min_headroom:.1f} ms, avg {avg_headroom:.1f} ms"
+        )
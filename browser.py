@@ -0,0 +1,168 @@
+import gi
+
+gi.require_version('Gtk', '3.0')
+gi.require_version('GdkPixbuf', '2.0')
+from gi.repository import Gtk, GLib, GObject, GdkPixbuf
+
+from thumbnails import THUMBNAIL_SIZE
+
+
+# Album store columns
+COL_PIXBUF, COL_MARKUP, COL_ARTIST, COL_ALBUM, COL_ARTWORK_HASH, COL_ARTWORK_PATH = range(6)
+
+# Tiles just outside the viewport are loaded too, so scrolling a little shows no gaps
+PRELOAD_TILES = 12
+
+
+def placeholder_pixbuf(size=THUMBNAIL_SIZE):
+    pixbuf = GdkPixbuf.Pixbuf.new(GdkPixbuf.Colorspace.RGB, True, 8, size, size)
+    pixbuf.fill(0x7F7F7F7F)
+    return pixbuf
+
+
+class LibraryBrowser(Gtk.Paned):
+    """Artist list next to a grid of that artist's albums
+
+    Artists and albums come from the library's album index, so switching artists
+    is one indexed query over albums rather than a pass over every track. Album
+    art is only loaded for tiles in (or near) view.
+    """
+
+    __gsignals__ = {
+        'play-tracks': (GObject.SignalFlags.RUN_FIRST, None, (object,)),
+    }
+
+    def __init__(self, library, thumbnails):
+        Gtk.Paned.__init__(self, orientation=Gtk.Orientation.HORIZONTAL)
+        self.library = library
+        self.thumbnails = thumbnails
+        self.placeholder = placeholder_pixbuf(thumbnails.size)
+        self.current_artist = None
+        self.dirty = True
+        self.thumbnail_idle_id = None
+
+        # Artists
+        self.artist_store = Gtk.ListStore(str, str)
+        self.artist_view = Gtk.TreeView(model=self.artist_store)
+        self.artist_view.set_headers_visible(False)
+        self.artist_view.set_enable_search(True)
+        self.artist_view.set_search_column(0)
+        self.artist_view.set_fixed_height_mode(True)
+        column = Gtk.TreeViewColumn("Artist", Gtk.CellRendererText(), markup=1)
+        column.set_sizing(Gtk.TreeViewColumnSizing.FIXED)
+        self.artist_view.append_column(column)
+        self.artist_view.get_selection().connect("changed", self.on_artist_changed)
+        self.artist_view.connect("row-activated", self.on_artist_activated)
+
+        artist_scroll = Gtk.ScrolledWindow()
+        artist_scroll.set_policy(Gtk.PolicyType.NEVER, Gtk.PolicyType.AUTOMATIC)
+        artist_scroll.set_size_request(220, -1)
+        artist_scroll.add(self.artist_view)
+        self.pack1(artist_scroll, False, False)
+
+        # Albums
+        self.album_store = Gtk.ListStore(GdkPixbuf.Pixbuf, str, str, str, str, str)
+        self.album_view = Gtk.IconView(model=self.album_store)
+        self.album_view.set_pixbuf_column(COL_PIXBUF)
+        self.album_view.set_markup_column(COL_MARKUP)
+        self.album_view.set_item_width(thumbnails.size + 12)
+        self.album_view.set_activate_on_single_click(False)
+        self.album_view.connect("item-activated", self.on_album_activated)
+
+        self.album_scroll = Gtk.ScrolledWindow()
+        self.album_scroll.set_policy(Gtk.PolicyType.NEVER, Gtk.PolicyType.AUTOMATIC)
+        self.album_scroll.add(self.album_view)
+        self.album_scroll.get_vadjustment().connect("value-changed", lambda adjustment: self.queue_thumbnails())
+        self.album_view.connect("size-allocate", lambda widget, allocation: self.queue_thumbnails())
+        self.pack2(self.album_scroll, True, False)
+
+        self.connect("map", lambda widget: self.refresh() if self.dirty else None)
+
+    def invalidate(self):
+        """The library changed; reload now if visible, otherwise when next shown"""
+        self.dirty = True
+        if self.get_mapped():
+            self.refresh()
+
+    def refresh(self):
+        self.dirty = False
+        selected = self.current_artist
+
+        # Detached while filling, the view doesn't re-layout on every row
+        self.artist_view.set_model(None)
+        self.artist_store.clear()
+        selected_index = 0
+        for index, (artist, album_count, track_count) in enumerate(self.library.artists()):
+            if artist == selected:
+                selected_index = index
+            self.artist_store.append([
+                artist,
+                f"{GLib.markup_escape_text(artist or 'Unknown')}\n"
+                f"<small>{album_count} albums, {track_count} tracks</small>"
+            ])
+        self.artist_view.set_model(self.artist_store)
+
+        if len(self.artist_store) > 0:
+            path = Gtk.TreePath.new_from_indices([selected_index])
+            self.artist_view.get_selection().select_path(path)
+            self.artist_view.scroll_to_cell(path, None, False, 0, 0)
+        else:
+            self.current_artist = None
+            self.album_store.clear()
+
+    def on_artist_changed(self, selection):
+        model, treeiter = selection.get_selected()
+        if treeiter is not None:
+            self.show_albums(model[treeiter][0])
+
+    def show_albums(self, artist):
+        self.current_artist = artist
+        self.album_view.set_model(None)
+        self.album_store.clear()
+        for artist_name, album, year, track_count, artwork_path, artwork_hash in self.library.albums(artist):
+            title = GLib.markup_escape_text(album or "Unknown")
+            details = f"{year}, {track_count} tracks" if year else f"{track_count} tracks"
+            pixbuf = self.thumbnails.cached(artwork_hash) if artwork_hash else None
+            self.album_store.append([
+                pixbuf or self.placeholder, f"{title}\n<small>{details}</small>",
+                artist_name, album, artwork_hash, artwork_path
+            ])
+        self.album_view.set_model(self.album_store)
+        self.album_scroll.get_vadjustment().set_value(0)
+        self.queue_thumbnails()
+
+    def queue_thumbnails(self):
+        # Scrolling fires many times per frame; look at the viewport once it settles
+        if self.thumbnail_idle_id is None:
+            self.thumbnail_idle_id = GLib.idle_add(self.request_visible_thumbnails)
+
+    def request_visible_thumbnails(self):
+        self.thumbnail_idle_id = None
+        visible = self.album_view.get_visible_range()
+        if not visible:
+            return False
+        start, end = visible[-2:]
+        first = max(0, start.get_indices()[0] - PRELOAD_TILES)
+        last = min(len(self.album_store) - 1, end.get_indices()[0] + PRELOAD_TILES)
+
+        items = []
+        for index in range(first, last + 1):
+            row = self.album_store[index]
+            if row[COL_ARTWORK_HASH] and row[COL_PIXBUF] is self.placeholder:
+                items.append((row[COL_ARTWORK_HASH], row[COL_ARTWORK_PATH]))
+        if items:
+            self.thumbnails.request(items, self.on_thumbnail_ready)
+        return False
+
+    def on_thumbnail_ready(self, key, pixbuf):
+        # The artist may have changed meanwhile, match rows by hash
+        for row in self.album_store:
+            if row[COL_ARTWORK_HASH] == key:
+                row[COL_PIXBUF] = pixbuf
+
+    def on_album_activated(self, iconview, path):
+        row = self.album_store[path]
+        self.emit('play-tracks', self.library.album_tracks(row[COL_ARTIST], row[COL_ALBUM]))
+
+    def on_artist_activated(self, treeview, path, column):
+        self.emit('play-tracks', self.library.artist_tracks(self.artist_store[path][0]))
@@ -0,0 +1,186 @@
+import math
+import inspect
+
+import gi
+
+gi.require_version('Gtk', '3.0')
+from gi.repository import Gtk, Gdk, Gio, GLib
+
+
+# (key name, modifiers) -> (command, *args)
+KEY_BINDINGS = {
+    ("space", 0): ("play_pause",),
+    ("Right", 0): ("seek", 5),
+    ("Left", 0): ("seek", -5),
+    ("Right", Gdk.ModifierType.CONTROL_MASK): ("skip", 1),
+    ("Left", Gdk.ModifierType.CONTROL_MASK): ("skip", -1),
+    ("Up", Gdk.ModifierType.CONTROL_MASK): ("volume", 5),
+    ("Down", Gdk.ModifierType.CONTROL_MASK): ("volume", -5),
+    ("m", Gdk.ModifierType.CONTROL_MASK): ("mute",),
+    ("s", Gdk.ModifierType.CONTROL_MASK | Gdk.ModifierType.SHIFT_MASK): ("stop",),
+    # Media keys as delivered to a focused window
+    ("AudioPlay", 0): ("play_pause",),
+    ("AudioPause", 0): ("pause",),
+    ("AudioStop", 0): ("stop",),
+    ("AudioNext", 0): ("skip", 1),
+    ("AudioPrev", 0): ("skip", -1),
+    ("AudioForward", 0): ("seek", 10),
+    ("AudioRewind", 0): ("seek", -10),
+    ("AudioRaiseVolume", 0): ("volume", 5),
+    ("AudioLowerVolume", 0): ("volume", -5),
+    ("AudioMute", 0): ("mute",),
+}
+
+# Keys reported by the GNOME settings daemon
+MEDIA_PLAYER_KEYS = {
+    "Play": ("play_pause",),
+    "Pause": ("pause",),
+    "Stop": ("stop",),
+    "Next": ("skip", 1),
+    "Previous": ("skip", -1),
+    "FastForward": ("seek", 10),
+    "Rewind": ("seek", -10),
+}
+
+BINDING_MODIFIERS = Gdk.ModifierType.CONTROL_MASK | Gdk.ModifierType.SHIFT_MASK | Gdk.ModifierType.MOD1_MASK
+
+
+class Command:
+    __slots__ = ("handler", "debounce_ms", "preview", "arg_type", "pending", "timeout_id", "arity")
+
+    def __init__(self, handler, debounce_ms, preview, arg_type):
+        self.handler = handler
+        self.debounce_ms = debounce_ms
+        self.preview = preview
+        self.arg_type = arg_type
+        self.pending = 0
+        self.timeout_id = None
+        # Optional parameters are for GTK callbacks (the clicked button), not for callers
+        self.arity = sum(1 for parameter in inspect.signature(handler).parameters.values()
+                         if parameter.default is inspect.Parameter.empty and
+                         parameter.kind in (inspect.Parameter.POSITIONAL_ONLY,
+                                            inspect.Parameter.POSITIONAL_OR_KEYWORD))
+
+    def accepts(self, args):
+        """Whether dispatching with args can reach the handler"""
+        if self.debounce_ms:
+            if len(args) > 1:
+                return False
+        elif len(args) != self.arity:
+            return False
+        # bool is an int too, and NaN or infinity would reach seeks and row indexes
+        allowed = (int,) if self.arg_type is int else (int, float)
+        return all(isinstance(arg, allowed) and not isinstance(arg, bool) and math.isfinite(arg)
+                   for arg in args)
+
+
+class CommandDispatcher:
+    """Named player commands shared by buttons, key bindings and media keys
+
+    A debounced command takes one number; repeats within debounce_ms are summed
+    and the handler runs once with the total (e.g. five quick "skip 1" become
+    one "skip 5"). preview(total) runs on every repeat for instant feedback.
+    Arguments are numbers, arg_type=int for commands that only take whole ones.
+    """
+
+    def __init__(self):
+        self.commands = {}
+
+    def register(self, name, handler, debounce_ms=0, preview=None, arg_type=float):
+        self.commands[name] = Command(handler, debounce_ms, preview, arg_type)
+
+    def accepts(self, name, args):
+        command = self.commands.get(name)
+        return command is not None and command.accepts(args)
+
+    def dispatch(self, name, *args):
+        command = self.commands.get(name)
+        if command is None:
+            print(f"Unknown command: {name}")
+            return False
+
+        if not command.debounce_ms:
+            command.handler(*args)
+            return True
+
+        command.pending += args[0] if args else 1
+        if command.preview is not None:
+            command.preview(command.pending)
+        if command.timeout_id is not None:
+            GLib.source_remove(command.timeout_id)
+        command.timeout_id = GLib.timeout_add(command.debounce_ms, self._flush, command)
+        return True
+
+    def _flush(self, command):
+        total = command.pending
+        command.pending = 0
+        command.timeout_id = None
+        if total:
+            command.handler(total)
+        return False
+
+    def handle_key(self, widget, event):
+        """key-press-event handler for the main window, connected after the default one
+
+        Only sees the keys the focused widget didn't use.
+        """
+        # Typing in an entry must not trigger playback commands
+        focus = widget.get_focus() if isinstance(widget, Gtk.Window) else None
+        if isinstance(focus, Gtk.Editable):
+            return False
+
+        # Media keys are named XF86AudioPlay etc.
+        name = (Gdk.keyval_name(Gdk.keyval_to_lower(event.keyval)) or "").replace("XF86", "", 1)
+        binding = KEY_BINDINGS.get((name, event.state & BINDING_MODIFIERS))
+        if binding is None:
+            return False
+        return self.dispatch(*binding)
+
+
+class MediaKeys:
+    """Receives media keys from gnome-settings-daemon over D-Bus, when it is running"""
+
+    def __init__(self, dispatcher, app_name="ubuntu-music-player"):
+        self.dispatcher = dispatcher
+        self.app_name = app_name
+        self.proxy = None
+        Gio.DBusProxy.new_for_bus(
+            Gio.BusType.SESSION, Gio.DBusProxyFlags.DO_NOT_AUTO_START, None,
+            "org.gnome.SettingsDaemon.MediaKeys", "/org/gnome/SettingsDaemon/MediaKeys",
+            "org.gnome.SettingsDaemon.MediaKeys", None, self._on_proxy_ready)
+
+    def _on_proxy_ready(self, source, result):
+        try:
+            self.proxy = Gio.DBusProxy.new_for_bus_finish(result)
+        except GLib.Error as e:
+            print(f"Media keys unavailable: {e.message}")
+            return
+        self.proxy.connect("g-signal", self._on_signal)
+        self.grab()
+
+    def grab(self):
+        """(Re)claim the keys, e.g. when our window gets focus"""
+        if self.proxy is None or self.proxy.get_name_owner() is None:
+            return
+        self.proxy.call("GrabMediaPlayerKeys", GLib.Variant("(su)", (self.app_name, 0)),
+                        Gio.DBusCallFlags.NONE, -1, None, self._on_call_done)
+
+    def release(self):
+        if self.proxy is None or self.proxy.get_name_owner() is None:
+            return
+        self.proxy.call("ReleaseMediaPlayerKeys", GLib.Variant("(s)", (self.app_name,)),
+                        Gio.DBusCallFlags.NONE, -1, None, self._on_call_done)
+
+    def _on_call_done(self, proxy, result):
+        try:
+            proxy.call_finish(result)
+        except GLib.Error as e:
+            print(f"Media keys call failed: {e.message}")
+
+    def _on_signal(self, proxy, sender, signal, parameters):
+        if signal != "MediaPlayerKeyPressed":
+            return
+        app_name, key = parameters.unpack()
+        binding = MEDIA_PLAYER_KEYS.get(key)
+        if app_name == self.app_name and binding is not None:
+            self.dispatcher.dispatch(*binding)
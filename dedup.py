@@ -0,0 +1,382 @@
+import os
+import base64
+import sqlite3
+import hashlib
+import threading
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+import gi
+
+gi.require_version('Gst', '1.0')
+from gi.repository import Gst, GLib
+
+from settings import get_config_directory
+
+
+# Bytes hashed from the start and from the end of a file
+PARTIAL_HASH_BLOCK = 64 * 1024
+
+# Tracks whose durations differ by more than this are never compared
+DURATION_BUCKET_MS = 2000
+
+# Cache rows are gathered for this long and written in one transaction
+CACHE_FLUSH_DELAY_MS = 1000
+
+UPSERT_HASH = """
+    INSERT INTO hashes (path, size, mtime_ns, partial_hash, fingerprint) VALUES (?, ?, ?, ?, ?)
+    ON CONFLICT(path) DO UPDATE SET
+        partial_hash = CASE WHEN size = excluded.size AND mtime_ns = excluded.mtime_ns
+                       THEN COALESCE(excluded.partial_hash, partial_hash) ELSE excluded.partial_hash END,
+        fingerprint = CASE WHEN size = excluded.size AND mtime_ns = excluded.mtime_ns
+                      THEN COALESCE(excluded.fingerprint, fingerprint) ELSE excluded.fingerprint END,
+        size = excluded.size,
+        mtime_ns = excluded.mtime_ns
+"""
+
+
+def partial_hash(path, size):
+    """Hash of the file size plus its first and last blocks"""
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(size.to_bytes(8, 'little'))
+    with open(path, 'rb') as f:
+        digest.update(f.read(PARTIAL_HASH_BLOCK))
+        if size > 2 * PARTIAL_HASH_BLOCK:
+            f.seek(-PARTIAL_HASH_BLOCK, os.SEEK_END)
+            digest.update(f.read(PARTIAL_HASH_BLOCK))
+    return digest.hexdigest()
+
+
+def decode_fingerprint(fingerprint):
+    """Decode a compressed Chromaprint fingerprint string into its 32-bit values"""
+    data = base64.urlsafe_b64decode(fingerprint + "=" * (-len(fingerprint) % 4))
+    if len(data) < 4:
+        return []
+    length = int.from_bytes(data[1:4], 'big')
+
+    # Bit positions are packed as 3-bit values, one 0 terminates each item
+    values = []
+    zeros = 0
+    bit_offset = 32
+    total_bits = len(data) * 8
+    while zeros < length and bit_offset + 3 <= total_bits:
+        byte_index, shift = divmod(bit_offset, 8)
+        chunk = data[byte_index] | ((data[byte_index + 1] << 8) if byte_index + 1 < len(data) else 0)
+        value = (chunk >> shift) & 0x7
+        values.append(value)
+        if value == 0:
+            zeros += 1
+        bit_offset += 3
+
+    # Values of 7 continue in a 5-bit exception stream starting at the next byte
+    bit_offset = ((bit_offset + 7) // 8) * 8
+    for i, value in enumerate(values):
+        if value == 7 and bit_offset + 5 <= total_bits:
+            byte_index, shift = divmod(bit_offset, 8)
+            chunk = data[byte_index] | ((data[byte_index + 1] << 8) if byte_index + 1 < len(data) else 0)
+            values[i] = 7 + ((chunk >> shift) & 0x1F)
+            bit_offset += 5
+
+    result = []
+    value = 0
+    last_bit = 0
+    for bit in values:
+        if bit == 0:
+            result.append(value ^ result[-1] if result else value)
+            value = 0
+            last_bit = 0
+        else:
+            last_bit += bit
+            value |= 1 << (last_bit - 1)
+    return result
+
+
+def fingerprint_similarity(a, b):
+    """Fraction of equal bits over the overlapping part of two fingerprints"""
+    length = min(len(a), len(b))
+    if length == 0:
+        return 0.0
+    differing = sum(bin(x ^ y).count("1") for x, y in zip(a[:length], b[:length]))
+    return 1.0 - differing / (32.0 * length)
+
+
+class DedupCache:
+    """Partial hashes and fingerprints cached by path, size and mtime
+
+    Writes are queued and flushed together from a GLib timeout, so scanning a
+    folder or a burst of fingerprints costs one commit instead of one per file.
+    """
+
+    def __init__(self, path=None):
+        self.path = path or os.path.join(get_config_directory(), "dedup.db")
+        self.lock = threading.Lock()
+        self.pending = {}       # path -> [size, mtime_ns, partial, fingerprint]
+        self.flush_id = None
+        self.conn = sqlite3.connect(self.path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS hashes (
+                path TEXT PRIMARY KEY,
+                size INTEGER,
+                mtime_ns INTEGER,
+                partial_hash TEXT,
+                fingerprint TEXT
+            )
+        """)
+        self.conn.commit()
+
+    def get(self, path, size, mtime_ns):
+        with self.lock:
+            row = self.pending.get(path)
+            if row is not None and row[0] == size and row[1] == mtime_ns:
+                return row[2], row[3]
+            row = self.conn.execute(
+                "SELECT partial_hash, fingerprint FROM hashes WHERE path = ? AND size = ? AND mtime_ns = ?",
+                (path, size, mtime_ns)).fetchone()
+        return row if row else (None, None)
+
+    def put(self, path, size, mtime_ns, partial=None, fingerprint=None):
+        """Queue a row for the next flush"""
+        with self.lock:
+            row = self.pending.get(path)
+            if row is not None and row[0] == size and row[1] == mtime_ns:
+                row[2] = partial or row[2]
+                row[3] = fingerprint or row[3]
+            else:
+                self.pending[path] = [size, mtime_ns, partial, fingerprint]
+            if self.flush_id is None:
+                self.flush_id = GLib.timeout_add(CACHE_FLUSH_DELAY_MS, self._on_flush_timeout)
+
+    def _on_flush_timeout(self):
+        with self.lock:
+            self.flush_id = None
+        self.flush()
+        return False
+
+    def flush(self):
+        with self.lock:
+            rows = [(path, *row) for path, row in self.pending.items()]
+            self.pending.clear()
+            if not rows:
+                return
+            try:
+                with self.conn:
+                    self.conn.executemany(UPSERT_HASH, rows)
+            except sqlite3.Error as e:
+                print(f"Error writing the dedup cache: {e}")
+
+    def close(self):
+        with self.lock:
+            if self.flush_id is not None:
+                GLib.source_remove(self.flush_id)
+                self.flush_id = None
+        self.flush()
+        self.conn.close()
+
+
+class _Entry:
+    __slots__ = ("path", "dev", "ino", "size", "mtime_ns", "partial", "fingerprint", "duration_ms")
+
+    def __init__(self, path, duration_ms=0):
+        self.path = path
+        self.dev = self.ino = self.size = self.mtime_ns = None
+        self.partial = None
+        self.fingerprint = None
+        self.duration_ms = duration_ms
+
+
+class DedupIndex:
+    """Finds duplicate tracks: same path/inode at add time, same content or recording later"""
+
+    def __init__(self, cache=None):
+        self.cache = cache or DedupCache()
+        self.entries = {}                   # real path -> _Entry
+        self.inodes = {}                    # (dev, ino) -> real path
+        self.by_size = defaultdict(set)     # size -> real paths
+
+    def find_same_file(self, path):
+        """Return the queued path that is the same file as path, or None"""
+        real = os.path.realpath(path)
+        entry = self.entries.get(real)
+        if entry is not None:
+            return entry.path
+        try:
+            st = os.stat(real)
+        except OSError:
+            return None
+        other = self.inodes.get((st.st_dev, st.st_ino))
+        return self.entries[other].path if other else None
+
+    def add(self, path, duration_ms=0, stat=True):
+        """Register a queued file; size collisions get their partial hash right away"""
+        real = os.path.realpath(path)
+        entry = _Entry(path, duration_ms)
+        self.entries[real] = entry
+        if stat:
+            self._stat(real, entry)
+
+    def remove(self, path):
+        real = os.path.realpath(path)
+        entry = self.entries.pop(real, None)
+        if entry is None or entry.size is None:
+            return
+        self.inodes.pop((entry.dev, entry.ino), None)
+        self.by_size[entry.size].discard(real)
+
+    def clear(self):
+        self.entries.clear()
+        self.inodes.clear()
+        self.by_size.clear()
+
+    def _stat(self, real, entry):
+        try:
+            st = os.stat(real)
+        except OSError:
+            return False
+        entry.dev, entry.ino, entry.size, entry.mtime_ns = st.st_dev, st.st_ino, st.st_size, st.st_mtime_ns
+        self.inodes[(entry.dev, entry.ino)] = real
+        entry.partial, entry.fingerprint = self.cache.get(real, entry.size, entry.mtime_ns)
+
+        # Only files sharing a size ever need their content hashed
+        same_size = self.by_size[entry.size]
+        same_size.add(real)
+        if len(same_size) > 1:
+            for other in same_size:
+                self._ensure_partial(other)
+        return True
+
+    def _ensure_partial(self, real):
+        entry = self.entries[real]
+        if entry.partial is None:
+            try:
+                entry.partial = partial_hash(real, entry.size)
+            except OSError as e:
+                print(f"Error hashing {real}: {e}")
+                return
+            self.cache.put(real, entry.size, entry.mtime_ns, partial=entry.partial)
+
+    def set_fingerprint(self, path, fingerprint):
+        entry = self.entries.get(os.path.realpath(path))
+        if entry is not None and entry.size is not None:
+            entry.fingerprint = fingerprint
+            self.cache.put(os.path.realpath(path), entry.size, entry.mtime_ns, fingerprint=fingerprint)
+
+    def pending_fingerprints(self):
+        return [entry.path for entry in self.entries.values() if entry.fingerprint is None]
+
+    def stat_pending(self):
+        """Stat entries restored without file information (e.g. from the session)"""
+        for real, entry in list(self.entries.items()):
+            if entry.size is None:
+                self._stat(real, entry)
+
+    def content_groups(self):
+        """Groups of queued paths with identical size and partial hash"""
+        groups = defaultdict(list)
+        for size, reals in self.by_size.items():
+            if len(reals) < 2:
+                continue
+            for real in reals:
+                entry = self.entries[real]
+                if entry.partial is not None:
+                    groups[(size, entry.partial)].append(entry.path)
+        return [sorted(paths) for paths in groups.values() if len(paths) > 1]
+
+    def recording_groups(self, threshold=0.85):
+        """Groups of paths whose fingerprints match, compared only within a duration bucket"""
+        buckets = defaultdict(list)
+        for entry in self.entries.values():
+            if entry.fingerprint and entry.duration_ms:
+                buckets[entry.duration_ms // DURATION_BUCKET_MS].append(entry)
+
+        parent = {}
+
+        def find(path):
+            while parent.get(path, path) != path:
+                path = parent[path]
+            return path
+
+        decoded = {}
+        for key, entries in buckets.items():
+            # Neighbouring bucket catches durations straddling a boundary
+            candidates = entries + buckets.get(key + 1, [])
+            for i, a in enumerate(entries):
+                fp_a = decoded.setdefault(a.path, decode_fingerprint(a.fingerprint))
+                for b in candidates[i + 1:]:
+                    if abs(a.duration_ms - b.duration_ms) > DURATION_BUCKET_MS:
+                        continue
+                    fp_b = decoded.setdefault(b.path, decode_fingerprint(b.fingerprint))
+                    if fingerprint_similarity(fp_a, fp_b) >= threshold:
+                        parent[find(b.path)] = find(a.path)
+
+        groups = defaultdict(list)
+        for path in parent:
+            groups[find(path)].append(path)
+        for root, paths in groups.items():
+            if root not in paths:
+                paths.append(root)
+        return [sorted(paths) for paths in groups.values() if len(paths) > 1]
+
+
+def chromaprint_available():
+    return Gst.ElementFactory.find("chromaprint") is not None
+
+
+def compute_fingerprint(path, timeout_seconds=120):
+    """Decode a file through the chromaprint element and return its fingerprint string"""
+    pipeline = Gst.parse_launch(
+        "uridecodebin name=source ! audioconvert ! chromaprint name=chromaprint ! fakesink sync=false")
+    pipeline.get_by_name("source").set_property("uri", GLib.filename_to_uri(path))
+    bus = pipeline.get_bus()
+    fingerprint = None
+    try:
+        pipeline.set_state(Gst.State.PLAYING)
+        while True:
+            message = bus.timed_pop_filtered(
+                timeout_seconds * Gst.SECOND,
+                Gst.MessageType.TAG | Gst.MessageType.EOS | Gst.MessageType.ERROR)
+            if message is None:
+                print(f"Fingerprinting timed out for {path}")
+                break
+            if message.type == Gst.MessageType.TAG:
+                success, value = message.parse_tag().get_string("chromaprint-fingerprint")
+                if success:
+                    fingerprint = value
+            elif message.type == Gst.MessageType.ERROR:
+                err, debug = message.parse_error()
+                print(f"Error fingerprinting {path}: {err}")
+                break
+            else:
+                break
+    finally:
+        pipeline.set_state(Gst.State.NULL)
+    return fingerprint
+
+
+class FingerprintWorker:
+    """Computes fingerprints in a background pool and reports them on the GLib main loop"""
+
+    def __init__(self, workers=2):
+        self.executor = ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="fingerprint")
+        self.queued = set()
+
+    def submit(self, path, callback):
+        if path in self.queued:
+            return
+        self.queued.add(path)
+        future = self.executor.submit(compute_fingerprint, path)
+        future.add_done_callback(lambda f: GLib.idle_add(self._done, path, f, callback))
+
+    def _done(self, path, future, callback):
+        self.queued.discard(path)
+        try:
+            fingerprint = future.result()
+        except Exception as e:
+            print(f"Error fingerprinting {path}: {e}")
+            fingerprint = None
+        if fingerprint:
+            callback(path, fingerprint)
+        return False
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,135 @@
+import time
+
+import gi
+
+gi.require_version('Gst', '1.0')
+from gi.repository import Gst
+
+
+# Centre frequencies of the graphic equalizer bands
+BAND_FREQUENCIES = (31, 62, 125, 250, 500, 1000, 2000, 4000, 8000, 16000)
+
+# Gains in dB per band; the compressor and balance are part of a preset too
+BUILTIN_PRESETS = {
+    "Flat": {"bands": [0.0] * 10, "compressor": False, "balance": 0.0},
+    "Bass Boost": {"bands": [6.0, 5.0, 4.0, 2.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0], "compressor": False, "balance": 0.0},
+    "Treble Boost": {"bands": [0.0, 0.0, 0.0, 0.0, 0.0, 1.0, 2.0, 4.0, 5.0, 6.0], "compressor": False, "balance": 0.0},
+    "Vocal": {"bands": [-2.0, -2.0, -1.0, 1.0, 3.0, 3.0, 2.0, 1.0, 0.0, -1.0], "compressor": False, "balance": 0.0},
+    "Loudness": {"bands": [5.0, 4.0, 1.0, 0.0, -1.0, 0.0, 0.0, 1.0, 4.0, 5.0], "compressor": True, "balance": 0.0},
+    "Night": {"bands": [0.0] * 10, "compressor": True, "balance": 0.0},
+}
+
+
+def all_presets(dsp_settings):
+    presets = dict(BUILTIN_PRESETS)
+    presets.update(dsp_settings.get("presets", {}))
+    return presets
+
+
+class DSPChain:
+    """Equalizer, compressor and balance elements for playbin's audio-filter bin
+
+    Presets only change properties of the live elements, so switching one never
+    rebuilds the pipeline.
+    """
+
+    def __init__(self):
+        self.equalizer = Gst.ElementFactory.make("equalizer-nbands", "dsp-equalizer")
+        self.compressor = Gst.ElementFactory.make("audiodynamic", "dsp-compressor")
+        self.balance = Gst.ElementFactory.make("audiopanorama", "dsp-balance")
+        self.preset_name = None
+
+        if self.equalizer is not None:
+            self.equalizer.set_property("num-bands", len(BAND_FREQUENCIES))
+            for i, frequency in enumerate(BAND_FREQUENCIES):
+                band = self.equalizer.get_child_by_index(i)
+                band.set_property("freq", float(frequency))
+                # One octave wide bands
+                band.set_property("bandwidth", frequency * 0.7)
+                band.set_property("gain", 0.0)
+
+        if self.compressor is not None:
+            Gst.util_set_object_arg(self.compressor, "mode", "compressor")
+            Gst.util_set_object_arg(self.compressor, "characteristics", "soft-knee")
+            self.compressor.set_property("threshold", 0.5)
+
+        self.reset_stats()
+        self.set_compressor(False)
+        self.set_balance(0.0)
+
+    def elements(self):
+        return [element for element in (self.equalizer, self.compressor, self.balance) if element is not None]
+
+    def apply_preset(self, preset, name=None):
+        """Switch to a preset by setting properties on the running elements"""
+        self.preset_name = name
+        for i, gain in enumerate(preset.get("bands", [])[:len(BAND_FREQUENCIES)]):
+            self.set_band_gain(i, gain)
+        self.set_compressor(preset.get("compressor", False))
+        self.set_balance(preset.get("balance", 0.0))
+
+    def set_band_gain(self, index, gain):
+        if self.equalizer is not None:
+            self.equalizer.get_child_by_index(index).set_property("gain", max(-24.0, min(12.0, float(gain))))
+
+    def band_gains(self):
+        if self.equalizer is None:
+            return [0.0] * len(BAND_FREQUENCIES)
+        return [self.equalizer.get_child_by_index(i).get_property("gain") for i in range(len(BAND_FREQUENCIES))]
+
+    def set_compressor(self, enabled):
+        self.compressor_enabled = enabled
+        if self.compressor is not None:
+            # A ratio of 1 leaves the signal untouched, the element stays in place
+            self.compressor.set_property("ratio", 0.5 if enabled else 1.0)
+
+    def set_balance(self, balance):
+        self.balance_value = max(-1.0, min(1.0, float(balance)))
+        if self.balance is not None:
+            self.balance.set_property("panorama", self.balance_value)
+
+    def current_preset(self):
+        return {"bands": self.band_gains(), "compressor": self.compressor_enabled, "balance": self.balance_value}
+
+    def reset_stats(self):
+        self.buffers = 0
+        self.processing_ns = 0
+        self.audio_ns = 0
+        self.max_ns = 0
+        self.entered = {}
+
+    def attach_probes(self):
+        """Time each buffer from the first element's sink pad to the last element's src pad"""
+        elements = self.elements()
+        if not elements:
+            return
+        elements[0].get_static_pad("sink").add_probe(Gst.PadProbeType.BUFFER, self._on_enter)
+        elements[-1].get_static_pad("src").add_probe(Gst.PadProbeType.BUFFER, self._on_leave)
+
+    def _on_enter(self, pad, info):
+        # The chain has no queues, so a buffer leaves on the thread it entered
+        if len(self.entered) > 64:
+            self.entered.clear()  # buffers dropped by a flush never leave
+        self.entered[info.get_buffer().pts] = time.perf_counter_ns()
+        return Gst.PadProbeReturn.OK
+
+    def _on_leave(self, pad, info):
+        buffer = info.get_buffer()
+        started = self.entered.pop(buffer.pts, None)
+        if started is None:
+            return Gst.PadProbeReturn.OK
+        elapsed = time.perf_counter_ns() - started
+        self.buffers += 1
+        self.processing_ns += elapsed
+        self.max_ns = max(self.max_ns, elapsed)
+        if buffer.duration != Gst.CLOCK_TIME_NONE:
+            self.audio_ns += buffer.duration
+        return Gst.PadProbeReturn.OK
+
+    def summary(self):
+        if not self.buffers:
+            return "DSP cost: no buffers processed yet"
+        average_us = self.processing_ns / self.buffers / 1000
+        load = self.processing_ns / self.audio_ns * 100 if self.audio_ns else 0.0
+        return (f"DSP cost: avg {average_us:.0f} µs, max {self.max_ns / 1000:.0f} µs per buffer "
+                f"({self.buffers} buffers, {load:.2f}% of real time)")
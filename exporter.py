@@ -0,0 +1,192 @@
+import os
+import re
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import gi
+
+gi.require_version('Gst', '1.0')
+from gi.repository import Gst
+
+from audio_output import renice_streaming_threads
+from metadata import read_metadata
+from tag_writer import apply_tags
+
+
+# Encoder part of the pipeline and file extension per export format
+EXPORT_FORMATS = {
+    "mp3": ("lamemp3enc target=quality quality=2 ! xingmux", ".mp3"),
+    "opus": ("opusenc bitrate=128000 ! oggmux", ".opus"),
+}
+
+
+def default_workers():
+    # Leave one core for playback and the UI
+    return max(1, (os.cpu_count() or 2) - 1)
+
+
+def output_names(paths, extension):
+    """Map each source path to a unique output file name with the new extension"""
+    names = {}
+    used = set()
+    for path in paths:
+        base = re.sub(r'[\\/:*?"<>|]', "_", os.path.splitext(os.path.basename(path))[0])
+        name = base + extension
+        counter = 2
+        while name.lower() in used:
+            name = f"{base} ({counter}){extension}"
+            counter += 1
+        used.add(name.lower())
+        names[path] = name
+    return names
+
+
+def is_up_to_date(source, target):
+    try:
+        target_stat = os.stat(target)
+        return target_stat.st_size > 0 and target_stat.st_mtime >= os.stat(source).st_mtime
+    except OSError:
+        return False
+
+
+def copy_tags(source, target):
+    """Copy the common tags and artwork of source onto the exported file"""
+    record = read_metadata(source)
+    changes = {
+        "title": record.title,
+        "artist": record.artist,
+        "album": record.album,
+        "genre": record.genre,
+        "track_no": record.track_no,
+    }
+    if record.date:
+        changes["year"] = record.date
+    if record.artwork:
+        changes["artwork"] = record.artwork
+    apply_tags(target, {field: value for field, value in changes.items() if value})
+
+
+class ExportJob:
+    """Progress of one file being transcoded"""
+    __slots__ = ("position", "duration")
+
+    def __init__(self):
+        self.position = 0
+        self.duration = 0
+
+
+class Exporter:
+    """Transcodes files in parallel pipelines; poll snapshot() for progress"""
+
+    def __init__(self, paths, destination, export_format="mp3", workers=None):
+        self.paths = [path for path in dict.fromkeys(paths) if os.path.isfile(path)]
+        self.destination = destination
+        self.encoder, self.extension = EXPORT_FORMATS[export_format]
+        self.workers = workers or default_workers()
+        self.names = output_names(self.paths, self.extension)
+        self.lock = threading.Lock()
+        self.jobs = {}
+        self.done = 0
+        self.skipped = 0
+        self.failed = []
+        self.transcoded_ns = 0
+        self.cancelled = False
+        self.started = None
+        self.executor = None
+
+    def start(self):
+        os.makedirs(self.destination, exist_ok=True)
+        self.started = time.monotonic()
+        self.executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="export")
+        for path in self.paths:
+            self.executor.submit(self._export, path)
+        self.executor.shutdown(wait=False)
+
+    def cancel(self):
+        self.cancelled = True
+        if self.executor is not None:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+
+    def finished(self):
+        with self.lock:
+            return self.cancelled or self.done + self.skipped + len(self.failed) == len(self.paths)
+
+    def snapshot(self):
+        """(fraction done, files done, skipped, failed, audio seconds per wall second)"""
+        with self.lock:
+            active = sum(job.position / job.duration for job in self.jobs.values() if job.duration > 0)
+            transcoded = self.transcoded_ns + sum(job.position for job in self.jobs.values())
+            completed = self.done + self.skipped + len(self.failed)
+            fraction = (completed + active) / len(self.paths) if self.paths else 1.0
+            elapsed = time.monotonic() - self.started if self.started else 0
+            speed = transcoded / Gst.SECOND / elapsed if elapsed > 0 else 0.0
+            return fraction, self.done, self.skipped, len(self.failed), speed
+
+    def _export(self, path):
+        if self.cancelled:
+            return
+        target = os.path.join(self.destination, self.names[path])
+        if is_up_to_date(path, target):
+            with self.lock:
+                self.skipped += 1
+            return
+
+        job = ExportJob()
+        with self.lock:
+            self.jobs[path] = job
+        # Encode under a temporary name so an interrupted export never looks up to date
+        tmp_target = target + ".part"
+        try:
+            self._transcode(path, tmp_target, job)
+            copy_tags(path, tmp_target)
+            os.replace(tmp_target, target)
+        except Exception as e:
+            print(f"Error exporting {path}: {e}")
+            try:
+                os.unlink(tmp_target)
+            except OSError:
+                pass
+            with self.lock:
+                del self.jobs[path]
+                self.failed.append(path)
+            return
+
+        with self.lock:
+            del self.jobs[path]
+            self.done += 1
+            self.transcoded_ns += job.duration or job.position
+
+    def _transcode(self, path, target, job):
+        pipeline = Gst.parse_launch(
+            f"filesrc name=source ! decodebin ! audioconvert ! audioresample ! {self.encoder} ! "
+            f"filesink name=sink")
+        pipeline.get_by_name("source").set_property("location", path)
+        pipeline.get_by_name("sink").set_property("location", target)
+        # Decoding at a lower priority keeps playback from being starved
+        renice_streaming_threads(pipeline)
+
+        bus = pipeline.get_bus()
+        try:
+            pipeline.set_state(Gst.State.PLAYING)
+            while True:
+                if self.cancelled:
+                    raise RuntimeError("export cancelled")
+                message = bus.timed_pop_filtered(
+                    500 * Gst.MSECOND, Gst.MessageType.EOS | Gst.MessageType.ERROR)
+                if message is None:
+                    success, position = pipeline.query_position(Gst.Format.TIME)
+                    if success:
+                        job.position = position
+                    if not job.duration:
+                        success, duration = pipeline.query_duration(Gst.Format.TIME)
+                        if success:
+                            job.duration = duration
+                elif message.type == Gst.MessageType.ERROR:
+                    err, debug = message.parse_error()
+                    raise RuntimeError(err.message)
+                else:
+                    job.position = job.duration
+                    break
+        finally:
+            pipeline.set_state(Gst.State.NULL)
@@ -0,0 +1,387 @@
+import re
+import json
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit, parse_qs
+
+from gi.repository import GLib
+
+from library import LibraryDB
+from thumbnails import THUMBNAIL_SIZE, thumbnail_file
+
+
+MAX_HEADER_BYTES = 16 * 1024
+MAX_BODY_BYTES = 1024 * 1024
+REQUEST_TIMEOUT = 10
+KEEPALIVE_INTERVAL = 15
+
+REASONS = {
+    200: "OK", 202: "Accepted", 204: "No Content", 304: "Not Modified", 400: "Bad Request",
+    403: "Forbidden", 404: "Not Found", 405: "Method Not Allowed", 413: "Payload Too Large",
+    415: "Unsupported Media Type", 500: "Internal Server Error",
+}
+
+ARTWORK_KEY = re.compile(r"^[0-9a-f]{1,64}$")
+LOOPBACK_HOSTS = ("127.0.0.1", "localhost", "::1")
+
+
+def track_json(track):
+    return {
+        "path": track.path,
+        "title": track.title,
+        "artist": track.artist,
+        "album": track.album,
+        "year": track.year,
+        "track_no": track.track_no,
+        "duration_ms": track.duration_ms,
+        "artwork": track.artwork_hash,
+    }
+
+
+class HttpError(Exception):
+    def __init__(self, status, message):
+        Exception.__init__(self, message)
+        self.status = status
+
+
+class EventClient:
+    """One /events subscriber; newer events of a kind replace undelivered older ones"""
+
+    def __init__(self):
+        self.pending = {}
+        self.wake = asyncio.Event()
+
+    def push(self, event, data):
+        self.pending[event] = data
+        self.wake.set()
+
+
+class HttpApi:
+    """HTTP/JSON control API served by an asyncio loop on its own thread
+
+    Requests never run on the GTK thread: reads are answered from snapshots the
+    window publishes and from a separate library connection, and commands are
+    handed to the command dispatcher with GLib.idle_add.
+    """
+
+    def __init__(self, api_settings, dispatcher, actions):
+        self.host = api_settings["host"]
+        self.port = int(api_settings["port"])
+        self.event_interval = 1.0 / max(0.1, float(api_settings["max_event_rate"]))
+        self.dispatcher = dispatcher
+        # Queue actions run on the GTK thread: {"add": f(paths), "play": f(index)}
+        self.actions = actions
+        self.state = {"state": "stopped", "track": None, "index": -1, "position": 0.0, "duration": 0.0}
+        self.queue = ()
+        self.clients = set()
+        self.loop = None
+        self.thread = None
+        # SQLite connections belong to one thread, all library reads go through this one
+        self.db_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="http-api-db")
+        self.library = None
+        # Listening on loopback, only names of this machine may be asked for (no DNS rebinding)
+        if self.host in LOOPBACK_HOSTS:
+            self.allowed_hosts = {f"{name}:{self.port}" for name in ("127.0.0.1", "localhost", "[::1]")}
+        else:
+            self.allowed_hosts = None
+
+    # Called from the GTK thread
+
+    def start(self):
+        self.thread = threading.Thread(target=self._run, name="http-api", daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        if self.loop is not None:
+            self.loop.call_soon_threadsafe(self.loop.stop)
+        if self.thread is not None:
+            self.thread.join(timeout=2)
+        self.db_executor.shutdown(wait=False, cancel_futures=True)
+
+    def publish_state(self, **fields):
+        state = dict(self.state)
+        state.update(fields)
+        self.state = state
+        self._emit("state", state)
+
+    def publish_track(self, track, index):
+        self.publish_state(track=track_json(track), index=index, position=0.0, duration=track.duration_ms / 1000)
+        self._emit("track", self.state["track"])
+
+    def publish_position(self, position, duration):
+        state = dict(self.state)
+        state.update(position=position, duration=duration)
+        self.state = state
+        self._emit("position", {"position": position, "duration": duration})
+
+    def publish_queue(self, tracks):
+        self.queue = tuple(tracks)
+        self._emit("queue", {"length": len(self.queue)})
+
+    def _emit(self, event, data):
+        loop = self.loop
+        if loop is not None and self.clients:
+            loop.call_soon_threadsafe(self._broadcast, event, data)
+
+    # API thread
+
+    def _run(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        try:
+            server = self.loop.run_until_complete(
+                asyncio.start_server(self._handle, self.host, self.port, limit=MAX_HEADER_BYTES))
+        except OSError as e:
+            print(f"HTTP API could not listen on {self.host}:{self.port}: {e}")
+            self.loop.close()
+            self.loop = None
+            return
+        print(f"HTTP API listening on http://{self.host}:{self.port}/")
+        try:
+            self.loop.run_forever()
+        finally:
+            server.close()
+            # Event streams never end by themselves
+            tasks = asyncio.all_tasks(self.loop)
+            for task in tasks:
+                task.cancel()
+            self.loop.run_until_complete(asyncio.gather(*tasks, return_exceptions=True))
+            self.loop.close()
+
+    def _broadcast(self, event, data):
+        for client in self.clients:
+            client.push(event, data)
+
+    def _on_main(self, function, *args):
+        def run():
+            function(*args)
+            return False
+        GLib.idle_add(run)
+
+    async def _library(self, function, *args):
+        def call():
+            if self.library is None:
+                self.library = LibraryDB()
+            return function(self.library, *args)
+        return await self.loop.run_in_executor(self.db_executor, call)
+
+    async def _handle(self, reader, writer):
+        try:
+            try:
+                head = await asyncio.wait_for(reader.readuntil(b"\r\n\r\n"), REQUEST_TIMEOUT)
+            except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, asyncio.TimeoutError, ConnectionError):
+                return
+            try:
+                method, target, headers = self._parse_head(head)
+                self._check_origin(headers)
+                body = b""
+                try:
+                    length = int(headers.get("content-length", 0))
+                except ValueError:
+                    raise HttpError(400, "Bad Content-Length")
+                if length > MAX_BODY_BYTES:
+                    raise HttpError(413, "Request body too large")
+                if length:
+                    body = await asyncio.wait_for(reader.readexactly(length), REQUEST_TIMEOUT)
+                if body and headers.get("content-type", "").split(";")[0].strip().lower() != "application/json":
+                    # Other types can be sent by any web page without a CORS preflight
+                    raise HttpError(415, "Content-Type must be application/json")
+                await self._route(method, target, headers, body, writer)
+            except HttpError as e:
+                await self._respond_json(writer, e.status, {"error": str(e)})
+            except (asyncio.IncompleteReadError, asyncio.TimeoutError, ConnectionError):
+                return
+            except Exception as e:
+                print(f"HTTP API error: {e}")
+                await self._respond_json(writer, 500, {"error": "Internal error"})
+        except asyncio.CancelledError:
+            # Shutting down, drop the connection quietly
+            pass
+        finally:
+            writer.close()
+
+    def _parse_head(self, head):
+        lines = head.decode("latin-1").split("\r\n")
+        try:
+            method, target, version = lines[0].split(" ", 2)
+        except ValueError:
+            raise HttpError(400, "Malformed request line")
+        headers = {}
+        for line in lines[1:]:
+            if ":" in line:
+                name, value = line.split(":", 1)
+                headers[name.strip().lower()] = value.strip()
+        return method.upper(), target, headers
+
+    def _check_origin(self, headers):
+        """Turn away web pages on other sites; browsers always send Origin with their POSTs"""
+        host = headers.get("host", "").lower()
+        if self.allowed_hosts is not None and host not in self.allowed_hosts:
+            raise HttpError(403, "Unknown Host")
+        origin = headers.get("origin")
+        if origin is not None and origin.lower() != f"http://{host}":
+            raise HttpError(403, "Cross-origin requests are not allowed")
+
+    async def _route(self, method, target, headers, body, writer):
+        url = urlsplit(target)
+        path = url.path.rstrip("/") or "/"
+        query = {name: values[-1] for name, values in parse_qs(url.query).items()}
+
+        if path == "/events":
+            self._require(method, "GET")
+            await self._serve_events(writer)
+        elif path == "/playback":
+            self._require(method, "GET")
+            await self._respond_json(writer, 200, self.state)
+        elif path.startswith("/playback/"):
+            self._require(method, "POST")
+            name = path[len("/playback/"):]
+            if name not in self.dispatcher.commands:
+                raise HttpError(404, f"Unknown command: {name}")
+            args = self._json_body(body).get("args", [])
+            if not isinstance(args, list):
+                raise HttpError(400, "args must be a list of numbers")
+            # Checked here, a wrong count or type would only fail later on the GTK thread
+            if not self.dispatcher.accepts(name, args):
+                raise HttpError(400, f"Wrong args for {name}")
+            self._on_main(self.dispatcher.dispatch, name, *args)
+            await self._respond_json(writer, 202, {"command": name, "args": args})
+        elif path == "/queue":
+            if method == "GET":
+                offset, limit = self._int(query, "offset", 0), self._int(query, "limit", 500)
+                queue = self.queue
+                await self._respond_json(writer, 200, {
+                    "length": len(queue),
+                    "offset": offset,
+                    "tracks": [track_json(track) for track in queue[offset:offset + limit]],
+                })
+            else:
+                self._require(method, "POST")
+                paths = self._json_body(body).get("paths")
+                if not isinstance(paths, list) or not all(isinstance(p, str) for p in paths):
+                    raise HttpError(400, "paths must be a list of strings")
+                self._on_main(self.actions["add"], paths)
+                await self._respond_json(writer, 202, {"added": len(paths)})
+        elif path == "/queue/play":
+            self._require(method, "POST")
+            index = self._json_body(body).get("index")
+            if not isinstance(index, int) or isinstance(index, bool):
+                raise HttpError(400, "index must be an integer")
+            self._on_main(self.actions["play"], index)
+            await self._respond_json(writer, 202, {"index": index})
+        elif path == "/search":
+            self._require(method, "GET")
+            text = query.get("q", "").strip()
+            if not text:
+                raise HttpError(400, "Missing q")
+            tracks = await self._library(LibraryDB.search, text, self._int(query, "limit", 100))
+            await self._respond_json(writer, 200, [track_json(track) for track in tracks])
+        elif path == "/library/artists":
+            self._require(method, "GET")
+            artists = await self._library(LibraryDB.artists)
+            await self._respond_json(writer, 200, [
+                {"artist": artist, "albums": albums, "tracks": tracks} for artist, albums, tracks in artists])
+        elif path == "/library/albums":
+            self._require(method, "GET")
+            albums = await self._library(LibraryDB.albums, query.get("artist"))
+            await self._respond_json(writer, 200, [
+                {"artist": artist, "album": album, "year": year, "tracks": count, "artwork": artwork}
+                for artist, album, year, count, artwork_path, artwork in albums])
+        elif path == "/library/tracks":
+            self._require(method, "GET")
+            if "artist" not in query:
+                raise HttpError(400, "Missing artist")
+            if "album" in query:
+                tracks = await self._library(LibraryDB.album_tracks, query["artist"], query["album"])
+            else:
+                tracks = await self._library(LibraryDB.artist_tracks, query["artist"])
+            await self._respond_json(writer, 200, [track_json(track) for track in tracks])
+        elif path.startswith("/art/"):
+            self._require(method, "GET")
+            await self._serve_art(path[len("/art/"):], headers, writer)
+        else:
+            raise HttpError(404, "Not found")
+
+    def _require(self, method, allowed):
+        if method != allowed:
+            raise HttpError(405, f"Use {allowed}")
+
+    def _int(self, query, name, default):
+        try:
+            return max(0, int(query.get(name, default)))
+        except ValueError:
+            raise HttpError(400, f"{name} must be an integer")
+
+    def _json_body(self, body):
+        try:
+            data = json.loads(body or b"{}")
+        except ValueError:
+            raise HttpError(400, "Body is not JSON")
+        if not isinstance(data, dict):
+            raise HttpError(400, "Body must be a JSON object")
+        return data
+
+    async def _serve_art(self, key, headers, writer):
+        if not ARTWORK_KEY.match(key):
+            raise HttpError(404, "Unknown artwork")
+        source = await self._library(LibraryDB.artwork_source, key)
+        if source is None:
+            raise HttpError(404, "Unknown artwork")
+
+        # Thumbnails are named by content hash, the name is a strong validator
+        etag = f'"{key}-{THUMBNAIL_SIZE}"'
+        cache_headers = {"ETag": etag, "Cache-Control": "public, max-age=86400"}
+        if headers.get("if-none-match") == etag:
+            await self._respond(writer, 304, b"", None, cache_headers)
+            return
+
+        def load():
+            cache_file = thumbnail_file(key, source)
+            if cache_file is None:
+                return None
+            with open(cache_file, "rb") as f:
+                return f.read()
+
+        data = await self.loop.run_in_executor(None, load)
+        if data is None:
+            raise HttpError(404, "No artwork")
+        await self._respond(writer, 200, data, "image/png", cache_headers)
+
+    async def _serve_events(self, writer):
+        writer.write(b"HTTP/1.1 200 OK\r\nContent-Type: text/event-stream\r\n"
+                     b"Cache-Control: no-cache\r\nConnection: close\r\n\r\n")
+        client = EventClient()
+        client.push("state", self.state)
+        self.clients.add(client)
+        try:
+            while True:
+                try:
+                    await asyncio.wait_for(client.wake.wait(), KEEPALIVE_INTERVAL)
+                except asyncio.TimeoutError:
+                    writer.write(b": keep-alive\n\n")
+                    await writer.drain()
+                    continue
+                client.wake.clear()
+                events, client.pending = client.pending, {}
+                for event, data in events.items():
+                    writer.write(f"event: {event}\ndata: {json.dumps(data)}\n\n".encode("utf-8"))
+                await writer.drain()
+                # At most one batch per interval; anything newer waits and replaces older data
+                await asyncio.sleep(self.event_interval)
+        except ConnectionError:
+            pass
+        finally:
+            self.clients.discard(client)
+
+    async def _respond_json(self, writer, status, data):
+        await self._respond(writer, status, json.dumps(data).encode("utf-8"), "application/json")
+
+    async def _respond(self, writer, status, body, content_type, headers=None):
+        lines = [f"HTTP/1.1 {status} {REASONS.get(status, '')}", f"Content-Length: {len(body)}", "Connection: close"]
+        if content_type:
+            lines.append(f"Content-Type: {content_type}")
+        for name, value in (headers or {}).items():
+            lines.append(f"{name}: {value}")
+        writer.write(("\r\n".join(lines) + "\r\n\r\n").encode("latin-1") + body)
+        await writer.drain()
@@ -0,0 +1,388 @@
+import os
+import json
+import time
+import sqlite3
+
+from settings import get_config_directory
+from track import Track
+
+
+TRACK_COLUMNS = Track.__slots__
+
+# Rule fields and the SQL expressions they map to
+RULE_FIELDS = {
+    "artist": "t.artist",
+    "album": "t.album",
+    "title": "t.title",
+    "genre": "t.genre",
+    "year": "t.year",
+    "duration_ms": "t.duration_ms",
+    "added_at": "t.added_at",
+    "play_count": "COALESCE(s.play_count, 0)",
+    "skip_count": "COALESCE(s.skip_count, 0)",
+    "last_played": "s.last_played",
+}
+TEXT_FIELDS = {"artist", "album", "title", "genre"}
+TIME_FIELDS = {"added_at", "last_played"}
+
+TRACK_ORDER = "t.artist COLLATE NOCASE, t.album COLLATE NOCASE, t.disc_no, t.track_no, t.path"
+
+SCHEMA = """
+    CREATE TABLE IF NOT EXISTS tracks (
+        id INTEGER PRIMARY KEY,
+        path TEXT NOT NULL UNIQUE,
+        title TEXT, artist TEXT, album TEXT,
+        year INTEGER, track_no INTEGER, disc_no INTEGER,
+        duration_ms INTEGER, artwork_hash TEXT, gain REAL, genre TEXT,
+        added_at INTEGER NOT NULL
+    );
+    CREATE INDEX IF NOT EXISTS idx_tracks_artist ON tracks (artist COLLATE NOCASE);
+    CREATE INDEX IF NOT EXISTS idx_tracks_album ON tracks (album COLLATE NOCASE);
+    CREATE INDEX IF NOT EXISTS idx_tracks_genre_year ON tracks (genre COLLATE NOCASE, year);
+    CREATE INDEX IF NOT EXISTS idx_tracks_year ON tracks (year);
+    CREATE INDEX IF NOT EXISTS idx_tracks_duration ON tracks (duration_ms);
+    CREATE INDEX IF NOT EXISTS idx_tracks_added ON tracks (added_at);
+    CREATE INDEX IF NOT EXISTS idx_tracks_artist_album ON tracks (artist, album);
+
+    CREATE TABLE IF NOT EXISTS albums (
+        artist TEXT NOT NULL,
+        album TEXT NOT NULL,
+        year INTEGER,
+        track_count INTEGER NOT NULL,
+        artwork_path TEXT,
+        artwork_hash TEXT,
+        PRIMARY KEY (artist, album)
+    ) WITHOUT ROWID;
+    CREATE INDEX IF NOT EXISTS idx_albums_artist ON albums (artist COLLATE NOCASE);
+
+    CREATE TABLE IF NOT EXISTS play_stats (
+        path TEXT PRIMARY KEY,
+        play_count INTEGER NOT NULL DEFAULT 0,
+        skip_count INTEGER NOT NULL DEFAULT 0,
+        last_played INTEGER,
+        listened REAL NOT NULL DEFAULT 0
+    );
+    CREATE INDEX IF NOT EXISTS idx_stats_play_count ON play_stats (play_count);
+    CREATE INDEX IF NOT EXISTS idx_stats_last_played ON play_stats (last_played);
+
+    CREATE TABLE IF NOT EXISTS smart_playlists (
+        id INTEGER PRIMARY KEY,
+        name TEXT NOT NULL UNIQUE,
+        rules TEXT NOT NULL,
+        materialized INTEGER NOT NULL DEFAULT 0
+    );
+    CREATE TABLE IF NOT EXISTS smart_members (
+        playlist_id INTEGER NOT NULL,
+        track_id INTEGER NOT NULL,
+        PRIMARY KEY (playlist_id, track_id)
+    ) WITHOUT ROWID;
+
+    CREATE TABLE IF NOT EXISTS waveforms (
+        path TEXT PRIMARY KEY,
+        size INTEGER NOT NULL,
+        mtime_ns INTEGER NOT NULL,
+        peaks BLOB NOT NULL
+    );
+
+    CREATE TABLE IF NOT EXISTS dsp_presets (
+        scope TEXT NOT NULL,
+        key TEXT NOT NULL,
+        preset TEXT NOT NULL,
+        PRIMARY KEY (scope, key)
+    ) WITHOUT ROWID;
+"""
+
+
+def get_library_path():
+    return os.path.join(get_config_directory(), "library.db")
+
+
+def build_where(rules):
+    """Translate smart playlist rules into a WHERE clause and its parameters
+
+    rules is {"match": "all"|"any", "conditions": [{"field", "op", "value"}, ...]}.
+    """
+    clauses = []
+    params = []
+    now = int(time.time())
+
+    for condition in rules.get("conditions", []):
+        field = condition.get("field")
+        op = condition.get("op")
+        value = condition.get("value")
+        if field not in RULE_FIELDS:
+            raise ValueError(f"Unknown rule field: {field}")
+        column = RULE_FIELDS[field]
+
+        if field in TEXT_FIELDS:
+            if op == "is":
+                clauses.append(f"{column} = ? COLLATE NOCASE")
+                params.append(value)
+            elif op == "starts_with":
+                clauses.append(f"{column} LIKE ? ESCAPE '\\'")
+                params.append(_escape_like(value) + "%")
+            elif op == "contains":
+                clauses.append(f"{column} LIKE ? ESCAPE '\\'")
+                params.append("%" + _escape_like(value) + "%")
+            else:
+                raise ValueError(f"Unknown operator for {field}: {op}")
+        elif op == "within_days" and field in TIME_FIELDS:
+            clauses.append(f"{column} >= ?")
+            params.append(now - int(value) * 86400)
+        elif op == "between":
+            clauses.append(f"{column} BETWEEN ? AND ?")
+            params.extend((value[0], value[1]))
+        elif op in (">=", "<=", "="):
+            clauses.append(f"{column} {op} ?")
+            params.append(value)
+        else:
+            raise ValueError(f"Unknown operator for {field}: {op}")
+
+    if not clauses:
+        return "1", params
+    joiner = " OR " if rules.get("match") == "any" else " AND "
+    return "(" + joiner.join(clauses) + ")", params
+
+
+def _escape_like(value):
+    return str(value).replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+
+def album_key(track):
+    return f"{track.artist}\x1f{track.album}"
+
+
+def is_time_relative(rules):
+    """Rules like "added in the last 30 days" change without the library changing"""
+    return any(c.get("op") == "within_days" for c in rules.get("conditions", []))
+
+
+class LibraryDB:
+    """Indexed track library with smart playlists evaluated as SQL queries"""
+
+    def __init__(self, path=None):
+        self.path = path or get_library_path()
+        self.conn = sqlite3.connect(self.path)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(SCHEMA)
+        self.conn.commit()
+
+        # Libraries from before the album index existed get it built once
+        if (self.conn.execute("SELECT 1 FROM albums LIMIT 1").fetchone() is None and
+                self.conn.execute("SELECT 1 FROM tracks LIMIT 1").fetchone() is not None):
+            with self.conn:
+                self.refresh_albums(self.conn.execute("SELECT DISTINCT artist, album FROM tracks").fetchall())
+
+    def add_tracks(self, tracks):
+        """Insert or update tracks, then refresh smart playlist membership for just those rows"""
+        tracks = [track for track in tracks if not track.is_stream]
+        if not tracks:
+            return
+        now = int(time.time())
+        columns = ", ".join(TRACK_COLUMNS)
+        updates = ", ".join(f"{column} = excluded.{column}" for column in TRACK_COLUMNS[1:])
+        paths = [track.path for track in tracks]
+        with self.conn:
+            # Groups the tracks leave (after a tag edit) need refreshing as well
+            groups = {(track.artist, track.album) for track in tracks}
+            for start in range(0, len(paths), 500):
+                chunk = paths[start:start + 500]
+                groups.update(self.conn.execute(
+                    f"SELECT artist, album FROM tracks WHERE path IN ({', '.join('?' * len(chunk))})", chunk))
+            self.conn.executemany(
+                f"INSERT INTO tracks ({columns}, added_at) VALUES ({', '.join('?' * (len(TRACK_COLUMNS) + 1))}) "
+                f"ON CONFLICT(path) DO UPDATE SET {updates}",
+                ((*(getattr(track, column) for column in TRACK_COLUMNS), now) for track in tracks)
+            )
+            self.refresh_albums(groups)
+            self.refresh_paths(paths)
+
+    def refresh_albums(self, groups):
+        """Recompute the album index rows of the given (artist, album) pairs"""
+        for artist, album in groups:
+            self.conn.execute("DELETE FROM albums WHERE artist = ? AND album = ?", (artist, album))
+            year, count = self.conn.execute(
+                "SELECT MAX(year), COUNT(*) FROM tracks WHERE artist = ? AND album = ?", (artist, album)).fetchone()
+            if not count:
+                continue
+            # Any track with embedded artwork provides the album tile
+            cover = self.conn.execute(
+                "SELECT path, artwork_hash FROM tracks WHERE artist = ? AND album = ? AND artwork_hash IS NOT NULL "
+                "LIMIT 1", (artist, album)).fetchone() or (None, None)
+            self.conn.execute(
+                "INSERT INTO albums (artist, album, year, track_count, artwork_path, artwork_hash) "
+                "VALUES (?, ?, ?, ?, ?, ?)", (artist, album, year, count, *cover))
+
+    def artists(self):
+        """[(artist, album count, track count)] from the album index"""
+        return self.conn.execute(
+            "SELECT artist, COUNT(*), SUM(track_count) FROM albums "
+            "GROUP BY artist COLLATE NOCASE ORDER BY artist COLLATE NOCASE").fetchall()
+
+    def albums(self, artist=None):
+        """[(artist, album, year, track count, artwork path, artwork hash)], all or one artist's"""
+        columns = "artist, album, year, track_count, artwork_path, artwork_hash"
+        if artist is None:
+            return self.conn.execute(
+                f"SELECT {columns} FROM albums ORDER BY artist COLLATE NOCASE, year, album COLLATE NOCASE").fetchall()
+        return self.conn.execute(
+            f"SELECT {columns} FROM albums WHERE artist = ? COLLATE NOCASE ORDER BY year, album COLLATE NOCASE",
+            (artist,)).fetchall()
+
+    def artist_tracks(self, artist):
+        return self._tracks(
+            f"SELECT {self._track_select()} FROM tracks t WHERE t.artist = ? COLLATE NOCASE "
+            f"ORDER BY {TRACK_ORDER}", (artist,))
+
+    def album_tracks(self, artist, album):
+        return self._tracks(
+            f"SELECT {self._track_select()} FROM tracks t WHERE t.artist = ? AND t.album = ? "
+            f"ORDER BY t.disc_no, t.track_no, t.path", (artist, album))
+
+    def refresh_paths(self, paths):
+        """Re-evaluate materialized smart playlists for the given tracks only"""
+        playlists = self.conn.execute(
+            "SELECT id, rules FROM smart_playlists WHERE materialized = 1").fetchall()
+        if not playlists:
+            return
+
+        ids = []
+        for start in range(0, len(paths), 500):
+            chunk = paths[start:start + 500]
+            ids.extend(row[0] for row in self.conn.execute(
+                f"SELECT id FROM tracks WHERE path IN ({', '.join('?' * len(chunk))})", chunk))
+
+        for playlist_id, rules_json in playlists:
+            where, params = build_where(json.loads(rules_json))
+            for start in range(0, len(ids), 500):
+                chunk = ids[start:start + 500]
+                marks = ", ".join("?" * len(chunk))
+                self.conn.execute(
+                    f"DELETE FROM smart_members WHERE playlist_id = ? AND track_id IN ({marks})",
+                    (playlist_id, *chunk))
+                self.conn.execute(
+                    f"INSERT INTO smart_members (playlist_id, track_id) "
+                    f"SELECT ?, t.id FROM tracks t LEFT JOIN play_stats s ON s.path = t.path "
+                    f"WHERE {where} AND t.id IN ({marks})",
+                    (playlist_id, *params, *chunk))
+
+    def refresh_stats(self, paths):
+        """Called after play statistics changed for paths"""
+        with self.conn:
+            self.refresh_paths(paths)
+
+    def top_played(self, limit=100):
+        return self._tracks(
+            f"SELECT {self._track_select()} FROM play_stats s JOIN tracks t ON t.path = s.path "
+            f"WHERE s.play_count > 0 ORDER BY s.play_count DESC, s.last_played DESC LIMIT ?", (limit,))
+
+    def recently_played(self, limit=100):
+        return self._tracks(
+            f"SELECT {self._track_select()} FROM play_stats s JOIN tracks t ON t.path = s.path "
+            f"WHERE s.last_played IS NOT NULL ORDER BY s.last_played DESC LIMIT ?", (limit,))
+
+    def never_played(self, limit=100):
+        return self._tracks(
+            f"SELECT {self._track_select()} FROM tracks t LEFT JOIN play_stats s ON s.path = t.path "
+            f"WHERE s.play_count IS NULL OR s.play_count = 0 ORDER BY t.added_at DESC LIMIT ?", (limit,))
+
+    def save_smart_playlist(self, name, rules):
+        build_where(rules)  # validate before storing
+        with self.conn:
+            self.conn.execute(
+                "INSERT INTO smart_playlists (name, rules, materialized) VALUES (?, ?, 0) "
+                "ON CONFLICT(name) DO UPDATE SET rules = excluded.rules, materialized = 0",
+                (name, json.dumps(rules)))
+            playlist_id = self.conn.execute(
+                "SELECT id FROM smart_playlists WHERE name = ?", (name,)).fetchone()[0]
+            self.conn.execute("DELETE FROM smart_members WHERE playlist_id = ?", (playlist_id,))
+
+    def delete_smart_playlist(self, name):
+        with self.conn:
+            row = self.conn.execute("SELECT id FROM smart_playlists WHERE name = ?", (name,)).fetchone()
+            if row:
+                self.conn.execute("DELETE FROM smart_members WHERE playlist_id = ?", (row[0],))
+                self.conn.execute("DELETE FROM smart_playlists WHERE id = ?", (row[0],))
+
+    def smart_playlists(self):
+        return [(name, json.loads(rules)) for name, rules in
+                self.conn.execute("SELECT name, rules FROM smart_playlists ORDER BY name COLLATE NOCASE")]
+
+    def smart_playlist_tracks(self, name):
+        """Tracks of a smart playlist, materializing its membership on first use"""
+        row = self.conn.execute(
+            "SELECT id, rules, materialized FROM smart_playlists WHERE name = ?", (name,)).fetchone()
+        if row is None:
+            return []
+        playlist_id, rules_json, materialized = row
+        rules = json.loads(rules_json)
+
+        # Time relative rules are evaluated fresh every time
+        if is_time_relative(rules):
+            return self.query_tracks(rules)
+
+        if not materialized:
+            where, params = build_where(rules)
+            with self.conn:
+                self.conn.execute("DELETE FROM smart_members WHERE playlist_id = ?", (playlist_id,))
+                self.conn.execute(
+                    f"INSERT INTO smart_members (playlist_id, track_id) "
+                    f"SELECT ?, t.id FROM tracks t LEFT JOIN play_stats s ON s.path = t.path WHERE {where}",
+                    (playlist_id, *params))
+                self.conn.execute("UPDATE smart_playlists SET materialized = 1 WHERE id = ?", (playlist_id,))
+
+        return self._tracks(
+            f"SELECT {self._track_select()} FROM smart_members m JOIN tracks t ON t.id = m.track_id "
+            f"WHERE m.playlist_id = ? ORDER BY {TRACK_ORDER}", (playlist_id,))
+
+    def query_tracks(self, rules, limit=None):
+        """Evaluate rules directly against the indexed tracks table"""
+        where, params = build_where(rules)
+        sql = (f"SELECT {self._track_select()} FROM tracks t LEFT JOIN play_stats s ON s.path = t.path "
+               f"WHERE {where} ORDER BY {TRACK_ORDER}")
+        if limit:
+            sql += f" LIMIT {int(limit)}"
+        return self._tracks(sql, params)
+
+    def search(self, text, limit=100):
+        """Tracks whose title, artist or album contains text"""
+        rules = {"match": "any", "conditions": [
+            {"field": field, "op": "contains", "value": text} for field in ("title", "artist", "album")
+        ]}
+        return self.query_tracks(rules, limit=limit)
+
+    def artwork_source(self, artwork_hash):
+        """A track path carrying the artwork with this hash, None if unknown"""
+        row = self.conn.execute(
+            "SELECT artwork_path FROM albums WHERE artwork_hash = ? LIMIT 1", (artwork_hash,)).fetchone()
+        if row is None:
+            row = self.conn.execute(
+                "SELECT path FROM tracks WHERE artwork_hash = ? LIMIT 1", (artwork_hash,)).fetchone()
+        return row[0] if row else None
+
+    def assign_preset(self, scope, track, preset):
+        """Remember an equalizer preset for a track or its album ("track"/"album"); None clears it"""
+        key = track.path if scope == "track" else album_key(track)
+        with self.conn:
+            if preset is None:
+                self.conn.execute("DELETE FROM dsp_presets WHERE scope = ? AND key = ?", (scope, key))
+            else:
+                self.conn.execute("INSERT OR REPLACE INTO dsp_presets (scope, key, preset) VALUES (?, ?, ?)",
+                                  (scope, key, preset))
+
+    def preset_for(self, track):
+        """The track's own preset, else its album's, else None"""
+        row = self.conn.execute(
+            "SELECT preset FROM dsp_presets WHERE (scope = 'track' AND key = ?) OR (scope = 'album' AND key = ?) "
+            "ORDER BY scope = 'track' DESC LIMIT 1", (track.path, album_key(track))).fetchone()
+        return row[0] if row else None
+
+    def _track_select(self):
+        return ", ".join(f"t.{column}" for column in TRACK_COLUMNS)
+
+    def _tracks(self, sql, params=()):
+        return [Track(*row) for row in self.conn.execute(sql, params)]
+
+    def close(self):
+        self.conn.close()
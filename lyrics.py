@@ -0,0 +1,134 @@
+import os
+import re
+from bisect import bisect_right
+from functools import lru_cache
+
+from metadata import read_lyrics
+
+
+TIMESTAMP = re.compile(r"\[(\d+):(\d+(?:[.:]\d+)?)\]")
+OFFSET = re.compile(r"^\[offset:\s*([+-]?\d+)\s*\]", re.IGNORECASE | re.MULTILINE)
+
+
+def layout(entries):
+    """Text to show for lyric entries and the line of that text each entry starts on
+
+    LRC gives one entry per line. SYLT entries are often syllables or lines
+    carrying their own line breaks ("\\nNever", " gonna"), so once any entry
+    has one the entries are joined as they are.
+    """
+    entries = [entry.replace("\r\n", "\n").replace("\r", "\n") for entry in entries]
+    if not any("\n" in entry for entry in entries):
+        return "\n".join(entries), list(range(len(entries)))
+
+    text = "".join(entries)
+    # Breaks before the first words would only leave empty lines at the top
+    skipped = len(text) - len(text.lstrip("\n"))
+    rows = []
+    row = 0
+    for entry in entries:
+        words = entry.lstrip("\n")
+        row += len(entry) - len(words)
+        rows.append(max(0, row - skipped))
+        row += words.count("\n")
+    return text[skipped:], rows
+
+
+class Lyrics:
+    """Lyrics entries, with start times in ms sorted ascending when synced
+
+    text is what gets shown, rows[i] the line of text where entry i starts.
+    """
+    __slots__ = ("times", "lines", "source", "text", "rows")
+
+    def __init__(self, lines, times=None, source=""):
+        self.lines = lines
+        self.times = times or []
+        self.source = source
+        self.text, self.rows = layout(lines)
+
+    @property
+    def synced(self):
+        return bool(self.times)
+
+    def line_at(self, position_ms):
+        """Index of the line being sung at position_ms, -1 before the first one"""
+        if not self.times:
+            return -1
+        return bisect_right(self.times, position_ms) - 1
+
+
+def parse_lrc(text):
+    """Parse LRC text; lines without timestamps make plain (unsynced) lyrics"""
+    offset_match = OFFSET.search(text)
+    # A positive offset makes lines appear sooner
+    offset = int(offset_match.group(1)) if offset_match else 0
+
+    timed = []
+    plain = []
+    for raw_line in text.splitlines():
+        stamps = TIMESTAMP.findall(raw_line)
+        line = TIMESTAMP.sub("", raw_line).strip()
+        if stamps:
+            # "[00:12.00][01:40.00]chorus" repeats a line at several times
+            for minutes, seconds in stamps:
+                ms = int((int(minutes) * 60 + float(seconds.replace(":", "."))) * 1000) - offset
+                timed.append((max(0, ms), line))
+        elif not re.match(r"^\[\w+:.*\]$", raw_line.strip()):
+            plain.append(raw_line.rstrip())
+
+    if timed:
+        timed.sort(key=lambda entry: entry[0])
+        return Lyrics([line for ms, line in timed], [ms for ms, line in timed])
+    return Lyrics(plain)
+
+
+def find_sidecar(file_path):
+    """The .lrc file next to a track ("song.mp3" -> "song.lrc"), None if there is none"""
+    base = os.path.splitext(file_path)[0]
+    for extension in (".lrc", ".LRC"):
+        if os.path.isfile(base + extension):
+            return base + extension
+    return None
+
+
+def load_lyrics(file_path):
+    """Lyrics for a track, preferring synced ones; parsed results are cached"""
+    sidecar = find_sidecar(file_path)
+    try:
+        track_mtime = os.stat(file_path).st_mtime_ns
+        sidecar_mtime = os.stat(sidecar).st_mtime_ns if sidecar else 0
+    except OSError:
+        return None
+    # The mtimes are part of the key so edited files are parsed again
+    return _load_lyrics(file_path, track_mtime, sidecar, sidecar_mtime)
+
+
+@lru_cache(maxsize=64)
+def _load_lyrics(file_path, track_mtime, sidecar, sidecar_mtime):
+    sidecar_lyrics = None
+    if sidecar:
+        try:
+            with open(sidecar, 'r', encoding='utf-8-sig', errors='replace') as f:
+                sidecar_lyrics = parse_lrc(f.read())
+            sidecar_lyrics.source = os.path.basename(sidecar)
+            if sidecar_lyrics.synced:
+                return sidecar_lyrics
+        except OSError as e:
+            print(f"Error reading lyrics {sidecar}: {e}")
+
+    try:
+        text, synced = read_lyrics(file_path)
+    except Exception as e:
+        print(f"Error reading lyrics from {file_path}: {e}")
+        text, synced = "", []
+
+    if synced:
+        synced.sort(key=lambda entry: entry[0])
+        return Lyrics([line for ms, line in synced], [ms for ms, line in synced], "embedded")
+    if text:
+        embedded = parse_lrc(text)
+        embedded.source = "embedded"
+        if embedded.synced or sidecar_lyrics is None:
+            return embedded
+    return sidecar_lyrics
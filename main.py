@@ -5,9 +5,36 @@ import gi
 
 gi.require_version('Gtk', '3.0')
 gi.require_version('Gst', '1.0')
-from gi.repository import Gtk, GLib, Gst, GObject, GdkPixbuf
-from mutagen import File
+from gi.repository import Gtk, Gdk, GLib, Gst, GObject, GdkPixbuf
 import time
+import sqlite3
+import threading
+
+from settings import load_settings, save_settings
+from metadata import read_metadata
+from track import Track, artwork_hash
+from session import SessionStore
+from dedup import DedupIndex, FingerprintWorker, chromaprint_available
+from library import LibraryDB
+from stats import PlayStatsRecorder
+from waveform import WaveformStore, WaveformSeekBar
+from visualizer import SpectrumVisualizer, create_spectrum_element
+from dsp import DSPChain, BAND_FREQUENCIES, BUILTIN_PRESETS, all_presets
+from lyrics import load_lyrics
+from tag_writer import TagWriteQueue, is_temp_file
+from exporter import Exporter, EXPORT_FORMATS, default_workers
+from commands import CommandDispatcher, MediaKeys
+from thumbnails import ThumbnailStore
+from artwork import load_artwork
+from browser import LibraryBrowser
+from network import NetworkOutput, run_receiver
+from http_api import HttpApi
+from playlist_file import PlaylistFile, merge_groups
+from player_state import PlayerStateMachine, TRANSITION_TIMEOUT_MS, STREAM_TRANSITION_TIMEOUT_MS
+from audio_output import (SINK_FACTORIES, AudioOutputStats, build_audio_sink, build_audio_filter,
+                          configure_sink_element, apply_playbin_flags)
+from streams import (is_stream_uri, to_uri, apply_stream_buffering,
+                     configure_queue_element, parse_icy_title, StreamBufferController)
 
 
 class MusicPlayerWindow(Gtk.Window):
@@ -22,13 +49,41 @@ class MusicPlayerWindow(Gtk.Window):
         # Initialize GStreamer
         Gst.init(None)
 
-        # Create playbin for audio playback
-        self.player = Gst.ElementFactory.make("playbin", "player")
+        self.settings = load_settings()
+        self.audio_stats = AudioOutputStats()
+        self.pending_seek = None
+        self.play_after_preroll = False
+        self.dedup_index = DedupIndex()
+        self.library = LibraryDB()
+        self.play_stats = PlayStatsRecorder(on_flushed=self.on_play_stats_flushed)
+        self.listening_track = None
+        # Time actually spent PLAYING the listening track, seeks don't count
+        self.listened_seconds = 0.0
+        self.listen_started = None
+        self.fingerprint_worker = None
+        self.waveforms = WaveformStore()
+        self.waveform_path = None
+        self.spectrum = None
+        self.dsp = None
+        self.lyrics = None
+        self.lyrics_path = None
+        self.lyrics_line = -1
+        self.tag_writer = TagWriteQueue(on_written=self.on_tags_written)
+        self.thumbnails = ThumbnailStore()
+        self.browser = None
+        self.network = None
+        # Saved playlists written this session, they remember what is on disk to save only changes
+        self.playlist_files = {}
+
+        # Pipeline state comes from bus messages, the UI never waits on it
+        self.playback = PlayerStateMachine(None, on_reached=self.on_state_reached,
+                                           on_stuck=self.on_transition_stuck)
+        self.playing_track = None
+        self.retry_path = None
+        self.failed_in_a_row = 0
 
-        # Create bus to get events from GStreamer pipeline
-        bus = self.player.get_bus()
-        bus.add_signal_watch()
-        bus.connect('message', self.on_message)
+        # Create playbin for audio playback
+        self.create_player()
 
         # Initialize player state variables
         self.current_track_index = -1
@@ -55,6 +110,53 @@ class MusicPlayerWindow(Gtk.Window):
         open_folder_button.connect("clicked", self.on_folder_clicked)
         header.pack_start(open_folder_button)
 
+        # Open network stream button
+        open_location_button = Gtk.Button.new_from_icon_name("network-workgroup", Gtk.IconSize.LARGE_TOOLBAR)
+        open_location_button.set_tooltip_text("Open Location")
+        open_location_button.connect("clicked", self.on_location_clicked)
+        header.pack_start(open_location_button)
+
+        # Artist/album browser toggle
+        self.library_button = Gtk.ToggleButton()
+        self.library_button.add(Gtk.Image.new_from_icon_name("view-grid-symbolic", Gtk.IconSize.LARGE_TOOLBAR))
+        self.library_button.set_tooltip_text("Browse Library")
+        self.library_button.connect("toggled", self.on_library_toggled)
+        header.pack_start(self.library_button)
+
+        # Audio output settings button
+        audio_output_button = Gtk.Button.new_from_icon_name("audio-card", Gtk.IconSize.LARGE_TOOLBAR)
+        audio_output_button.set_tooltip_text("Audio Output")
+        audio_output_button.connect("clicked", self.on_audio_output_clicked)
+        header.pack_end(audio_output_button)
+
+        # Lyrics panel toggle
+        self.lyrics_button = Gtk.ToggleButton()
+        self.lyrics_button.add(Gtk.Image.new_from_icon_name("format-justify-left", Gtk.IconSize.LARGE_TOOLBAR))
+        self.lyrics_button.set_tooltip_text("Lyrics")
+        self.lyrics_button.connect("toggled", self.on_lyrics_toggled)
+        header.pack_end(self.lyrics_button)
+
+        # Equalizer button
+        self.equalizer_button = Gtk.Button.new_from_icon_name("preferences-desktop-sound",
+                                                              Gtk.IconSize.LARGE_TOOLBAR)
+        self.equalizer_button.set_tooltip_text("Equalizer")
+        self.equalizer_button.connect("clicked", self.on_equalizer_clicked)
+        header.pack_end(self.equalizer_button)
+
+        # Visualizer toggle
+        self.visualizer_button = Gtk.ToggleButton()
+        self.visualizer_button.add(Gtk.Image.new_from_icon_name("audio-x-generic", Gtk.IconSize.LARGE_TOOLBAR))
+        self.visualizer_button.set_tooltip_text("Visualizer")
+        self.visualizer_button.set_active(self.settings["visualizer"]["enabled"])
+        self.visualizer_button.connect("toggled", self.on_visualizer_toggled)
+        header.pack_end(self.visualizer_button)
+
+        # Duplicate finder button
+        duplicates_button = Gtk.Button.new_from_icon_name("edit-find-replace", Gtk.IconSize.LARGE_TOOLBAR)
+        duplicates_button.set_tooltip_text("Find Duplicates")
+        duplicates_button.connect("clicked", self.on_find_duplicates_clicked)
+        header.pack_end(duplicates_button)
+
         self.set_titlebar(header)
 
         # Create stack to hold different views
@@ -77,6 +179,27 @@ class MusicPlayerWindow(Gtk.Window):
         self.create_now_playing_section()
         self.create_playlist_view()
         self.create_control_buttons()
+        self.apply_audio_filter()
+        self.connect('window-state-event', self.on_window_state_event)
+
+        # Buttons, keys and media keys all go through the command dispatcher
+        self.commands = CommandDispatcher()
+        self.register_commands()
+        # After the default handler, so the focused widget gets first pick (Space on a
+        # button, arrows in a scale or the playlist) and only unused keys become commands
+        self.connect_after('key-press-event', self.commands.handle_key)
+        self.media_keys = MediaKeys(self.commands)
+        self.connect('focus-in-event', lambda widget, event: self.media_keys.grab())
+
+        # Optional HTTP API, served from its own thread
+        self.http_api = None
+        self.queue_publish_id = None
+        if self.settings["http_api"]["enabled"]:
+            self.http_api = HttpApi(self.settings["http_api"], self.commands,
+                                    {"add": self.add_music_files, "play": self.play_track_at_index})
+            self.http_api.start()
+            for signal_name in ('row-inserted', 'row-deleted', 'rows-reordered'):
+                self.playlist_store.connect(signal_name, lambda *args: self.schedule_queue_publish())
 
         self.player.set_property('volume', 1.0)
         self.previous_volume = 100
@@ -87,9 +210,369 @@ class MusicPlayerWindow(Gtk.Window):
 
         self.stack.set_visible_child_name("welcome")
 
+        # Restore the previous session, then keep snapshotting it as things change
+        self.session = SessionStore()
+        self.session_save_timeout_id = None
+        self.last_saved_position = None
+        self.restore_session()
+        for signal in ('row-inserted', 'row-deleted', 'rows-reordered', 'row-changed'):
+            self.playlist_store.connect(signal, self.on_queue_changed)
+        self.connect("destroy", self.on_destroy)
+
+    def restore_session(self):
+        """Reload queue, current track, position and toggles from the last run"""
+        try:
+            tracks = self.session.load_queue()
+            state = self.session.load_state()
+        except sqlite3.Error as e:
+            print(f"Error restoring session: {e}")
+            return
+
+        for track in tracks:
+            self.playlist_store.append([track])
+            if not track.is_stream:
+                # Stat lazily, restoring must not touch every file
+                self.dedup_index.add(track.path, track.duration_ms, stat=False)
+        self.update_view()
+
+        if state.get('volume') is not None:
+            self.volume_scale.set_value(state['volume'])
+        if state.get('muted'):
+            self.on_volume_button_clicked(None)
+
+        self.repeat_button.set_active(bool(state.get('repeat')))
+
+        # Restore the toggle without reshuffling the saved order
+        self.shuffle_button.handler_block_by_func(self.on_shuffle_toggled)
+        self.shuffle_button.set_active(bool(state.get('shuffle')))
+        self.shuffle_button.handler_unblock_by_func(self.on_shuffle_toggled)
+        self.shuffle_enabled = self.shuffle_button.get_active()
+
+        index = state.get('current_index', -1)
+        if index is not None and 0 <= index < len(self.playlist_store):
+            self.current_track_index = index
+            self.select_row(index)
+            self.play_track(self.playlist_store[index][0],
+                            start_position=state.get('position_ns') or 0,
+                            autoplay=bool(state.get('playing')))
+
+    def on_queue_changed(self, *args):
+        self.schedule_session_save()
+
+    def schedule_session_save(self):
+        # Coalesce bursts of changes (e.g. scanning a folder) into one write
+        if self.session_save_timeout_id is None:
+            self.session_save_timeout_id = GLib.timeout_add_seconds(2, self.save_session)
+
+    def save_session(self):
+        self.session_save_timeout_id = None
+        try:
+            self.session.save_queue([row[0] for row in self.playlist_store])
+            self.save_session_state()
+        except sqlite3.Error as e:
+            print(f"Error saving session: {e}")
+        return False
+
+    def save_session_state(self):
+        position = 0
+        if self.current_track_index != -1:
+            success, position = self.player.query_position(Gst.Format.TIME)
+            if not success:
+                position = 0
+        playing = self.playback.playing or self.play_after_preroll
+
+        self.session.save_state(
+            current_index=self.current_track_index,
+            position_ns=position,
+            playing=playing,
+            shuffle=self.shuffle_enabled,
+            repeat=self.repeat_enabled,
+            volume=self.previous_volume if self.is_muted else self.volume_scale.get_value(),
+            muted=self.is_muted,
+        )
+        self.last_saved_position = position
+
+    def on_destroy(self, widget):
+        if self.session_save_timeout_id is not None:
+            GLib.source_remove(self.session_save_timeout_id)
+        self.save_session()
+        self.session.close()
+        if self.fingerprint_worker is not None:
+            self.fingerprint_worker.shutdown()
+        self.dedup_index.cache.close()
+        self.media_keys.release()
+        self.record_listen()
+        self.play_stats.close()
+        self.tag_writer.close()
+        self.library.close()
+        self.waveforms.shutdown()
+        self.thumbnails.shutdown()
+        if self.network is not None:
+            self.network.close()
+        if self.http_api is not None:
+            self.http_api.stop()
+
+    def create_player(self):
+        """Create the playbin with the configured output; also used to replace a failed one"""
+        self.player = Gst.ElementFactory.make("playbin", "player")
+        self.player.connect('deep-element-added', self.on_deep_element_added)
+        self.playback.set_player(self.player)
+        self.apply_audio_output()
+        apply_stream_buffering(self.player, self.settings["streaming"])
+        self.stream_buffering = StreamBufferController(self.player)
+
+        # Create bus to get events from GStreamer pipeline
+        bus = self.player.get_bus()
+        bus.add_signal_watch()
+        self.bus_handler_id = bus.connect('message', self.on_message)
+
+    def rebuild_player(self):
+        """Swap in a fresh playbin with the current sink, filters and volume"""
+        old_player = self.player
+        bus = old_player.get_bus()
+        bus.disconnect(self.bus_handler_id)
+        bus.remove_signal_watch()
+        # A wedged pipeline may take long to reach NULL, shut it down off the main loop
+        threading.Thread(target=old_player.set_state, args=(Gst.State.NULL,), daemon=True).start()
+
+        self.create_player()
+        self.apply_audio_filter()
+        self.player.set_property('volume', self.volume_scale.get_value() / 100.0)
+
+    def reconfigure_pipeline(self, configure):
+        """Run configure() with the pipeline in NULL state, then resume where we were"""
+        # Sinks and filters can only be swapped in NULL state, so remember where we were
+        resume_state = None
+        if self.player.get_property('uri') and self.playback.target in (Gst.State.PLAYING, Gst.State.PAUSED):
+            resume_state = self.playback.target
+            success, position = self.player.query_position(Gst.Format.TIME)
+            if success:
+                self.pending_seek = position
+
+        self.playback.request(Gst.State.NULL)
+        configure()
+        if resume_state is not None:
+            self.playback.request(resume_state)
+
+    def apply_audio_output(self):
+        """(Re)create the audio sink from settings, keeping the current position"""
+        output_settings = self.settings["audio_output"]
+
+        def configure():
+            sink = build_audio_sink(output_settings)
+            self.audio_stats.reset()
+            self.audio_stats.attach(sink)
+            self.player.set_property('audio-sink', self.apply_network_output(sink))
+            apply_playbin_flags(self.player, output_settings)
+
+        self.reconfigure_pipeline(configure)
+
+    def apply_network_output(self, sink):
+        """Start or stop the network sender; returns the sink to give playbin"""
+        network_settings = self.settings["network"]
+        if not network_settings["enabled"]:
+            if self.network is not None:
+                self.network.close()
+                self.network = None
+                # Back to the clock and latency playbin picks itself
+                NetworkOutput.detach(self.player)
+            return sink
+
+        if self.network is None:
+            try:
+                self.network = NetworkOutput(network_settings)
+            except OSError as e:
+                print(f"Error starting network output: {e}")
+                return sink
+        return self.network.attach(self.player, sink)
+
+    def apply_audio_filter(self):
+        """(Re)build playbin's audio-filter bin from the DSP and visualizer settings"""
+        visualizer_settings = self.settings["visualizer"]
+        # Bit-perfect output can't go through filters that convert and alter the samples
+        passthrough = self.settings["audio_output"]["passthrough"]
+
+        def configure():
+            self.dsp = None
+            if self.settings["dsp"]["enabled"] and not passthrough:
+                self.dsp = DSPChain()
+                self.dsp.attach_probes()
+            self.spectrum = None
+            if visualizer_settings["enabled"] and not passthrough:
+                self.spectrum = create_spectrum_element(visualizer_settings)
+            # The spectrum goes last so it shows the equalized signal
+            elements = (self.dsp.elements() if self.dsp else []) + [self.spectrum]
+            self.player.set_property('audio-filter', build_audio_filter(elements))
+
+        self.reconfigure_pipeline(configure)
+        self.apply_track_preset(self.listening_track)
+        self.visualizer.set_element(self.spectrum)
+        self.visualizer.set_visible(self.spectrum is not None)
+        for button, name in ((self.equalizer_button, "Equalizer"), (self.visualizer_button, "Visualizer")):
+            button.set_sensitive(not passthrough)
+            button.set_tooltip_text(f"{name} (off during bit-perfect passthrough)" if passthrough else name)
+
+    def apply_track_preset(self, track):
+        """Hot-swap to the track's (or its album's) preset, falling back to the default one"""
+        if self.dsp is None:
+            return
+        dsp_settings = self.settings["dsp"]
+        name = self.library.preset_for(track) if track is not None else None
+        presets = all_presets(dsp_settings)
+        if name not in presets:
+            name = dsp_settings["preset"] if dsp_settings["preset"] in presets else "Flat"
+        if name != self.dsp.preset_name:
+            self.dsp.apply_preset(presets[name], name)
+
+    def on_visualizer_toggled(self, button):
+        self.settings["visualizer"]["enabled"] = button.get_active()
+        save_settings(self.settings)
+        self.apply_audio_filter()
+
+    def on_window_state_event(self, widget, event):
+        self.visualizer.set_active(not event.new_window_state & Gdk.WindowState.ICONIFIED)
+        return False
+
+    def on_deep_element_added(self, bin, sub_bin, element):
+        # autoaudiosink creates the real sink lazily, configure it when it shows up
+        configure_sink_element(element, self.settings["audio_output"])
+        # Network sources get a queue2 whose watermarks drive BUFFERING messages
+        configure_queue_element(element, self.settings["streaming"])
+
+    def on_audio_output_clicked(self, widget):
+        output_settings = self.settings["audio_output"]
+
+        dialog = Gtk.Dialog(title="Audio Output", parent=self)
+        dialog.add_buttons(
+            Gtk.STOCK_CLOSE, Gtk.ResponseType.CLOSE,
+            Gtk.STOCK_APPLY, Gtk.ResponseType.APPLY
+        )
+
+        box = dialog.get_content_area()
+        box.set_spacing(6)
+        box.set_margin_start(10)
+        box.set_margin_end(10)
+        box.set_margin_top(10)
+        box.set_margin_bottom(10)
+
+        grid = Gtk.Grid()
+        grid.set_column_spacing(10)
+        grid.set_row_spacing(6)
+
+        sink_combo = Gtk.ComboBoxText()
+        for sink_type in SINK_FACTORIES:
+            sink_combo.append(sink_type, sink_type)
+        sink_combo.set_active_id(output_settings["sink"])
+
+        device_entry = Gtk.Entry()
+        device_entry.set_text(output_settings["device"])
+        device_entry.set_placeholder_text("default")
+
+        file_entry = Gtk.Entry()
+        file_entry.set_text(output_settings["file_location"])
+        file_entry.set_placeholder_text("/tmp/output.wav")
+
+        buffer_spin = Gtk.SpinButton.new_with_range(10, 2000, 10)
+        buffer_spin.set_value(output_settings["buffer_time_ms"])
+
+        latency_spin = Gtk.SpinButton.new_with_range(1, 500, 1)
+        latency_spin.set_value(output_settings["latency_time_ms"])
+
+        passthrough_check = Gtk.CheckButton(label="Bit-perfect passthrough")
+        passthrough_check.set_active(output_settings["passthrough"])
+        passthrough_check.set_tooltip_text("Disable software volume and format conversion")
+        passthrough_warning = Gtk.Label(label="Passthrough turns off the equalizer and the visualizer")
+        passthrough_warning.set_halign(Gtk.Align.START)
+        passthrough_warning.set_no_show_all(True)
+        passthrough_warning.set_visible(passthrough_check.get_active())
+        passthrough_check.connect("toggled", lambda check: passthrough_warning.set_visible(check.get_active()))
+
+        network_settings = self.settings["network"]
+        network_check = Gtk.CheckButton(label="Send to network receivers (RTP/Opus)")
+        network_check.set_active(network_settings["enabled"])
+        network_check.set_tooltip_text("Receivers run: main.py --receive <this host>")
+
+        network_address_entry = Gtk.Entry()
+        network_address_entry.set_text(network_settings["address"])
+
+        network_latency_spin = Gtk.SpinButton.new_with_range(50, 5000, 10)
+        network_latency_spin.set_value(network_settings["latency_ms"])
+
+        rows = [
+            ("Sink:", sink_combo),
+            ("Device:", device_entry),
+            ("File location:", file_entry),
+            ("Buffer time (ms):", buffer_spin),
+            ("Latency time (ms):", latency_spin),
+        ]
+        for i, (text, widget) in enumerate(rows):
+            label = Gtk.Label(label=text)
+            label.set_halign(Gtk.Align.START)
+            grid.attach(label, 0, i, 1, 1)
+            grid.attach(widget, 1, i, 1, 1)
+        grid.attach(passthrough_check, 0, len(rows), 2, 1)
+        grid.attach(passthrough_warning, 0, len(rows) + 1, 2, 1)
+
+        network_rows = [
+            ("Network address:", network_address_entry),
+            ("Network latency (ms):", network_latency_spin),
+        ]
+        grid.attach(network_check, 0, len(rows) + 2, 2, 1)
+        for i, (text, widget) in enumerate(network_rows, len(rows) + 3):
+            label = Gtk.Label(label=text)
+            label.set_halign(Gtk.Align.START)
+            grid.attach(label, 0, i, 1, 1)
+            grid.attach(widget, 1, i, 1, 1)
+
+        stats_frame = Gtk.Frame(label="Statistics")
+        stats_label = Gtk.Label(label="")
+        stats_label.set_halign(Gtk.Align.START)
+        stats_label.set_margin_start(6)
+        stats_label.set_margin_end(6)
+        stats_label.set_margin_top(6)
+        stats_label.set_margin_bottom(6)
+        stats_frame.add(stats_label)
+
+        box.add(grid)
+        box.add(stats_frame)
+
+        def refresh_stats():
+            self.audio_stats.update_latency(self.player)
+            text = self.audio_stats.summary(self.settings["audio_output"])
+            if self.network is not None:
+                text += "\n" + self.network.drift.summary()
+            stats_label.set_text(text)
+            return True
+
+        refresh_stats()
+        stats_timeout_id = GLib.timeout_add(1000, refresh_stats)
+
+        dialog.show_all()
+        while dialog.run() == Gtk.ResponseType.APPLY:
+            output_settings["sink"] = sink_combo.get_active_id() or "auto"
+            output_settings["device"] = device_entry.get_text().strip()
+            output_settings["file_location"] = file_entry.get_text().strip()
+            output_settings["buffer_time_ms"] = int(buffer_spin.get_value())
+            output_settings["latency_time_ms"] = int(latency_spin.get_value())
+            passthrough_changed = output_settings["passthrough"] != passthrough_check.get_active()
+            output_settings["passthrough"] = passthrough_check.get_active()
+            network_settings["enabled"] = network_check.get_active()
+            network_settings["address"] = network_address_entry.get_text().strip() or "239.255.42.42"
+            network_settings["latency_ms"] = int(network_latency_spin.get_value())
+            save_settings(self.settings)
+            self.apply_audio_output()
+            if passthrough_changed:
+                self.apply_audio_filter()
+            refresh_stats()
+
+        GLib.source_remove(stats_timeout_id)
+        dialog.destroy()
+
     def update_view(self):
         """Switch between welcome screen and player view based on playlist content"""
-        if len(self.playlist_store) > 0:
+        if self.library_button.get_active():
+            self.stack.set_visible_child_name("library")
+        elif len(self.playlist_store) > 0:
             self.stack.set_visible_child_name("player")
         else:
             self.stack.set_visible_child_name("welcome")
@@ -97,6 +580,7 @@ class MusicPlayerWindow(Gtk.Window):
     def create_now_playing_section(self):
         # Create frame for now playing section
         frame = Gtk.Frame(label="Now Playing")
+        self.now_playing_frame = frame
         frame.set_margin_start(10)
         frame.set_margin_end(10)
         frame.set_margin_top(10)
@@ -156,10 +640,13 @@ class MusicPlayerWindow(Gtk.Window):
         track_info_grid.attach(date_label, 0, 3, 1, 1)
         track_info_grid.attach(self.date_value, 1, 3, 1, 1)
 
+        # Spectrum visualizer, shown when enabled
+        self.visualizer = SpectrumVisualizer(self.settings["visualizer"])
+        self.visualizer.set_no_show_all(True)
+
         # Progress bar
-        self.progress_bar = Gtk.Scale.new_with_range(Gtk.Orientation.HORIZONTAL, 0, 100, 1)
-        self.progress_bar.set_draw_value(False)
-        self.progress_bar.connect('change-value', self.on_progress_changed)
+        self.progress_bar = WaveformSeekBar()
+        self.progress_bar.connect('seek', self.on_progress_changed)
 
         # Time labels
         time_box = Gtk.Box(orientation=Gtk.Orientation.HORIZONTAL, spacing=5)
@@ -170,11 +657,25 @@ class MusicPlayerWindow(Gtk.Window):
 
         # Pack everything
         info_box.pack_start(track_info_grid, False, False, 0)
+        info_box.pack_start(self.visualizer, True, True, 0)
         info_box.pack_start(self.progress_bar, True, True, 0)
         info_box.pack_start(time_box, False, False, 0)
 
+        # Lyrics panel, shown from the header bar
+        self.lyrics_view = Gtk.TextView()
+        self.lyrics_view.set_editable(False)
+        self.lyrics_view.set_cursor_visible(False)
+        self.lyrics_view.set_wrap_mode(Gtk.WrapMode.WORD)
+        self.lyrics_view.set_justification(Gtk.Justification.CENTER)
+        self.lyrics_view.get_buffer().create_tag("current", weight=700, scale=1.2)
+        self.lyrics_panel = Gtk.ScrolledWindow()
+        self.lyrics_panel.set_size_request(260, 200)
+        self.lyrics_panel.add(self.lyrics_view)
+        self.lyrics_panel.set_no_show_all(True)
+
         now_playing_box.pack_start(self.album_art, False, False, 0)
         now_playing_box.pack_start(info_box, True, True, 0)
+        now_playing_box.pack_end(self.lyrics_panel, False, False, 0)
 
         frame.add(now_playing_box)
         self.player_view.pack_start(frame, False, False, 0)
@@ -184,53 +685,37 @@ class MusicPlayerWindow(Gtk.Window):
         scrolled.set_hexpand(True)
         scrolled.set_vexpand(True)
 
-        # Create ListStore with columns
-        self.playlist_store = Gtk.ListStore(str, str, str, str, str, str, str)
+        # Create ListStore holding one Track object per row
+        self.playlist_store = Gtk.ListStore(GObject.TYPE_PYOBJECT)
 
         # Create TreeView
         self.playlist_view = Gtk.TreeView(model=self.playlist_store)
+        self.playlist_view.get_selection().set_mode(Gtk.SelectionMode.MULTIPLE)
 
         # Connect double-click handler
         self.playlist_view.connect('row-activated', self.on_row_activated)
 
         self.playlist_view.connect('button-press-event', self.on_playlist_button_press)
 
-        # Add columns
-        renderer = Gtk.CellRendererText()
-
-        # Filename column (with track numbers)
-        filename_column = Gtk.TreeViewColumn("Filename", renderer, text=1)
-        filename_column.set_expand(True)
-        filename_column.set_sort_column_id(1)
-        self.playlist_view.append_column(filename_column)
-
-        # Title column from metadata
-        title_column = Gtk.TreeViewColumn("Title", renderer, text=2)
-        title_column.set_expand(True)
-        title_column.set_sort_column_id(2)
-        self.playlist_view.append_column(title_column)
-
-        # Artist column
-        artist_column = Gtk.TreeViewColumn("Artist", renderer, text=3)
-        artist_column.set_expand(True)
-        artist_column.set_sort_column_id(3)
-        self.playlist_view.append_column(artist_column)
-
-        # Album column
-        album_column = Gtk.TreeViewColumn("Album", renderer, text=4)
-        album_column.set_expand(True)
-        album_column.set_sort_column_id(4)
-        self.playlist_view.append_column(album_column)
-
-        # Year column
-        year_column = Gtk.TreeViewColumn("Year", renderer, text=5)
-        year_column.set_sort_column_id(5)
-        self.playlist_view.append_column(year_column)
-
-        # Duration column
-        duration_column = Gtk.TreeViewColumn("Duration", renderer, text=6)
-        duration_column.set_sort_column_id(6)
-        self.playlist_view.append_column(duration_column)
+        # Columns render and sort straight from the Track fields
+        columns = [
+            ("Filename", lambda track: track.filename, lambda track: track.filename.lower(), True),
+            ("Title", lambda track: track.title, lambda track: track.title.lower(), True),
+            ("Artist", lambda track: track.artist, lambda track: track.artist.lower(), True),
+            ("Album", lambda track: track.album, lambda track: track.album.lower(), True),
+            ("Year", lambda track: str(track.year) if track.year else "", lambda track: track.year, False),
+            ("Duration", lambda track: self.format_time(track.duration_ms / 1000) if track.duration_ms else "",
+             lambda track: track.duration_ms, False),
+        ]
+
+        for sort_id, (name, get_text, get_key, expand) in enumerate(columns):
+            renderer = Gtk.CellRendererText()
+            column = Gtk.TreeViewColumn(name, renderer)
+            column.set_cell_data_func(renderer, self.track_cell_data_func, get_text)
+            column.set_expand(expand)
+            column.set_sort_column_id(sort_id)
+            self.playlist_store.set_sort_func(sort_id, self.track_sort_func, get_key)
+            self.playlist_view.append_column(column)
 
         # Add remove button column
         renderer_remove = Gtk.CellRendererPixbuf()
@@ -241,6 +726,14 @@ class MusicPlayerWindow(Gtk.Window):
         scrolled.add(self.playlist_view)
         self.player_view.pack_start(scrolled, True, True, 0)
 
+    def track_cell_data_func(self, column, cell, model, iter, get_text):
+        cell.set_property('text', get_text(model[iter][0]))
+
+    def track_sort_func(self, model, iter_a, iter_b, get_key):
+        key_a = get_key(model[iter_a][0])
+        key_b = get_key(model[iter_b][0])
+        return (key_a > key_b) - (key_a < key_b)
+
     def create_welcome_screen(self):
         # Create main container for welcome screen
         welcome_box = Gtk.Box(orientation=Gtk.Orientation.VERTICAL, spacing=20)
@@ -311,9 +804,27 @@ class MusicPlayerWindow(Gtk.Window):
         load_playlist_button.connect("clicked", self.on_load_playlist_clicked)
         load_playlist_button.set_size_request(25, 25)
 
+        # Smart playlists button
+        smart_playlists_button = Gtk.Button()
+        smart_icon = Gtk.Image.new_from_icon_name("starred", Gtk.IconSize.SMALL_TOOLBAR)
+        smart_playlists_button.add(smart_icon)
+        smart_playlists_button.set_tooltip_text("Smart Playlists")
+        smart_playlists_button.connect("clicked", self.on_smart_playlists_clicked)
+        smart_playlists_button.set_size_request(25, 25)
+
+        # Export playlist button
+        export_button = Gtk.Button()
+        export_icon = Gtk.Image.new_from_icon_name("document-send", Gtk.IconSize.SMALL_TOOLBAR)
+        export_button.add(export_icon)
+        export_button.set_tooltip_text("Export Playlist")
+        export_button.connect("clicked", self.on_export_clicked)
+        export_button.set_size_request(25, 25)
+
         # Add playlist buttons to the left box
         playlist_box.pack_start(save_playlist_button, False, False, 0)
         playlist_box.pack_start(load_playlist_button, False, False, 0)
+        playlist_box.pack_start(smart_playlists_button, False, False, 0)
+        playlist_box.pack_start(export_button, False, False, 0)
 
         # Create center box for controls with fixed width
         control_box = Gtk.Box(spacing=6)
@@ -337,22 +848,22 @@ class MusicPlayerWindow(Gtk.Window):
         # Previous button
         self.prev_button = Gtk.Button.new_from_icon_name("media-skip-backward", Gtk.IconSize.LARGE_TOOLBAR)
         self.prev_button.set_size_request(45, 45)
-        self.prev_button.connect("clicked", self.on_prev)
+        self.prev_button.connect("clicked", lambda button: self.commands.dispatch("skip", -1))
 
         # Play/Pause button
         self.play_pause_button = Gtk.Button.new_from_icon_name("media-playback-start", Gtk.IconSize.LARGE_TOOLBAR)
         self.play_pause_button.set_size_request(45, 45)
-        self.play_pause_button.connect("clicked", self.on_play_pause_clicked)
+        self.play_pause_button.connect("clicked", lambda button: self.commands.dispatch("play_pause"))
 
         # Stop button
         self.stop_button = Gtk.Button.new_from_icon_name("media-playback-stop", Gtk.IconSize.LARGE_TOOLBAR)
         self.stop_button.set_size_request(45, 45)
-        self.stop_button.connect("clicked", self.on_stop)
+        self.stop_button.connect("clicked", lambda button: self.commands.dispatch("stop"))
 
         # Next button
         self.next_button = Gtk.Button.new_from_icon_name("media-skip-forward", Gtk.IconSize.LARGE_TOOLBAR)
         self.next_button.set_size_request(45, 45)
-        self.next_button.connect("clicked", self.on_next)
+        self.next_button.connect("clicked", lambda button: self.commands.dispatch("skip", 1))
 
         # Volume control frame
         volume_frame = Gtk.Frame()
@@ -369,7 +880,7 @@ class MusicPlayerWindow(Gtk.Window):
         self.volume_button = Gtk.Button()
         self.volume_icon = Gtk.Image.new_from_icon_name("audio-volume-high", Gtk.IconSize.SMALL_TOOLBAR)
         self.volume_button.add(self.volume_icon)
-        self.volume_button.connect("clicked", self.on_volume_button_clicked)
+        self.volume_button.connect("clicked", lambda button: self.commands.dispatch("mute"))
 
         # Volume slider
         self.volume_scale = Gtk.Scale.new_with_range(Gtk.Orientation.HORIZONTAL, 0, 100, 1)
@@ -416,17 +927,17 @@ class MusicPlayerWindow(Gtk.Window):
 
     def on_shuffle_toggled(self, button):
         self.shuffle_enabled = button.get_active()
+        self.schedule_session_save()
         if self.shuffle_enabled:
             # Create a shuffled version of the playlist
             import random
-            rows = [(row[0], row[1], row[2], row[3], row[4], row[5], row[6])
-                    for row in self.playlist_store]
-            random.shuffle(rows)
+            tracks = [row[0] for row in self.playlist_store]
+            random.shuffle(tracks)
 
             # Clear and refill the playlist store
             self.playlist_store.clear()
-            for row in rows:
-                self.playlist_store.append(row)
+            for track in tracks:
+                self.playlist_store.append([track])
 
             # Update current track index if a track is playing
             if self.current_track_index != -1:
@@ -434,104 +945,122 @@ class MusicPlayerWindow(Gtk.Window):
                 current_uri = self.player.get_property('uri')
                 if current_uri:
                     for i, row in enumerate(self.playlist_store):
-                        if GLib.filename_to_uri(row[0]) == current_uri:
+                        if to_uri(row[0].path) == current_uri:
                             self.current_track_index = i
                             break
 
     def on_repeat_toggled(self, button):
         self.repeat_enabled = button.get_active()
+        self.schedule_session_save()
 
     def get_metadata(self, file_path):
-        try:
-            filename = os.path.basename(file_path)
-            display_name = os.path.splitext(filename)[0]
-
-            # Initialize metadata values
-            title = "Unknown"
-            artist = "Unknown"
-            album = "Unknown"
-            year = ""
-            duration = ""
-            artwork = None
-
-            audio = File(file_path)
-
-            if audio:
-                if hasattr(audio.info, 'length'):
-                    duration = self.format_time(audio.info.length)
-
-                # MP3 Files
-                if hasattr(audio, 'tags') and hasattr(audio, 'ID3'):
-                    tags = audio.tags
-                    print("Processing as MP3")
-
-                    if 'TPE1' in tags:
-                        artist = str(tags['TPE1'])
-                    if 'TIT2' in tags:
-                        title = str(tags['TIT2'])
-                    if 'TALB' in tags:
-                        album = str(tags['TALB'])
-                    if 'TDRC' in tags:
-                        year = str(tags['TDRC'])
-
-                    # Get MP3 artwork
-                    for key in tags.keys():
-                        if key.startswith('APIC'):
-                            artwork_tag = tags[key]
-                            if artwork_tag:
-                                artwork = artwork_tag.data
-                                print(f"Found MP3 artwork, size: {len(artwork)} bytes")
-                                break
-
-                # FLAC Files
-                elif hasattr(audio, 'tags') and hasattr(audio.tags, 'get'):
-                    tags = audio.tags
-                    print("Processing as FLAC")
-
-                    artist = str(tags.get('artist', ['Unknown'])[0])
-                    title = str(tags.get('title', [display_name])[0])
-                    album = str(tags.get('album', ['Unknown'])[0])
-                    year = str(tags.get('date', [''])[0])
-
-                    # Get FLAC artwork
-                    if hasattr(audio, 'pictures'):
-                        if audio.pictures:
-                            picture = audio.pictures[0]
-                            artwork = picture.data
-                            print(f"Found FLAC artwork, size: {len(artwork)} bytes")
-
-                print(f"Metadata extracted - Title: {title}, Artist: {artist}, Album: {album}")
-                if artwork:
-                    print(f"Artwork found: {len(artwork)} bytes")
-                else:
-                    print("No artwork found in file")
+        """Read the tags of a file into a Track"""
+        if is_stream_uri(file_path):
+            # Stream titles arrive later as ICY tags while playing
+            return Track.for_stream(file_path)
 
-            return display_name, title, artist, album, year, duration, artwork
+        try:
+            return Track.from_record(file_path, read_metadata(file_path))
 
         except Exception as e:
             print(f"Error reading metadata for {file_path}: {e}")
-            return os.path.splitext(os.path.basename(file_path))[0], "Unknown", "Unknown", "Unknown", "", "", None
-
-    def add_music_files(self, file_paths):
+            return Track(file_path, title=os.path.splitext(os.path.basename(file_path))[0])
+
+    def add_track(self, file_path, position=None):
+        """Queue a file at position (default the end) unless the very same file is already queued"""
+        if not is_stream_uri(file_path):
+            same_file = self.dedup_index.find_same_file(file_path)
+            if same_file:
+                print(f"Skipping {file_path}: already queued as {same_file}")
+                return None
+
+        track = self.get_metadata(file_path)
+        if position is None:
+            self.playlist_store.append([track])
+        else:
+            self.playlist_store.insert(position, [track])
+            if position <= self.current_track_index:
+                self.current_track_index += 1
+        if not track.is_stream:
+            self.dedup_index.add(file_path, track.duration_ms)
+            self.queue_fingerprint(file_path)
+        return track
+
+    def queue_fingerprint(self, file_path):
+        dedup_settings = self.settings["dedup"]
+        if not dedup_settings["fingerprints"]:
+            return
+        if self.fingerprint_worker is None:
+            if not chromaprint_available():
+                print("GStreamer chromaprint element not found, fingerprinting disabled")
+                dedup_settings["fingerprints"] = False
+                return
+            self.fingerprint_worker = FingerprintWorker(dedup_settings["fingerprint_workers"])
+        self.fingerprint_worker.submit(file_path, self.dedup_index.set_fingerprint)
+
+    def queue_files(self, file_paths, position=None):
+        """Queue the files and streams that exist at position (default the end); returns the new tracks"""
+        tracks = []
         for file_path in file_paths:
-            if os.path.isfile(file_path):
-                filename, title, artist, album, year, duration, artwork = self.get_metadata(file_path)
-                self.playlist_store.append([file_path, filename, title, artist, album, year, duration])
+            if is_stream_uri(file_path) or os.path.isfile(file_path):
+                track = self.add_track(file_path, position)
+                if track:
+                    tracks.append(track)
+                    if position is not None:
+                        position += 1
+        return tracks
+
+    def add_music_files(self, file_paths, position=None):
+        self.add_to_library(self.queue_files(file_paths, position))
         self.update_view()
 
     def scan_directory(self, directory):
+        tracks = []
         for root, dirs, files in os.walk(directory):
             for file in files:
-                if self.is_music_file(file):
+                if is_temp_file(file):
+                    # From a tag write cut short by a crash or kill
+                    self.tag_writer.remove_leftover(os.path.join(root, file))
+                elif self.is_music_file(file):
                     file_path = os.path.join(root, file)
                     if os.path.isfile(file_path):
-                        filename, title, artist, album, year, duration, artwork = self.get_metadata(file_path)
-                        print(f"Found: {title} by {artist}")  # Debug print
-                        self.playlist_store.append([file_path, filename, title, artist, album, year, duration])
+                        track = self.add_track(file_path)
+                        if track:
+                            print(f"Found: {track.title} by {track.artist}")  # Debug print
+                            tracks.append(track)
+        self.add_to_library(tracks)
         self.update_view()
 
+    def add_to_library(self, tracks):
+        # One transaction per batch keeps scanning fast
+        try:
+            self.library.add_tracks(tracks)
+        except sqlite3.Error as e:
+            print(f"Error updating library: {e}")
+            return
+        if self.browser is not None and tracks:
+            self.browser.invalidate()
+
+    def on_library_toggled(self, button):
+        if button.get_active() and self.browser is None:
+            # Built on first use, most sessions never open it
+            self.browser = LibraryBrowser(self.library, self.thumbnails)
+            self.browser.connect('play-tracks', self.on_browser_play_tracks)
+            self.browser.show_all()
+            self.stack.add_named(self.browser, "library")
+        self.update_view()
+
+    def on_browser_play_tracks(self, browser, tracks):
+        if tracks:
+            self.library_button.set_active(False)
+            self.load_tracks(tracks)
+
     def is_music_file(self, filename):
-        music_extensions = {'.mp3', '.wav', '.flac', '.ogg', '.m4a', '.aac'}
+        if is_stream_uri(filename):
+            return True
+        if is_temp_file(filename):
+            return False
+        music_extensions = {'.mp3', '.wav', '.flac', '.ogg', '.opus', '.m4a', '.aac', '.ape', '.wv'}
         return os.path.splitext(filename)[1].lower() in music_extensions
 
     def on_file_clicked(self, widget):
@@ -559,12 +1088,16 @@ class MusicPlayerWindow(Gtk.Window):
         music_filter.add_mime_type("audio/ogg")
         music_filter.add_mime_type("audio/aac")
         music_filter.add_mime_type("audio/m4a")
+        music_filter.add_mime_type("audio/opus")
         music_filter.add_pattern("*.mp3")
         music_filter.add_pattern("*.wav")
         music_filter.add_pattern("*.flac")
         music_filter.add_pattern("*.ogg")
         music_filter.add_pattern("*.m4a")
         music_filter.add_pattern("*.aac")
+        music_filter.add_pattern("*.opus")
+        music_filter.add_pattern("*.ape")
+        music_filter.add_pattern("*.wv")
 
         dialog.add_filter(music_filter)
 
@@ -577,6 +1110,43 @@ class MusicPlayerWindow(Gtk.Window):
 
         dialog.destroy()
 
+    def on_location_clicked(self, widget):
+        dialog = Gtk.Dialog(title="Open Location", parent=self)
+        dialog.add_buttons(
+            Gtk.STOCK_CANCEL, Gtk.ResponseType.CANCEL,
+            Gtk.STOCK_OPEN, Gtk.ResponseType.OK
+        )
+        dialog.set_default_response(Gtk.ResponseType.OK)
+
+        box = dialog.get_content_area()
+        box.set_spacing(6)
+        box.set_margin_start(10)
+        box.set_margin_end(10)
+        box.set_margin_top(10)
+        box.set_margin_bottom(10)
+
+        label = Gtk.Label(label="Stream URL (http, https or Icecast):")
+        label.set_halign(Gtk.Align.START)
+        box.add(label)
+
+        entry = Gtk.Entry()
+        entry.set_width_chars(50)
+        entry.set_placeholder_text("http://example.com:8000/stream")
+        entry.set_activates_default(True)
+        box.add(entry)
+
+        dialog.show_all()
+        response = dialog.run()
+
+        if response == Gtk.ResponseType.OK:
+            location = entry.get_text().strip()
+            if is_stream_uri(location):
+                self.add_music_files([location])
+            elif location:
+                print(f"Not a stream URL: {location}")
+
+        dialog.destroy()
+
     def on_folder_clicked(self, widget):
         dialog = Gtk.FileChooserDialog(
             title="Select Music Folder",
@@ -608,46 +1178,458 @@ class MusicPlayerWindow(Gtk.Window):
                 if column == treeview.get_columns()[-1]:  # Last column (remove button)
                     self.remove_track(path)
                     return True
+        elif event.button == 3:  # Right click
+            path = treeview.get_path_at_pos(int(event.x), int(event.y))
+            if path:
+                selection = treeview.get_selection()
+                if not selection.path_is_selected(path[0]):
+                    selection.unselect_all()
+                    selection.select_path(path[0])
+                self.show_playlist_menu(event)
+                return True
+        return False
+
+    def show_playlist_menu(self, event):
+        menu = Gtk.Menu()
+        edit_item = Gtk.MenuItem(label="Edit Tags...")
+        edit_item.connect("activate", lambda item: self.edit_tags(self.selected_tracks()))
+        menu.append(edit_item)
+        menu.show_all()
+        menu.attach_to_widget(self.playlist_view, None)
+        menu.popup_at_pointer(event)
+
+    def selected_tracks(self):
+        """Tracks of the selected playlist rows, in playlist order (streams excluded)"""
+        model, paths = self.playlist_view.get_selection().get_selected_rows()
+        tracks = [model[path][0] for path in paths]
+        return [track for track in tracks if not track.is_stream]
+
+    def edit_tags(self, tracks):
+        """Edit artist/album/year/track number/artwork of one or many tracks"""
+        if not tracks:
+            return
+
+        dialog = Gtk.Dialog(title=f"Edit Tags ({len(tracks)} tracks)" if len(tracks) > 1 else "Edit Tags",
+                            parent=self)
+        dialog.add_buttons(
+            Gtk.STOCK_CANCEL, Gtk.ResponseType.CANCEL,
+            Gtk.STOCK_SAVE, Gtk.ResponseType.OK
+        )
+
+        box = dialog.get_content_area()
+        box.set_spacing(6)
+        box.set_margin_start(10)
+        box.set_margin_end(10)
+        box.set_margin_top(10)
+        box.set_margin_bottom(10)
+
+        def common(get_value):
+            # Prefill only values all tracks agree on
+            values = {get_value(track) for track in tracks}
+            return values.pop() if len(values) == 1 else None
+
+        grid = Gtk.Grid()
+        grid.set_column_spacing(10)
+        grid.set_row_spacing(6)
+
+        # Only ticked fields are written, so a multi-track edit can change just the album
+        checks = {}
+
+        def add_row(row, field, text, widget):
+            check = Gtk.CheckButton(label=text)
+            checks[field] = check
+            widget.connect("changed", lambda w: check.set_active(True))
+            grid.attach(check, 0, row, 1, 1)
+            grid.attach(widget, 1, row, 1, 1)
+
+        artist_entry = Gtk.Entry()
+        artist_entry.set_text(common(lambda track: track.artist) or "")
+        album_entry = Gtk.Entry()
+        album_entry.set_text(common(lambda track: track.album) or "")
+        year_spin = Gtk.SpinButton.new_with_range(0, 9999, 1)
+        year_spin.set_value(common(lambda track: track.year) or 0)
+        track_spin = Gtk.SpinButton.new_with_range(0, 999, 1)
+        track_spin.set_value(common(lambda track: track.track_no) or (1 if len(tracks) > 1 else 0))
+        artwork_chooser = Gtk.FileChooserButton(title="Select Artwork")
+        image_filter = Gtk.FileFilter()
+        image_filter.set_name("Images")
+        image_filter.add_mime_type("image/jpeg")
+        image_filter.add_mime_type("image/png")
+        artwork_chooser.add_filter(image_filter)
+
+        add_row(0, "artist", "Artist:", artist_entry)
+        add_row(1, "album", "Album:", album_entry)
+        add_row(2, "year", "Year:", year_spin)
+        add_row(3, "track_no", "Track (numbered from):" if len(tracks) > 1 else "Track:", track_spin)
+        checks["artwork"] = Gtk.CheckButton(label="Artwork:")
+        artwork_chooser.connect("file-set", lambda w: checks["artwork"].set_active(True))
+        grid.attach(checks["artwork"], 0, 4, 1, 1)
+        grid.attach(artwork_chooser, 1, 4, 1, 1)
+        for check in checks.values():
+            check.set_active(False)
+
+        box.add(grid)
+        dialog.show_all()
+
+        response = dialog.run()
+        changes = {}
+        if checks["artist"].get_active():
+            changes["artist"] = artist_entry.get_text().strip()
+        if checks["album"].get_active():
+            changes["album"] = album_entry.get_text().strip()
+        if checks["year"].get_active():
+            changes["year"] = int(year_spin.get_value())
+        artwork_file = artwork_chooser.get_filename()
+        dialog.destroy()
+        if response != Gtk.ResponseType.OK:
+            return
+
+        if checks["artwork"].get_active() and artwork_file:
+            try:
+                with open(artwork_file, 'rb') as f:
+                    changes["artwork"] = f.read()
+            except OSError as e:
+                print(f"Error reading artwork {artwork_file}: {e}")
+
+        per_track = []
+        first_number = int(track_spin.get_value())
+        for i, track in enumerate(tracks):
+            track_changes = dict(changes)
+            if checks["track_no"].get_active():
+                track_changes["track_no"] = first_number + i
+            if track_changes:
+                per_track.append((track, track_changes))
+        self.apply_tag_changes(per_track)
+
+    def apply_tag_changes(self, per_track):
+        """Update tracks, rows and the library right away; the files are written in the background"""
+        for track, changes in per_track:
+            for field, value in changes.items():
+                if field == "artwork":
+                    track.artwork_hash = artwork_hash(value)
+                else:
+                    setattr(track, field, value)
+            self.tag_writer.submit(track.path, changes)
+
+        self.refresh_track_rows({track.path for track, changes in per_track})
+        self.add_to_library([track for track, changes in per_track])
+        self.session.invalidate_queue()
+        self.schedule_session_save()
+
+    def refresh_track_rows(self, paths):
+        """Redraw rows (and the Now Playing labels) of tracks whose fields changed in place"""
+        for row in self.playlist_store:
+            if row[0].path in paths:
+                self.playlist_store.row_changed(row.path, row.iter)
+
+        if 0 <= self.current_track_index < len(self.playlist_store):
+            track = self.playlist_store[self.current_track_index][0]
+            if track.path in paths:
+                self.artist_value.set_text(track.artist)
+                self.album_value.set_text(track.album)
+                self.date_value.set_text(str(track.year) if track.year else "")
+
+    def on_tags_written(self, file_path, changes, error):
+        if error is None:
+            return False
+        # The write failed, show what is really in the file again
+        fresh = self.get_metadata(file_path)
+        tracks = [row[0] for row in self.playlist_store if row[0].path == file_path]
+        for track in tracks:
+            for field in Track.__slots__[1:]:
+                setattr(track, field, getattr(fresh, field))
+        self.refresh_track_rows({file_path})
+        self.add_to_library(tracks)
+        self.session.invalidate_queue()
+        self.schedule_session_save()
         return False
 
     def remove_track(self, path):
         iter = self.playlist_store.get_iter(path)
         if iter:
             if path.get_indices()[0] == self.current_track_index:
-                self.player.set_state(Gst.State.NULL)
+                self.record_listen()
+                self.playback.request(Gst.State.NULL)
                 self.update_now_playing_label("No track playing")
                 self.update_play_pause_button_icon(False)
                 self.current_track_index = -1
             elif path.get_indices()[0] < self.current_track_index:
                 self.current_track_index -= 1
+            self.dedup_index.remove(self.playlist_store[iter][0].path)
             self.playlist_store.remove(iter)
             self.update_view()
 
-    def on_play(self, button):
-        self.player.set_state(Gst.State.PLAYING)
+    def remove_paths(self, paths):
+        """Remove every queued track whose path is in paths"""
+        for index in reversed(range(len(self.playlist_store))):
+            if self.playlist_store[index][0].path in paths:
+                self.remove_track(Gtk.TreePath.new_from_indices([index]))
 
-    def on_pause(self, button):
-        self.player.set_state(Gst.State.PAUSED)
+    def on_equalizer_clicked(self, widget):
+        dsp_settings = self.settings["dsp"]
 
-    def on_play_pause_clicked(self, button):
-        success, state, pending = self.player.get_state(Gst.CLOCK_TIME_NONE)
+        dialog = Gtk.Dialog(title="Equalizer", parent=self)
+        dialog.add_buttons(Gtk.STOCK_CLOSE, Gtk.ResponseType.CLOSE)
 
-        if state == Gst.State.PLAYING:
-            self.player.set_state(Gst.State.PAUSED)
+        box = dialog.get_content_area()
+        box.set_spacing(6)
+        box.set_margin_start(10)
+        box.set_margin_end(10)
+        box.set_margin_top(10)
+        box.set_margin_bottom(10)
+
+        enable_check = Gtk.CheckButton(label="Enable equalizer")
+        enable_check.set_active(dsp_settings["enabled"])
+
+        preset_combo = Gtk.ComboBoxText()
+
+        def fill_presets():
+            preset_combo.remove_all()
+            for name in all_presets(dsp_settings):
+                preset_combo.append(name, name)
+
+        fill_presets()
+        preset_combo.set_active_id(self.dsp.preset_name if self.dsp else dsp_settings["preset"])
+
+        preset_box = Gtk.Box(spacing=6)
+        preset_box.pack_start(Gtk.Label(label="Preset:"), False, False, 0)
+        preset_box.pack_start(preset_combo, True, True, 0)
+
+        # One vertical slider per band
+        bands_box = Gtk.Box(spacing=4, homogeneous=True)
+        band_scales = []
+        for frequency in BAND_FREQUENCIES:
+            scale = Gtk.Scale.new_with_range(Gtk.Orientation.VERTICAL, -24, 12, 0.5)
+            scale.set_inverted(True)
+            scale.set_size_request(-1, 160)
+            scale.add_mark(0, Gtk.PositionType.LEFT, None)
+            column = Gtk.Box(orientation=Gtk.Orientation.VERTICAL, spacing=2)
+            column.pack_start(scale, True, True, 0)
+            label = f"{frequency // 1000}k" if frequency >= 1000 else str(frequency)
+            column.pack_start(Gtk.Label(label=label), False, False, 0)
+            bands_box.pack_start(column, True, True, 0)
+            band_scales.append(scale)
+
+        compressor_check = Gtk.CheckButton(label="Compressor")
+        balance_scale = Gtk.Scale.new_with_range(Gtk.Orientation.HORIZONTAL, -1, 1, 0.05)
+        balance_scale.add_mark(0, Gtk.PositionType.BOTTOM, None)
+        balance_box = Gtk.Box(spacing=6)
+        balance_box.pack_start(Gtk.Label(label="Balance:"), False, False, 0)
+        balance_box.pack_start(balance_scale, True, True, 0)
+
+        save_entry = Gtk.Entry()
+        save_entry.set_placeholder_text("Preset name")
+        save_button = Gtk.Button(label="Save Preset")
+        save_box = Gtk.Box(spacing=6)
+        save_box.pack_start(save_entry, True, True, 0)
+        save_box.pack_start(save_button, False, False, 0)
+
+        track_button = Gtk.Button(label="Use for This Track")
+        album_button = Gtk.Button(label="Use for This Album")
+        clear_button = Gtk.Button(label="Clear Assignment")
+        assign_box = Gtk.Box(spacing=6)
+        for button in (track_button, album_button, clear_button):
+            assign_box.pack_start(button, True, True, 0)
+
+        stats_label = Gtk.Label(label="")
+        stats_label.set_halign(Gtk.Align.START)
+
+        for child in (enable_check, preset_box, bands_box, compressor_check, balance_box,
+                      save_box, assign_box, stats_label):
+            box.pack_start(child, False, False, 0)
+
+        updating = [False]
+
+        def show_current():
+            # Reflect the live elements without feeding the values back into them
+            updating[0] = True
+            if self.dsp is not None:
+                for scale, gain in zip(band_scales, self.dsp.band_gains()):
+                    scale.set_value(gain)
+                compressor_check.set_active(self.dsp.compressor_enabled)
+                balance_scale.set_value(self.dsp.balance_value)
+            for control in (preset_box, bands_box, compressor_check, balance_box, save_box):
+                control.set_sensitive(self.dsp is not None)
+            assign_box.set_sensitive(self.dsp is not None and self.listening_track is not None)
+            updating[0] = False
+
+        def on_enable_toggled(button):
+            dsp_settings["enabled"] = button.get_active()
+            save_settings(self.settings)
+            self.apply_audio_filter()
+            show_current()
+
+        def on_preset_changed(combo):
+            name = combo.get_active_id()
+            if updating[0] or self.dsp is None or name is None:
+                return
+            dsp_settings["preset"] = name
+            save_settings(self.settings)
+            self.dsp.apply_preset(all_presets(dsp_settings)[name], name)
+            show_current()
+
+        def on_band_changed(scale, index):
+            if not updating[0] and self.dsp is not None:
+                self.dsp.set_band_gain(index, scale.get_value())
+
+        def on_compressor_toggled(button):
+            if not updating[0] and self.dsp is not None:
+                self.dsp.set_compressor(button.get_active())
+
+        def on_balance_changed(scale):
+            if not updating[0] and self.dsp is not None:
+                self.dsp.set_balance(scale.get_value())
+
+        def on_save_clicked(button):
+            name = save_entry.get_text().strip()
+            if not name or name in BUILTIN_PRESETS or self.dsp is None:
+                return
+            dsp_settings["presets"][name] = self.dsp.current_preset()
+            save_settings(self.settings)
+            self.dsp.preset_name = name
+            updating[0] = True
+            fill_presets()
+            preset_combo.set_active_id(name)
+            updating[0] = False
+            save_entry.set_text("")
+
+        def on_assign_clicked(button, scope):
+            name = preset_combo.get_active_id()
+            if self.listening_track is not None and name:
+                self.library.assign_preset(scope, self.listening_track, name)
+
+        def on_clear_clicked(button):
+            if self.listening_track is not None:
+                self.library.assign_preset("track", self.listening_track, None)
+                self.library.assign_preset("album", self.listening_track, None)
+                self.apply_track_preset(self.listening_track)
+                show_current()
+
+        enable_check.connect("toggled", on_enable_toggled)
+        preset_combo.connect("changed", on_preset_changed)
+        for i, scale in enumerate(band_scales):
+            scale.connect("value-changed", on_band_changed, i)
+        compressor_check.connect("toggled", on_compressor_toggled)
+        balance_scale.connect("value-changed", on_balance_changed)
+        save_button.connect("clicked", on_save_clicked)
+        track_button.connect("clicked", on_assign_clicked, "track")
+        album_button.connect("clicked", on_assign_clicked, "album")
+        clear_button.connect("clicked", on_clear_clicked)
+
+        def refresh_stats():
+            stats_label.set_text(self.dsp.summary() if self.dsp else "Equalizer disabled")
+            return True
+
+        show_current()
+        refresh_stats()
+        stats_timeout_id = GLib.timeout_add(1000, refresh_stats)
+
+        dialog.show_all()
+        dialog.run()
+        GLib.source_remove(stats_timeout_id)
+        dialog.destroy()
+
+    def on_find_duplicates_clicked(self, widget):
+        self.dedup_index.stat_pending()
+        dedup_settings = self.settings["dedup"]
+
+        groups = [("Identical content", paths) for paths in self.dedup_index.content_groups()]
+        groups += [("Same recording", paths)
+                   for paths in self.dedup_index.recording_groups(dedup_settings["similarity"])]
+
+        dialog = Gtk.Dialog(title="Find Duplicates", parent=self)
+        dialog.add_buttons(
+            Gtk.STOCK_CLOSE, Gtk.ResponseType.CLOSE,
+            Gtk.STOCK_REMOVE, Gtk.ResponseType.OK
+        )
+        dialog.set_default_size(600, 400)
+
+        box = dialog.get_content_area()
+        box.set_spacing(6)
+        box.set_margin_start(10)
+        box.set_margin_end(10)
+        box.set_margin_top(10)
+        box.set_margin_bottom(10)
+
+        if dedup_settings["fingerprints"]:
+            pending = self.dedup_index.pending_fingerprints()
+            for path in pending:
+                self.queue_fingerprint(path)
+            if pending:
+                status = Gtk.Label(label=f"Fingerprinting {len(pending)} tracks in the background, "
+                                         "reopen this dialog for more results.")
+                status.set_halign(Gtk.Align.START)
+                box.pack_start(status, False, False, 0)
+
+        # Group rows with the tracks beneath; all but the first copy are suggested for removal
+        store = Gtk.TreeStore(bool, str)
+        for reason, paths in groups:
+            parent = store.append(None, [False, f"{reason} ({len(paths)} tracks)"])
+            for i, path in enumerate(paths):
+                store.append(parent, [i > 0, path])
+
+        view = Gtk.TreeView(model=store)
+        toggle = Gtk.CellRendererToggle()
+        toggle.connect("toggled", lambda renderer, path: store.set_value(
+            store.get_iter(path), 0, not store[path][0]))
+        toggle_column = Gtk.TreeViewColumn("Remove", toggle, active=0)
+        toggle_column.set_cell_data_func(toggle, lambda column, cell, model, iter, data: cell.set_visible(
+            model.iter_parent(iter) is not None))
+        view.append_column(toggle_column)
+        view.append_column(Gtk.TreeViewColumn("Track", Gtk.CellRendererText(), text=1))
+        view.expand_all()
+
+        scrolled = Gtk.ScrolledWindow()
+        scrolled.set_vexpand(True)
+        scrolled.add(view)
+        box.pack_start(scrolled, True, True, 0)
+
+        if not groups:
+            box.pack_start(Gtk.Label(label="No duplicates found"), False, False, 0)
+
+        dialog.show_all()
+        if dialog.run() == Gtk.ResponseType.OK:
+            to_remove = set()
+            for group in store:
+                for child in group.iterchildren():
+                    if child[0]:
+                        to_remove.add(child[1])
+            self.remove_paths(to_remove)
+        dialog.destroy()
+
+    def register_commands(self):
+        commands = self.commands
+        commands.register("play", self.on_play)
+        commands.register("pause", self.on_pause)
+        commands.register("play_pause", self.on_play_pause_clicked)
+        commands.register("stop", self.on_stop)
+        # Holding next/prev only moves the selection, one track is loaded at the end
+        commands.register("skip", self.skip, debounce_ms=300, preview=self.preview_skip, arg_type=int)
+        commands.register("seek", self.seek_relative, debounce_ms=150)
+        commands.register("volume", self.change_volume, arg_type=int)
+        commands.register("mute", self.on_volume_button_clicked)
+
+    def on_play(self, button=None):
+        self.playback.request(Gst.State.PLAYING)
+
+    def on_pause(self, button=None):
+        self.playback.request(Gst.State.PAUSED)
+
+    def on_play_pause_clicked(self, button=None):
+        # Decide from the wanted state, a pipeline still prerolling counts as playing
+        if (self.playback.playing or self.play_after_preroll or
+                self.stream_buffering.target_state == Gst.State.PLAYING):
+            self.play_after_preroll = False
+            self.stream_buffering.set_target_state(Gst.State.PAUSED)
+            self.playback.request(Gst.State.PAUSED)
             self.update_play_pause_button_icon(False)
         else:
             if self.current_track_index == -1 and len(self.playlist_store) > 0:
-                self.current_track_index = 0
-
-                path = Gtk.TreePath.new_from_indices([self.current_track_index])
-                selection = self.playlist_view.get_selection()
-                selection.unselect_all()
-                selection.select_path(path)
-                self.playlist_view.scroll_to_cell(path, None, True, 0.5, 0.5)
-
-                self.play_track_at_index(self.current_track_index)
+                self.play_track_at_index(0)
             else:
-                self.player.set_state(Gst.State.PLAYING)
+                self.stream_buffering.set_target_state(Gst.State.PLAYING)
+                if not self.stream_buffering.buffering:
+                    self.playback.request(Gst.State.PLAYING)
                 self.update_play_pause_button_icon(True)
 
     def update_play_pause_button_icon(self, is_playing):
@@ -656,8 +1638,10 @@ class MusicPlayerWindow(Gtk.Window):
         self.play_pause_button.set_image(new_image)
         new_image.show()
 
-    def on_stop(self, button):
-        self.player.set_state(Gst.State.NULL)
+    def on_stop(self, button=None):
+        self.record_listen()
+        self.stream_buffering.reset(Gst.State.NULL)
+        self.playback.request(Gst.State.NULL)
         self.current_track_index = -1
         self.update_now_playing_label("No track playing")
         self.progress_bar.set_value(0)
@@ -674,34 +1658,31 @@ class MusicPlayerWindow(Gtk.Window):
 
         selection = self.playlist_view.get_selection()
         selection.unselect_all()
+        self.schedule_session_save()
 
-    def on_next(self, button):
-        if len(self.playlist_store) > 0:
-            self.player.set_state(Gst.State.NULL)
-            self.current_track_index = (self.current_track_index + 1) % len(self.playlist_store)
+    def skip_target(self, steps):
+        return (self.current_track_index + steps) % len(self.playlist_store)
 
-            path = Gtk.TreePath.new_from_indices([self.current_track_index])
-            selection = self.playlist_view.get_selection()
-            selection.unselect_all()
-            selection.select_path(path)
-            self.playlist_view.scroll_to_cell(path, None, True, 0.5, 0.5)
-
-            self.play_track_at_index(self.current_track_index)
-            self.player.set_state(Gst.State.PLAYING)
+    def skip(self, steps):
+        """Play the track steps away from the current one (negative for previous)"""
+        if len(self.playlist_store) > 0:
+            self.play_track_at_index(self.skip_target(steps))
 
-    def on_prev(self, button):
+    def preview_skip(self, steps):
         if len(self.playlist_store) > 0:
-            self.player.set_state(Gst.State.NULL)
-            self.current_track_index = (self.current_track_index - 1) % len(self.playlist_store)
+            self.select_row(self.skip_target(steps))
 
-            path = Gtk.TreePath.new_from_indices([self.current_track_index])
-            selection = self.playlist_view.get_selection()
-            selection.unselect_all()
-            selection.select_path(path)
-            self.playlist_view.scroll_to_cell(path, None, True, 0.5, 0.5)
+    def seek_relative(self, seconds):
+        success, position = self.player.query_position(Gst.Format.TIME)
+        if not success:
+            return
+        target = max(0, position + int(seconds * Gst.SECOND))
+        # Streams have no duration, the seek position must still fit in 64 bits
+        target = min(target, int(self.duration * Gst.SECOND) if self.duration > 0 else GLib.MAXINT64)
+        self.player.seek_simple(Gst.Format.TIME, Gst.SeekFlags.FLUSH | Gst.SeekFlags.KEY_UNIT, target)
 
-            self.play_track_at_index(self.current_track_index)
-            self.player.set_state(Gst.State.PLAYING)
+    def change_volume(self, delta):
+        self.volume_scale.set_value(max(0, min(100, self.volume_scale.get_value() + delta)))
 
     def update_volume_icon(self):
         volume = self.volume_scale.get_value()
@@ -713,7 +1694,7 @@ class MusicPlayerWindow(Gtk.Window):
         )
         self.volume_icon.set_from_icon_name(icon_name, Gtk.IconSize.LARGE_TOOLBAR)
 
-    def on_volume_button_clicked(self, button):
+    def on_volume_button_clicked(self, button=None):
         if self.is_muted:
             self.is_muted = False
             self.volume_scale.set_value(self.previous_volume)
@@ -731,75 +1712,123 @@ class MusicPlayerWindow(Gtk.Window):
         if volume > 0:
             self.is_muted = False
         self.update_volume_icon()
+        self.schedule_session_save()
+
+    def select_row(self, index):
+        """Select and scroll to a playlist row"""
+        path = Gtk.TreePath.new_from_indices([index])
+        selection = self.playlist_view.get_selection()
+        selection.unselect_all()
+        selection.select_path(path)
+        self.playlist_view.scroll_to_cell(path, None, True, 0.5, 0.5)
 
     def play_track_at_index(self, index):
         if 0 <= index < len(self.playlist_store):
+            self.select_row(index)
             path = Gtk.TreePath.new_from_indices([index])
             self.on_row_activated(self.playlist_view, path, None)
 
     def on_row_activated(self, treeview, path, column):
         self.current_track_index = path.get_indices()[0]
         model = treeview.get_model()
-        file_path = model[path][0]
-        self.play_file(file_path)
+        self.play_track(model[path][0])
 
-    def play_file(self, file_path):
+    def play_track(self, track, start_position=0, autoplay=True, retry=False):
 
-        self.player.set_state(Gst.State.NULL)
+        # A retry carries on the listen of the same track instead of counting a skip
+        if not (retry and track is self.listening_track):
+            self.record_listen()
+        self.playback.request(Gst.State.NULL)
+        self.pending_seek = None
+        self.play_after_preroll = False
         self.progress_bar.set_value(0)
         self.current_time_label.set_text("0:00")
+        # A retry is allowed once per track, a different track starts afresh
+        if track.path != self.retry_path:
+            self.retry_path = None
+        self.playing_track = track
 
-        uri = GLib.filename_to_uri(file_path)
+        uri = to_uri(track.path)
         self.player.set_property('uri', uri)
-        self.player.set_state(Gst.State.PLAYING)
-        self.update_play_pause_button_icon(True)
-
-        display_name, title, artist, album, year, duration, artwork = self.get_metadata(file_path)
-
-        self.title_value.set_text(title)
-        self.artist_value.set_text(artist)
-        self.album_value.set_text(album)
-        self.date_value.set_text(year)
 
-        if artwork:
-            try:
-                loader = GdkPixbuf.PixbufLoader()
-
-                loader.write(artwork)
-                loader.close()
-
-                pixbuf = loader.get_pixbuf()
-                if pixbuf:
-                    width = pixbuf.get_width()
-                    height = pixbuf.get_height()
-                    target_size = 200
-
-                    if width > height:
-                        new_width = target_size
-                        new_height = int(height * (target_size / width))
-                    else:
-                        new_height = target_size
-                        new_width = int(width * (target_size / height))
-
-                    scaled_pixbuf = pixbuf.scale_simple(new_width, new_height, GdkPixbuf.InterpType.BILINEAR)
-                    self.album_art.set_from_pixbuf(scaled_pixbuf)
-                else:
-                    print("Failed to get pixbuf from loader")
-                    raise Exception("Failed to get pixbuf")
-
-            except Exception as e:
-                print(f"Error loading album art: {e}")
-                default_pixbuf = GdkPixbuf.Pixbuf.new(GdkPixbuf.Colorspace.RGB, True, 8, 200, 200)
-                default_pixbuf.fill(0x7F7F7F7F)
-                self.album_art.set_from_pixbuf(default_pixbuf)
+        timeout_ms = STREAM_TRANSITION_TIMEOUT_MS if track.is_stream else TRANSITION_TIMEOUT_MS
+        if autoplay and not (start_position > 0 and not track.is_stream):
+            ret = self.playback.request(Gst.State.PLAYING, timeout_ms)
         else:
-            print("No artwork found in metadata")
-            default_pixbuf = GdkPixbuf.Pixbuf.new(GdkPixbuf.Colorspace.RGB, True, 8, 200, 200)
-            default_pixbuf.fill(0x7F7F7F7F)
-            self.album_art.set_from_pixbuf(default_pixbuf)
+            # Pre-roll paused and seek before any audio is played
+            if start_position > 0 and not track.is_stream:
+                self.pending_seek = start_position
+            self.play_after_preroll = autoplay
+            ret = self.playback.request(Gst.State.PAUSED, timeout_ms)
+
+        target_state = Gst.State.PLAYING if autoplay else Gst.State.PAUSED
+        self.stream_buffering.reset(target_state, is_live=ret == Gst.StateChangeReturn.NO_PREROLL)
+        self.now_playing_frame.set_label("Now Playing")
+        self.update_play_pause_button_icon(autoplay)
+        self.schedule_session_save()
+        if not track.is_stream:
+            self.listening_track = track
+            self.apply_track_preset(track)
+        self.request_waveforms(track)
+        self.lyrics_path = None if track.is_stream else track.path
+        self.show_lyrics()
+        if self.http_api is not None:
+            self.http_api.publish_track(track, self.current_track_index)
+
+        self.title_value.set_text(track.title)
+        self.artist_value.set_text(track.artist)
+        self.album_value.set_text(track.album)
+        self.date_value.set_text(str(track.year) if track.year else "")
+
+        # Only the artwork is read from the file, the rest comes from the Track
+        pixbuf = load_artwork(track)
+        if pixbuf is None:
+            pixbuf = GdkPixbuf.Pixbuf.new(GdkPixbuf.Colorspace.RGB, True, 8, 200, 200)
+            pixbuf.fill(0x7F7F7F7F)
+        self.album_art.set_from_pixbuf(pixbuf)
 
         self.start_progress_update()
 
+    def on_stream_tags(self, taglist):
+        """Update the Now Playing labels from ICY metadata of a playing stream"""
+        if not (0 <= self.current_track_index < len(self.playlist_store)):
+            return
+        if not self.playlist_store[self.current_track_index][0].is_stream:
+            return
+
+        title, artist, station = parse_icy_title(taglist)
+        if title:
+            self.title_value.set_text(title)
+        if artist:
+            self.artist_value.set_text(artist)
+        if station:
+            self.album_value.set_text(station)
+
+    def stop_listen_clock(self):
+        if self.listen_started is not None:
+            self.listened_seconds += time.monotonic() - self.listen_started
+            self.listen_started = None
+
+    def record_listen(self):
+        """Hand the listen of the track that is ending to the play statistics writer"""
+        self.stop_listen_clock()
+        listened = self.listened_seconds
+        self.listened_seconds = 0.0
+        track = self.listening_track
+        if track is None:
+            return
+        self.listening_track = None
+
+        self.play_stats.record(track.path, listened, track.duration_ms / 1000)
+
+    def on_play_stats_flushed(self, paths):
+        # Smart playlists with play count rules follow the new numbers
+        try:
+            self.library.refresh_stats(paths)
+        except sqlite3.Error as e:
+            print(f"Error refreshing smart playlists: {e}")
+        return False
+
     def update_now_playing_label(self, text):
         if text == "No track playing":
             self.title_value.set_text("")
@@ -822,8 +1851,19 @@ class MusicPlayerWindow(Gtk.Window):
         if success:
             position = position / Gst.SECOND
             self.current_time_label.set_text(self.format_time(position))
+            if self.http_api is not None:
+                self.http_api.publish_position(position, self.duration)
             if self.duration > 0:
                 self.progress_bar.set_value((position / self.duration) * 100)
+            self.update_lyrics_line(position * 1000)
+
+            # Keep the resume position fresh without writing on every tick
+            position_ns = position * Gst.SECOND
+            if self.last_saved_position is None or abs(position_ns - self.last_saved_position) >= 5 * Gst.SECOND:
+                try:
+                    self.save_session_state()
+                except sqlite3.Error as e:
+                    print(f"Error saving session: {e}")
         return True
 
     def format_time(self, seconds):
@@ -831,7 +1871,72 @@ class MusicPlayerWindow(Gtk.Window):
         seconds = int(seconds % 60)
         return f"{minutes}:{seconds:02d}"
 
-    def on_progress_changed(self, scale, scroll_type, value):
+    def on_lyrics_toggled(self, button):
+        self.lyrics_panel.set_visible(button.get_active())
+        self.lyrics_view.show()
+        self.show_lyrics()
+
+    def show_lyrics(self):
+        """Fill the lyrics panel for the playing track; lyrics are only read while it is shown"""
+        self.lyrics = None
+        self.lyrics_line = -1
+        if not self.lyrics_panel.get_visible():
+            return
+
+        if self.lyrics_path is not None:
+            self.lyrics = load_lyrics(self.lyrics_path)
+        text_buffer = self.lyrics_view.get_buffer()
+        if self.lyrics is None or not self.lyrics.lines:
+            text_buffer.set_text("No lyrics")
+            return
+        text_buffer.set_text(self.lyrics.text)
+        self.lyrics_panel.get_vadjustment().set_value(0)
+
+        success, position = self.player.query_position(Gst.Format.TIME)
+        if success:
+            self.update_lyrics_line(position / Gst.MSECOND)
+
+    def update_lyrics_line(self, position_ms):
+        """Highlight the current line of synced lyrics (called from the progress tick)"""
+        if self.lyrics is None or not self.lyrics.synced:
+            return
+        # Syllables share a line, the highlight moves when the line does
+        index = self.lyrics.line_at(position_ms)
+        line = self.lyrics.rows[index] if index >= 0 else -1
+        if line == self.lyrics_line:
+            return
+
+        text_buffer = self.lyrics_view.get_buffer()
+        text_buffer.remove_tag_by_name("current", text_buffer.get_start_iter(), text_buffer.get_end_iter())
+        self.lyrics_line = line
+        if line < 0:
+            return
+        start = text_buffer.get_iter_at_line(line)
+        end = start.copy()
+        end.forward_to_line_end()
+        text_buffer.apply_tag_by_name("current", start, end)
+        self.lyrics_view.scroll_to_iter(start, 0.0, True, 0.0, 0.5)
+
+    def request_waveforms(self, track):
+        """Show the waveform of track and prepare the next one in the queue"""
+        self.progress_bar.set_peaks(None)
+        self.waveform_path = None if track.is_stream else track.path
+        if self.waveform_path is None:
+            return
+
+        paths = [track.path]
+        next_index = self.current_track_index + 1
+        if 0 <= next_index < len(self.playlist_store):
+            next_track = self.playlist_store[next_index][0]
+            if not next_track.is_stream:
+                paths.append(next_track.path)
+        self.waveforms.request(paths, self.on_waveform_ready)
+
+    def on_waveform_ready(self, path, peaks):
+        if path == self.waveform_path:
+            self.progress_bar.set_peaks(peaks)
+
+    def on_progress_changed(self, seekbar, value):
         if self.duration > 0:
             position = (value / 100) * self.duration
             self.player.seek_simple(
@@ -848,27 +1953,31 @@ class MusicPlayerWindow(Gtk.Window):
         os.makedirs(playlist_dir, exist_ok=True)
         return playlist_dir
 
+    def get_playlist_file(self, filename):
+        playlist_file = self.playlist_files.get(filename)
+        if playlist_file is None:
+            playlist_file = self.playlist_files[filename] = PlaylistFile(filename)
+        return playlist_file
+
     def save_playlist(self, filename):
-        """Save current playlist to a file"""
+        """Save current playlist to a file, writing only what changed since it was last saved"""
+        entries = []
+        for row in self.playlist_store:
+            track = row[0]
+            length = track.duration_ms // 1000 if track.duration_ms else -1
+            entries.append((track.path, length, f"{track.artist} - {track.title}"))
         try:
-            with open(filename, 'w', encoding='utf-8') as f:
-                f.write("#EXTM3U\n")  # M3U playlist header
-                for row in self.playlist_store:
-                    # Write file path
-                    filepath = row[0]
-                    title = row[2]
-                    artist = row[3]
-                    # Write extended info
-                    f.write(f"#EXTINF:-1,{artist} - {title}\n")
-                    # Write file path
-                    f.write(f"{filepath}\n")
+            written = self.get_playlist_file(filename).save(entries)
+            print(f"Saved {len(entries)} tracks to {filename} ({written} bytes written)")
             return True
         except Exception as e:
             print(f"Error saving playlist: {e}")
+            # Forget what we believe is on disk, the next save starts from the file again
+            self.playlist_files.pop(filename, None)
             return False
 
-    def show_playlist_selection_dialog(self):
-        """Show a simple dialog with a list of saved playlists"""
+    def show_playlist_selection_dialog(self, options=None):
+        """Show a simple dialog with a list of saved playlists, and the options widget below it"""
         dialog = Gtk.Dialog(title="Select Playlist", parent=self)
         dialog.add_buttons(
             Gtk.STOCK_CANCEL, Gtk.ResponseType.CANCEL,
@@ -907,6 +2016,11 @@ class MusicPlayerWindow(Gtk.Window):
 
         scrolled.add(list_box)
         dialog.get_content_area().pack_start(scrolled, True, True, 0)
+        if options is not None:
+            options.set_margin_start(10)
+            options.set_margin_end(10)
+            options.set_margin_bottom(10)
+            dialog.get_content_area().pack_start(options, False, False, 0)
         dialog.show_all()
 
         response = dialog.run()
@@ -966,9 +2080,16 @@ class MusicPlayerWindow(Gtk.Window):
         dialog.destroy()
 
     def on_load_playlist_clicked(self, widget):
-        playlist_file = self.show_playlist_selection_dialog()
+        mode_combo = Gtk.ComboBoxText()
+        mode_combo.append("replace", "Replace the queue")
+        mode_combo.append("append", "Add to the end of the queue")
+        mode_combo.append("insert", "Add after the current track")
+        mode_combo.append("merge", "Merge with the queue")
+        mode_combo.set_active_id("replace")
+
+        playlist_file = self.show_playlist_selection_dialog(mode_combo)
         if playlist_file and os.path.exists(playlist_file):
-            if self.load_playlist(playlist_file):
+            if self.load_playlist(playlist_file, mode_combo.get_active_id()):
                 message_dialog = Gtk.MessageDialog(
                     transient_for=self,
                     message_type=Gtk.MessageType.INFO,
@@ -978,43 +2099,384 @@ class MusicPlayerWindow(Gtk.Window):
                 message_dialog.run()
                 message_dialog.destroy()
 
-    def load_playlist(self, filename):
-        """Load playlist from a file"""
+    def read_playlist_file(self, filename):
+        """Paths listed in a saved M3U playlist that still exist"""
+        entries = self.get_playlist_file(filename).load()
+        return [path for path, length, display in entries if is_stream_uri(path) or os.path.isfile(path)]
+
+    def on_export_clicked(self, widget):
+        dialog = Gtk.Dialog(title="Export Playlist", parent=self)
+        dialog.add_buttons(
+            Gtk.STOCK_CANCEL, Gtk.ResponseType.CANCEL,
+            "Export", Gtk.ResponseType.OK
+        )
+
+        box = dialog.get_content_area()
+        box.set_spacing(6)
+        box.set_margin_start(10)
+        box.set_margin_end(10)
+        box.set_margin_top(10)
+        box.set_margin_bottom(10)
+
+        grid = Gtk.Grid()
+        grid.set_column_spacing(10)
+        grid.set_row_spacing(6)
+
+        source_combo = Gtk.ComboBoxText()
+        source_combo.append("current", "Current playlist")
+        source_combo.append("saved", "Saved playlist...")
+        source_combo.set_active_id("current")
+
+        format_combo = Gtk.ComboBoxText()
+        for export_format in EXPORT_FORMATS:
+            format_combo.append(export_format, export_format.upper())
+        format_combo.set_active_id("mp3")
+
+        folder_chooser = Gtk.FileChooserButton(title="Export To", action=Gtk.FileChooserAction.SELECT_FOLDER)
+
+        workers_spin = Gtk.SpinButton.new_with_range(1, max(1, os.cpu_count() or 1), 1)
+        workers_spin.set_value(default_workers())
+
+        rows = [
+            ("Playlist:", source_combo),
+            ("Format:", format_combo),
+            ("Folder:", folder_chooser),
+            ("Parallel encoders:", workers_spin),
+        ]
+        for i, (text, widget) in enumerate(rows):
+            label = Gtk.Label(label=text)
+            label.set_halign(Gtk.Align.START)
+            grid.attach(label, 0, i, 1, 1)
+            grid.attach(widget, 1, i, 1, 1)
+        box.add(grid)
+
+        dialog.show_all()
+        response = dialog.run()
+        source = source_combo.get_active_id()
+        export_format = format_combo.get_active_id()
+        destination = folder_chooser.get_filename()
+        workers = int(workers_spin.get_value())
+        dialog.destroy()
+        if response != Gtk.ResponseType.OK or not destination:
+            return
+
+        if source == "saved":
+            playlist_file = self.show_playlist_selection_dialog()
+            if not playlist_file:
+                return
+            try:
+                paths = self.read_playlist_file(playlist_file)
+            except OSError as e:
+                print(f"Error reading playlist: {e}")
+                return
+        else:
+            paths = [row[0].path for row in self.playlist_store]
+        paths = [path for path in paths if not is_stream_uri(path)]
+
+        self.run_export(Exporter(paths, destination, export_format, workers))
+
+    def run_export(self, exporter):
+        """Show aggregate progress of an export until it finishes or is cancelled"""
+        dialog = Gtk.Dialog(title="Exporting", parent=self)
+        dialog.add_buttons(Gtk.STOCK_CANCEL, Gtk.ResponseType.CANCEL)
+        dialog.set_default_size(400, -1)
+
+        box = dialog.get_content_area()
+        box.set_spacing(6)
+        box.set_margin_start(10)
+        box.set_margin_end(10)
+        box.set_margin_top(10)
+        box.set_margin_bottom(10)
+
+        progress = Gtk.ProgressBar()
+        status = Gtk.Label(label="")
+        status.set_halign(Gtk.Align.START)
+        box.add(progress)
+        box.add(status)
+
+        total = len(exporter.paths)
+
+        def refresh():
+            fraction, done, skipped, failed, speed = exporter.snapshot()
+            progress.set_fraction(min(1.0, fraction))
+            status.set_text(f"{done + skipped + failed} of {total} files ({skipped} up to date, "
+                            f"{failed} failed)\n{speed:.1f}x real time with {exporter.workers} encoders")
+            if exporter.finished():
+                dialog.response(Gtk.ResponseType.CLOSE)
+                return False
+            return True
+
+        exporter.start()
+        refresh_id = GLib.timeout_add(500, refresh)
+        dialog.show_all()
+        response = dialog.run()
+        if response != Gtk.ResponseType.CLOSE:
+            GLib.source_remove(refresh_id)
+            exporter.cancel()
+        dialog.destroy()
+
+        if response == Gtk.ResponseType.CLOSE:
+            fraction, done, skipped, failed, speed = exporter.snapshot()
+            message_dialog = Gtk.MessageDialog(
+                transient_for=self,
+                message_type=Gtk.MessageType.WARNING if failed else Gtk.MessageType.INFO,
+                buttons=Gtk.ButtonsType.OK,
+                text=f"Exported {done} tracks, {skipped} already up to date, {failed} failed"
+            )
+            message_dialog.run()
+            message_dialog.destroy()
+
+    def load_playlist(self, filename, mode="replace"):
+        """Load playlist from a file
+
+        mode is "replace" (clear the queue and play the playlist), "append",
+        "insert" (after the current track) or "merge" (add only what is not queued yet).
+        """
         try:
-            # Clear current playlist
-            self.playlist_store.clear()
+            paths = self.read_playlist_file(filename)
+            if mode == "append":
+                self.add_music_files(paths)
+            elif mode == "insert":
+                position = self.current_track_index + 1 if self.current_track_index >= 0 else None
+                self.add_music_files(paths, position)
+            elif mode == "merge":
+                self.merge_music_files(paths)
+            else:
+                # Clear current playlist
+                self.playlist_store.clear()
+                self.dedup_index.clear()
 
-            with open(filename, 'r', encoding='utf-8') as f:
-                lines = f.readlines()
-
-            i = 0
-            while i < len(lines):
-                line = lines[i].strip()
-                if line.startswith('#EXTINF'):
-                    # Skip the extended info line
-                    i += 1
-                    if i < len(lines):
-                        filepath = lines[i].strip()
-                        if os.path.isfile(filepath):
-                            self.add_music_files([filepath])
-                i += 1
-
-            # Start playing the first track if playlist is not empty
-            if len(self.playlist_store) > 0:
-                self.current_track_index = 0
-                path = Gtk.TreePath.new_from_indices([0])
-                selection = self.playlist_view.get_selection()
-                selection.unselect_all()
-                selection.select_path(path)
-                self.playlist_view.scroll_to_cell(path, None, True, 0.5, 0.5)
-                self.play_track_at_index(0)
-                self.update_view()
+                self.add_music_files(paths)
+
+                # Start playing the first track if playlist is not empty
+                if len(self.playlist_store) > 0:
+                    self.play_track_at_index(0)
+                    self.update_view()
 
             return True
         except Exception as e:
             print(f"Error loading playlist: {e}")
             return False
 
+    def merge_music_files(self, file_paths):
+        """Queue the files not queued yet, each after its predecessor in file_paths"""
+        tracks = []
+        for position, group in merge_groups([row[0].path for row in self.playlist_store], file_paths):
+            tracks += self.queue_files(group, position)
+        self.add_to_library(tracks)
+        self.update_view()
+
+    def load_tracks(self, tracks):
+        """Replace the queue with already known tracks and start playing the first one"""
+        self.record_listen()
+        self.playback.request(Gst.State.NULL)
+        self.current_track_index = -1
+        self.playlist_store.clear()
+        self.dedup_index.clear()
+        for track in tracks:
+            self.playlist_store.append([track])
+            if not track.is_stream:
+                self.dedup_index.add(track.path, track.duration_ms, stat=False)
+        self.update_view()
+
+        if len(self.playlist_store) > 0:
+            self.play_track_at_index(0)
+
+    def on_smart_playlists_clicked(self, widget):
+        dialog = Gtk.Dialog(title="Smart Playlists", parent=self)
+        dialog.add_buttons(
+            Gtk.STOCK_NEW, 1,
+            Gtk.STOCK_EDIT, 2,
+            Gtk.STOCK_DELETE, 3,
+            Gtk.STOCK_CLOSE, Gtk.ResponseType.CLOSE,
+            Gtk.STOCK_OPEN, Gtk.ResponseType.OK
+        )
+        dialog.set_default_size(300, 400)
+
+        scrolled = Gtk.ScrolledWindow()
+        scrolled.set_policy(Gtk.PolicyType.NEVER, Gtk.PolicyType.AUTOMATIC)
+        scrolled.set_margin_start(10)
+        scrolled.set_margin_end(10)
+        scrolled.set_margin_top(10)
+        scrolled.set_margin_bottom(10)
+
+        list_box = Gtk.ListBox()
+        list_box.set_selection_mode(Gtk.SelectionMode.SINGLE)
+        list_box.connect("row-activated", lambda box, row: dialog.response(Gtk.ResponseType.OK))
+        scrolled.add(list_box)
+        dialog.get_content_area().pack_start(scrolled, True, True, 0)
+
+        # Built-in lists come straight from the play statistics indexes
+        builtin = [
+            ("Most Played", self.library.top_played),
+            ("Recently Played", self.library.recently_played),
+            ("Never Played", self.library.never_played),
+        ]
+
+        def refresh():
+            for row in list_box.get_children():
+                list_box.remove(row)
+            entries = [(name, None, loader) for name, loader in builtin]
+            entries += [(name, rules, None) for name, rules in self.library.smart_playlists()]
+            for name, rules, loader in entries:
+                row = Gtk.ListBoxRow()
+                row.playlist_name = name
+                row.playlist_rules = rules
+                row.playlist_loader = loader
+                label = Gtk.Label(label=name)
+                label.set_margin_start(10)
+                label.set_margin_end(10)
+                label.set_margin_top(5)
+                label.set_margin_bottom(5)
+                label.set_halign(Gtk.Align.START)
+                row.add(label)
+                list_box.add(row)
+            list_box.show_all()
+
+        refresh()
+        dialog.show_all()
+
+        while True:
+            response = dialog.run()
+            selected = list_box.get_selected_row()
+            if selected and selected.playlist_loader and response in (2, 3):
+                continue
+            if response == 1 or (response == 2 and selected):
+                if selected and response == 2:
+                    result = self.edit_smart_playlist(selected.playlist_name, selected.playlist_rules)
+                else:
+                    result = self.edit_smart_playlist()
+                if result:
+                    try:
+                        self.library.save_smart_playlist(*result)
+                    except (ValueError, sqlite3.Error) as e:
+                        print(f"Error saving smart playlist: {e}")
+                    refresh()
+            elif response == 3 and selected:
+                self.library.delete_smart_playlist(selected.playlist_name)
+                refresh()
+            elif response == Gtk.ResponseType.OK and selected:
+                try:
+                    if selected.playlist_loader:
+                        self.load_tracks(selected.playlist_loader())
+                    else:
+                        self.load_tracks(self.library.smart_playlist_tracks(selected.playlist_name))
+                except (ValueError, sqlite3.Error) as e:
+                    print(f"Error loading smart playlist: {e}")
+                break
+            elif response not in (1, 2, 3):
+                break
+
+        dialog.destroy()
+
+    def edit_smart_playlist(self, name="", rules=None):
+        """Show the rule editor; returns (name, rules) or None when cancelled"""
+        conditions = {(c["field"], c["op"]): c["value"] for c in (rules or {}).get("conditions", [])}
+
+        dialog = Gtk.Dialog(title="Smart Playlist", parent=self)
+        dialog.add_buttons(
+            Gtk.STOCK_CANCEL, Gtk.ResponseType.CANCEL,
+            Gtk.STOCK_SAVE, Gtk.ResponseType.OK
+        )
+
+        grid = Gtk.Grid()
+        grid.set_column_spacing(10)
+        grid.set_row_spacing(6)
+        grid.set_margin_start(10)
+        grid.set_margin_end(10)
+        grid.set_margin_top(10)
+        grid.set_margin_bottom(10)
+
+        name_entry = Gtk.Entry()
+        name_entry.set_text(name)
+
+        match_combo = Gtk.ComboBoxText()
+        match_combo.append("all", "all rules")
+        match_combo.append("any", "any rule")
+        match_combo.set_active_id((rules or {}).get("match", "all"))
+
+        def text_entry(field, op):
+            entry = Gtk.Entry()
+            entry.set_text(str(conditions.get((field, op), "")))
+            return entry
+
+        def spin(low, high, value):
+            button = Gtk.SpinButton.new_with_range(low, high, 1)
+            button.set_value(value)
+            return button
+
+        years = conditions.get(("year", "between"), [0, 0])
+        durations = conditions.get(("duration_ms", "between"), [0, 0])
+
+        artist_entry = text_entry("artist", "contains")
+        album_entry = text_entry("album", "contains")
+        genre_entry = text_entry("genre", "is")
+        year_from = spin(0, 3000, years[0])
+        year_to = spin(0, 3000, years[1])
+        min_minutes = spin(0, 600, durations[0] // 60000)
+        max_minutes = spin(0, 600, durations[1] // 60000)
+        min_plays = spin(0, 100000, conditions.get(("play_count", ">="), 0))
+        max_plays = spin(-1, 100000, conditions.get(("play_count", "<="), -1))
+        added_days = spin(0, 36500, conditions.get(("added_at", "within_days"), 0))
+        played_days = spin(0, 36500, conditions.get(("last_played", "within_days"), 0))
+
+        rows = [
+            ("Name:", name_entry),
+            ("Match:", match_combo),
+            ("Artist contains:", artist_entry),
+            ("Album contains:", album_entry),
+            ("Genre is:", genre_entry),
+            ("Year from (0 = any):", year_from),
+            ("Year to:", year_to),
+            ("Min duration (minutes):", min_minutes),
+            ("Max duration (0 = any):", max_minutes),
+            ("Min play count:", min_plays),
+            ("Max play count (-1 = any):", max_plays),
+            ("Added in last days (0 = any):", added_days),
+            ("Played in last days (0 = any):", played_days),
+        ]
+        for i, (text, widget) in enumerate(rows):
+            label = Gtk.Label(label=text)
+            label.set_halign(Gtk.Align.START)
+            grid.attach(label, 0, i, 1, 1)
+            grid.attach(widget, 1, i, 1, 1)
+
+        dialog.get_content_area().add(grid)
+        dialog.show_all()
+        response = dialog.run()
+
+        result = None
+        new_name = name_entry.get_text().strip()
+        if response == Gtk.ResponseType.OK and new_name:
+            new_conditions = []
+            for field, op, entry in (("artist", "contains", artist_entry),
+                                     ("album", "contains", album_entry),
+                                     ("genre", "is", genre_entry)):
+                value = entry.get_text().strip()
+                if value:
+                    new_conditions.append({"field": field, "op": op, "value": value})
+            if year_from.get_value() or year_to.get_value():
+                new_conditions.append({"field": "year", "op": "between",
+                                       "value": [int(year_from.get_value()), int(year_to.get_value()) or 9999]})
+            if min_minutes.get_value() or max_minutes.get_value():
+                new_conditions.append({"field": "duration_ms", "op": "between",
+                                       "value": [int(min_minutes.get_value()) * 60000,
+                                                 int(max_minutes.get_value() or 100000) * 60000]})
+            if min_plays.get_value() > 0:
+                new_conditions.append({"field": "play_count", "op": ">=", "value": int(min_plays.get_value())})
+            if max_plays.get_value() >= 0:
+                new_conditions.append({"field": "play_count", "op": "<=", "value": int(max_plays.get_value())})
+            if added_days.get_value() > 0:
+                new_conditions.append({"field": "added_at", "op": "within_days",
+                                       "value": int(added_days.get_value())})
+            if played_days.get_value() > 0:
+                new_conditions.append({"field": "last_played", "op": "within_days",
+                                       "value": int(played_days.get_value())})
+            result = (new_name, {"match": match_combo.get_active_id() or "all", "conditions": new_conditions})
+
+        dialog.destroy()
+        return result
+
     def on_clear_playlist_clicked(self, button):
         # Create confirmation dialog
         dialog = Gtk.MessageDialog(
@@ -1030,11 +2492,13 @@ class MusicPlayerWindow(Gtk.Window):
 
         if response == Gtk.ResponseType.YES:
             # Stop playback if playing
-            self.player.set_state(Gst.State.NULL)
+            self.record_listen()
+            self.playback.request(Gst.State.NULL)
             # Reset current track index
             self.current_track_index = -1
             # Clear the playlist store
             self.playlist_store.clear()
+            self.dedup_index.clear()
             # Reset now playing labels
             self.update_now_playing_label("No track playing")
             # Reset progress bar and time labels
@@ -1050,18 +2514,116 @@ class MusicPlayerWindow(Gtk.Window):
             # Update view to show welcome screen
             self.update_view()
 
+    def on_state_reached(self, state):
+        if state == Gst.State.PLAYING:
+            self.failed_in_a_row = 0
+            # A flushing seek re-reaches PLAYING, keep counting from the first start
+            if self.listen_started is None:
+                self.listen_started = time.monotonic()
+        else:
+            self.stop_listen_clock()
+        if self.http_api is not None:
+            names = {Gst.State.PLAYING: "playing", Gst.State.PAUSED: "paused"}
+            self.http_api.publish_state(state=names.get(state, "stopped"))
+
+    def schedule_queue_publish(self):
+        # Adding a folder inserts rows one by one, publish the queue once afterwards
+        if self.queue_publish_id is None:
+            self.queue_publish_id = GLib.idle_add(self.publish_queue)
+
+    def publish_queue(self):
+        self.queue_publish_id = None
+        self.http_api.publish_queue(row[0] for row in self.playlist_store)
+        return False
+
+    def on_transition_stuck(self, target):
+        print(f"Pipeline did not reach {target.value_nick} in time")
+        self.on_playback_error(f"Timed out switching to {target.value_nick}", stuck=True)
+
+    def on_playback_error(self, reason, stuck=False):
+        """Retry a failing track once on a rebuilt pipeline, then skip to the next one"""
+        # Nothing is heard until the retry reaches PLAYING again
+        self.stop_listen_clock()
+        track = self.playing_track
+        if track is None:
+            self.playback.request(Gst.State.NULL)
+            return
+
+        if self.retry_path != track.path:
+            self.retry_path = track.path
+            print(f"Retrying {track.path} on a new pipeline: {reason}")
+            autoplay = self.playback.playing or self.play_after_preroll
+            position = 0
+            if not track.is_stream:
+                success, position = self.player.query_position(Gst.Format.TIME)
+                if not success:
+                    position = 0
+            self.rebuild_player()
+            self.play_track(track, start_position=position, autoplay=autoplay, retry=True)
+            return
+
+        print(f"Skipping unplayable track {track.path}: {reason}")
+        self.record_listen()
+        self.playing_track = None
+        if stuck:
+            # The pipeline is wedged, NULL on it could block
+            self.rebuild_player()
+        else:
+            self.playback.request(Gst.State.NULL)
+
+        self.failed_in_a_row += 1
+        if self.failed_in_a_row < len(self.playlist_store):
+            self.skip(1)
+        else:
+            # Nothing in the queue plays, stop instead of cycling through it
+            self.failed_in_a_row = 0
+            self.update_now_playing_label("Error playing track")
+            self.update_play_pause_button_icon(False)
+
     def on_message(self, bus, message):
         t = message.type
         if t == Gst.MessageType.ERROR:
-            self.player.set_state(Gst.State.NULL)
             err, debug = message.parse_error()
             print("Error:", err, debug)
-            self.update_now_playing_label("Error playing track")
-            self.update_play_pause_button_icon(False)
+            self.on_playback_error(err.message)
+        elif t == Gst.MessageType.STATE_CHANGED:
+            self.playback.handle_message(message)
         elif t == Gst.MessageType.EOS:
+            self.record_listen()
             if self.repeat_enabled and self.current_track_index == len(self.playlist_store) - 1:
                 self.current_track_index = -1
-            self.on_next(None)
+            self.skip(1)
+        elif t == Gst.MessageType.ASYNC_DONE:
+            self.playback.handle_message(message)
+            # Seek requested before the pipeline was prerolled
+            if self.pending_seek is not None:
+                position = self.pending_seek
+                self.pending_seek = None
+                self.player.seek_simple(
+                    Gst.Format.TIME,
+                    Gst.SeekFlags.FLUSH | Gst.SeekFlags.ACCURATE,
+                    position
+                )
+            elif self.play_after_preroll:
+                # Resumed session: the seek has prerolled, now start audio
+                self.play_after_preroll = False
+                self.playback.request(Gst.State.PLAYING)
+        elif t == Gst.MessageType.QOS:
+            self.audio_stats.handle_message(message)
+        elif t == Gst.MessageType.BUFFERING:
+            percent = self.stream_buffering.handle_buffering(message)
+            if percent < 100:
+                self.now_playing_frame.set_label(f"Now Playing (buffering {percent}%)")
+            else:
+                self.now_playing_frame.set_label("Now Playing")
+        elif t == Gst.MessageType.TAG:
+            self.on_stream_tags(message.parse_tag())
+        elif t == Gst.MessageType.ELEMENT:
+            self.visualizer.handle_message(message)
+
+# Headless receiver for network output: main.py --receive SENDER_HOST
+if len(sys.argv) > 2 and sys.argv[1] == "--receive":
+    sys.exit(run_receiver(sys.argv[2], load_settings()["network"]))
 
 win = MusicPlayerWindow()
 win.connect("destroy", Gtk.main_quit)
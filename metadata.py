@@ -0,0 +1,362 @@
+#!/usr/bin/env python3
+import os
+import sys
+import time
+import base64
+
+import mutagen
+from mutagen.id3 import ID3
+from mutagen.mp3 import MP3
+from mutagen.flac import FLAC, Picture
+from mutagen.oggvorbis import OggVorbis
+from mutagen.oggopus import OggOpus
+from mutagen.oggflac import OggFLAC
+from mutagen.oggspeex import OggSpeex
+from mutagen.mp4 import MP4, MP4Tags
+from mutagen.aac import AAC
+from mutagen.wave import WAVE
+from mutagen.aiff import AIFF
+from mutagen.trueaudio import TrueAudio
+from mutagen.apev2 import APEv2
+from mutagen.monkeysaudio import MonkeysAudio
+from mutagen.wavpack import WavPack
+from mutagen.musepack import Musepack
+from mutagen.optimfrog import OptimFROG
+from mutagen._vorbis import VComment
+
+
+# Format families, each handled by one reader
+ID3_TYPES = (MP3, WAVE, AIFF, TrueAudio)
+VORBIS_TYPES = (FLAC, OggVorbis, OggOpus, OggFLAC, OggSpeex)
+MP4_TYPES = (MP4,)
+APE_TYPES = (MonkeysAudio, WavPack, Musepack, OptimFROG)
+
+# Likely mutagen types per extension, tried before the full format probe
+EXTENSION_TYPES = {
+    ".mp3": [MP3],
+    ".flac": [FLAC],
+    ".ogg": [OggVorbis, OggOpus, OggFLAC, OggSpeex],
+    ".oga": [OggVorbis, OggFLAC],
+    ".opus": [OggOpus],
+    ".m4a": [MP4],
+    ".mp4": [MP4],
+    ".aac": [AAC, MP4],
+    ".wav": [WAVE],
+    ".aif": [AIFF],
+    ".aiff": [AIFF],
+    ".tta": [TrueAudio],
+    ".ape": [MonkeysAudio],
+    ".wv": [WavPack],
+    ".mpc": [Musepack],
+    ".ofr": [OptimFROG],
+}
+
+# ID3 picture type of the front cover
+FRONT_COVER = 3
+
+
+class TagRecord:
+    """Normalized tags of one audio file"""
+    __slots__ = ("title", "artist", "album", "date", "genre", "track_no", "disc_no",
+                 "duration", "artwork", "gain", "reader")
+
+    def __init__(self):
+        self.title = "Unknown"
+        self.artist = "Unknown"
+        self.album = "Unknown"
+        self.date = ""
+        self.genre = ""
+        self.track_no = 0
+        self.disc_no = 0
+        self.duration = 0.0
+        self.artwork = None
+        self.gain = None
+        self.reader = None
+
+
+def parse_number(value):
+    """Parse "3", "3/12" or 3 into 3; 0 when missing or invalid"""
+    try:
+        return int(str(value).split("/", 1)[0].strip() or 0)
+    except ValueError:
+        return 0
+
+
+def parse_gain(value):
+    """Parse a ReplayGain value such as "-6.52 dB" into a float"""
+    try:
+        return float(str(value).lower().replace("db", "").strip())
+    except ValueError:
+        return None
+
+
+def read_id3(audio, record):
+    tags = audio.tags
+    if tags is None:
+        return
+
+    for key, attr in (("TIT2", "title"), ("TPE1", "artist"), ("TALB", "album")):
+        frame = tags.get(key)
+        if frame is not None and frame.text:
+            setattr(record, attr, str(frame.text[0]))
+
+    frame = tags.get("TCON")
+    if frame is not None and frame.genres:
+        record.genre = frame.genres[0]
+
+    frame = tags.get("TDRC") or tags.get("TYER")
+    if frame is not None and frame.text:
+        record.date = str(frame.text[0])
+
+    frame = tags.get("TRCK")
+    if frame is not None and frame.text:
+        record.track_no = parse_number(frame.text[0])
+    frame = tags.get("TPOS")
+    if frame is not None and frame.text:
+        record.disc_no = parse_number(frame.text[0])
+
+    frame = tags.get("TXXX:REPLAYGAIN_TRACK_GAIN") or tags.get("TXXX:replaygain_track_gain")
+    if frame is not None and frame.text:
+        record.gain = parse_gain(frame.text[0])
+
+    pictures = tags.getall("APIC")
+    if pictures:
+        front = [p for p in pictures if p.type == FRONT_COVER]
+        record.artwork = (front or pictures)[0].data
+
+
+def read_vorbis(audio, record):
+    tags = audio.tags
+    if tags is None:
+        return
+
+    def first(key):
+        values = tags.get(key)
+        return values[0] if values else None
+
+    for key, attr in (("title", "title"), ("artist", "artist"), ("album", "album"),
+                      ("date", "date"), ("genre", "genre")):
+        value = first(key)
+        if value:
+            setattr(record, attr, str(value))
+
+    record.track_no = parse_number(first("tracknumber") or 0)
+    record.disc_no = parse_number(first("discnumber") or 0)
+
+    gain = first("replaygain_track_gain")
+    if gain:
+        record.gain = parse_gain(gain)
+    elif first("r128_track_gain"):
+        # Opus R128 gain is a Q7.8 fixed point value in dB
+        record.gain = parse_number(first("r128_track_gain")) / 256.0
+
+    # FLAC keeps pictures in metadata blocks, Ogg in a base64 comment
+    pictures = list(getattr(audio, "pictures", None) or [])
+    if not pictures:
+        for value in tags.get("metadata_block_picture", []):
+            try:
+                pictures.append(Picture(base64.b64decode(value)))
+            except Exception as e:
+                print(f"Invalid METADATA_BLOCK_PICTURE: {e}")
+    if pictures:
+        front = [p for p in pictures if p.type == FRONT_COVER]
+        record.artwork = (front or pictures)[0].data
+    else:
+        legacy = first("coverart")
+        if legacy:
+            record.artwork = base64.b64decode(legacy)
+
+
+def read_mp4(audio, record):
+    tags = audio.tags
+    if tags is None:
+        return
+
+    for key, attr in (("\xa9nam", "title"), ("\xa9ART", "artist"), ("\xa9alb", "album"),
+                      ("\xa9day", "date"), ("\xa9gen", "genre")):
+        values = tags.get(key)
+        if values:
+            setattr(record, attr, str(values[0]))
+
+    values = tags.get("trkn")
+    if values:
+        record.track_no = values[0][0]
+    values = tags.get("disk")
+    if values:
+        record.disc_no = values[0][0]
+
+    values = tags.get("----:com.apple.iTunes:replaygain_track_gain")
+    if values:
+        record.gain = parse_gain(bytes(values[0]).decode("utf-8", "replace"))
+
+    covers = tags.get("covr")
+    if covers:
+        record.artwork = bytes(covers[0])
+
+
+def read_ape(audio, record):
+    tags = audio.tags
+    if tags is None:
+        return
+
+    # APEv2 keys are case-insensitive
+    for key, attr in (("Title", "title"), ("Artist", "artist"), ("Album", "album"),
+                      ("Year", "date"), ("Genre", "genre")):
+        value = tags.get(key)
+        if value is not None:
+            setattr(record, attr, str(value))
+
+    record.track_no = parse_number(tags.get("Track") or 0)
+    record.disc_no = parse_number(tags.get("Disc") or 0)
+
+    gain = tags.get("REPLAYGAIN_TRACK_GAIN")
+    if gain is not None:
+        record.gain = parse_gain(gain)
+
+    cover = tags.get("Cover Art (Front)")
+    if cover is not None:
+        # Binary value is "<filename>\0<image data>"
+        record.artwork = cover.value.split(b"\x00", 1)[-1]
+
+
+READERS = {}
+for types, reader in ((ID3_TYPES, read_id3), (VORBIS_TYPES, read_vorbis),
+                      (MP4_TYPES, read_mp4), (APE_TYPES, read_ape)):
+    for audio_type in types:
+        READERS[audio_type] = reader
+
+
+def reader_for(audio):
+    """Find the reader for a mutagen file object, caching subclass lookups"""
+    audio_type = type(audio)
+    reader = READERS.get(audio_type)
+    if reader is not None:
+        return reader
+
+    for base in audio_type.__mro__[1:]:
+        reader = READERS.get(base)
+        if reader is not None:
+            break
+    else:
+        # Unknown container, fall back to whatever tag format it carries
+        tags = getattr(audio, "tags", None)
+        if isinstance(tags, ID3):
+            return read_id3
+        elif isinstance(tags, VComment):
+            return read_vorbis
+        elif isinstance(tags, MP4Tags):
+            return read_mp4
+        elif isinstance(tags, APEv2):
+            return read_ape
+        return None
+
+    READERS[audio_type] = reader
+    return reader
+
+
+def open_audio(file_path):
+    """Open a file with mutagen, trying the types matching its extension first"""
+    extension = os.path.splitext(file_path)[1].lower()
+    options = EXTENSION_TYPES.get(extension)
+    if options:
+        try:
+            audio = mutagen.File(file_path, options=options)
+            if audio is not None:
+                return audio
+        except Exception:
+            # Misnamed file, let mutagen probe every format
+            pass
+    return mutagen.File(file_path)
+
+
+def read_metadata(file_path):
+    """Read normalized tags and artwork from an audio file"""
+    record = TagRecord()
+    # Files without a title tag show their file name, as they always have
+    record.title = os.path.splitext(os.path.basename(file_path))[0]
+    audio = open_audio(file_path)
+    if audio is None:
+        return record
+
+    if audio.info is not None:
+        record.duration = getattr(audio.info, "length", 0.0) or 0.0
+
+    reader = reader_for(audio)
+    if reader is not None:
+        reader(audio, record)
+        record.reader = reader.__name__
+    return record
+
+
+def read_artwork(file_path):
+    """Read only the artwork bytes of an audio file, None if it has none"""
+    return read_metadata(file_path).artwork
+
+
+def read_lyrics(file_path):
+    """Embedded lyrics as (text, synced) where synced is [(ms, line)] from an ID3 SYLT frame
+
+    Either part may be empty. The text may itself carry LRC timestamps.
+    """
+    audio = open_audio(file_path)
+    tags = getattr(audio, "tags", None)
+    if tags is None:
+        return "", []
+
+    if isinstance(tags, ID3):
+        for frame in tags.getall("SYLT"):
+            # Format 2 is milliseconds, 1 is MPEG frames which we can't map to time
+            if frame.format == 2 and frame.text:
+                return "", [(int(ms), line) for line, ms in frame.text]
+        frames = tags.getall("USLT")
+        return (str(frames[0].text) if frames else ""), []
+    elif isinstance(tags, VComment):
+        values = tags.get("lyrics") or tags.get("unsyncedlyrics") or []
+        return (str(values[0]) if values else ""), []
+    elif isinstance(tags, MP4Tags):
+        values = tags.get("\xa9lyr")
+        return (str(values[0]) if values else ""), []
+    elif isinstance(tags, APEv2):
+        value = tags.get("Lyrics")
+        return (str(value) if value is not None else ""), []
+    return "", []
+
+
+def benchmark_readers(file_paths, repeat=3):
+    """Time file opening and tag reading per reader; returns {reader: (files, open_us, read_us)}"""
+    results = {}
+    for file_path in file_paths:
+        for _ in range(repeat):
+            start = time.perf_counter()
+            audio = open_audio(file_path)
+            opened = time.perf_counter()
+            if audio is None:
+                break
+            reader = reader_for(audio)
+            if reader is None:
+                break
+            reader(audio, TagRecord())
+            done = time.perf_counter()
+
+            count, open_total, read_total = results.get(reader.__name__, (0, 0.0, 0.0))
+            results[reader.__name__] = (count + 1,
+                                        open_total + (opened - start) * 1e6,
+                                        read_total + (done - opened) * 1e6)
+
+    return {name: (count // repeat, open_total / count, read_total / count)
+            for name, (count, open_total, read_total) in results.items()}
+
+
+if __name__ == "__main__":
+    # Usage: python3 metadata.py FILE_OR_FOLDER...
+    paths = []
+    for arg in sys.argv[1:]:
+        if os.path.isdir(arg):
+            for root, dirs, files in os.walk(arg):
+                paths.extend(os.path.join(root, f) for f in files)
+        else:
+            paths.append(arg)
+
+    print(f"{'reader':<14}{'files':>8}{'open (us)':>14}{'read (us)':>14}")
+    for name, (count, open_us, read_us) in sorted(benchmark_readers(paths).items()):
+        print(f"{name:<14}{count:>8}{open_us:>14.1f}{read_us:>14.1f}")
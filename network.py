@@ -0,0 +1,351 @@
+import os
+import json
+import time
+import socket
+import signal
+
+import gi
+
+gi.require_version('Gst', '1.0')
+gi.require_version('GstNet', '1.0')
+from gi.repository import Gst, GstNet, GLib, Gio
+
+
+CLOCK_RATE = 48000
+PAYLOAD_TYPE = 96
+RTP_CAPS = (f"application/x-rtp,media=audio,clock-rate={CLOCK_RATE},"
+            f"encoding-name=OPUS,payload={PAYLOAD_TYPE}")
+
+# rtpbin's NTP times come from the pipeline clock, which senders and receivers share
+NTP_TIME_SOURCE_CLOCK_TIME = 3
+BUFFER_MODE_SYNCED = 4
+
+REPORT_INTERVAL_MS = 2000
+REPORT_EXPIRY = 10
+# Clock offset estimates kept by a receiver, the one with the shortest round trip is used
+CLOCK_PINGS = 8
+
+
+def is_multicast(address):
+    inet_address = Gio.InetAddress.new_from_string(address)
+    return inet_address is not None and inet_address.get_is_multicast()
+
+
+def _request_pad(element, name):
+    # request_pad_simple() replaced get_request_pad() in GStreamer 1.20
+    if hasattr(element, "request_pad_simple"):
+        return element.request_pad_simple(name)
+    return element.get_request_pad(name)
+
+
+def build_network_sink(local_sink, network_settings):
+    """Tee the decoded audio into local_sink and an RTP/Opus sender
+
+    The pipeline is given the receivers' latency (see NetworkOutput.attach), so
+    local_sink plays at the same clock time as they do. Only the RTP sink is
+    moved back by that latency, to send packets as the audio is decoded.
+    Returns local_sink unchanged if a plugin is missing.
+    """
+    address = network_settings["address"]
+    port = int(network_settings["port"])
+
+    factories = ["tee", "queue", "queue", "audioconvert", "audioresample", "opusenc",
+                 "rtpopuspay", "rtpbin", "udpsink", "udpsink"]
+    elements = [Gst.ElementFactory.make(factory, None) for factory in factories]
+    missing = [factory for factory, element in zip(factories, elements) if element is None]
+    if missing:
+        print(f"Network output unavailable, missing {', '.join(sorted(set(missing)))}")
+        return local_sink
+    tee, local_queue, net_queue, convert, resample, encoder, payloader, rtpbin, rtp_sink, rtcp_sink = elements
+
+    encoder.set_property("bitrate", int(network_settings["bitrate"]))
+    payloader.set_property("pt", PAYLOAD_TYPE)
+    rtpbin.set_property("ntp-time-source", NTP_TIME_SOURCE_CLOCK_TIME)
+    rtpbin.set_property("rtcp-sync-send-time", False)
+    rtp_sink.set_property("host", address)
+    rtp_sink.set_property("port", port)
+    # RTP goes out when due, not as fast as the decoder produces it
+    rtp_sink.set_property("sync", True)
+    rtp_sink.set_property("ts-offset", -int(network_settings["latency_ms"]) * Gst.MSECOND)
+    rtcp_sink.set_property("host", address)
+    rtcp_sink.set_property("port", port + 1)
+    rtcp_sink.set_property("sync", False)
+    rtcp_sink.set_property("async", False)
+
+    sink_bin = Gst.Bin.new("network-output")
+    for element in elements + [local_sink]:
+        sink_bin.add(element)
+    tee.link(local_queue)
+    local_queue.link(local_sink)
+    tee.link(net_queue)
+    net_queue.link(convert)
+    convert.link(resample)
+    resample.link(encoder)
+    encoder.link(payloader)
+    payloader.get_static_pad("src").link(_request_pad(rtpbin, "send_rtp_sink_0"))
+    rtpbin.link_pads("send_rtp_src_0", rtp_sink, "sink")
+    _request_pad(rtpbin, "send_rtcp_src_0").link(rtcp_sink.get_static_pad("sink"))
+
+    sink_bin.add_pad(Gst.GhostPad.new("sink", tee.get_static_pad("sink")))
+    return sink_bin
+
+
+def drift_between(report, reference):
+    """How much later (ns) report's receiver plays the same audio than reference's"""
+    # RTP timestamps are 32 bit and wrap, compare them as a signed difference
+    ticks = (report["rtp_ts"] - reference["rtp_ts"] + 2 ** 31) % 2 ** 32 - 2 ** 31
+    return (report["render_ns"] - reference["render_ns"]) - ticks * Gst.SECOND // CLOCK_RATE
+
+
+class NetworkOutput:
+    """Sender side: publishes the pipeline clock and collects receiver drift reports"""
+
+    def __init__(self, network_settings):
+        self.settings = network_settings
+        # The system clock outlives pipeline rebuilds, receivers stay locked to it
+        self.clock = Gst.SystemClock.obtain()
+        clock_port = int(network_settings["clock_port"])
+        self.provider = GstNet.NetTimeProvider.new(self.clock, None, clock_port)
+        if self.provider is None:
+            # It doesn't raise, e.g. when another sender on this machine has the port
+            raise OSError(f"Can't publish the clock on port {clock_port}")
+        self.drift = DriftMonitor(int(network_settings["report_port"]), self.clock)
+
+    def attach(self, player, local_sink):
+        """Make player run on the shared clock; returns the sink to give playbin"""
+        player.use_clock(self.clock)
+        # Receivers render at clock time + latency whatever their sink, so does the local output
+        player.set_latency(int(self.settings["latency_ms"]) * Gst.MSECOND)
+        return build_network_sink(local_sink, self.settings)
+
+    @staticmethod
+    def detach(player):
+        """Give player back its own clock and latency"""
+        player.auto_clock()
+        player.set_latency(Gst.CLOCK_TIME_NONE)
+
+    def close(self):
+        self.provider = None
+        self.drift.close()
+
+
+class DriftMonitor:
+    """Receives receivers' playout reports over UDP and compares them
+
+    Receivers also ping it to learn how far their network clock is off; the
+    reply carries this side's clock time.
+    """
+
+    def __init__(self, port, clock):
+        self.clock = clock
+        self.reports = {}
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.sock.bind(("0.0.0.0", port))
+        self.sock.setblocking(False)
+        self.watch_id = GLib.io_add_watch(self.sock.fileno(), GLib.PRIORITY_DEFAULT, GLib.IO_IN, self._on_readable)
+        self.print_id = GLib.timeout_add_seconds(REPORT_EXPIRY, self._print_summary)
+
+    def _on_readable(self, fd, condition):
+        try:
+            while True:
+                data, address = self.sock.recvfrom(2048)
+                report = json.loads(data)
+                if report.get("type") == "ping":
+                    pong = {"type": "pong", "sent_ns": report["sent_ns"], "sender_ns": self.clock.get_time()}
+                    self.sock.sendto(json.dumps(pong).encode("utf-8"), address)
+                    continue
+                # Put the render time on this side's clock
+                report["render_ns"] -= report.get("clock_offset_ns", 0)
+                report["received"] = time.monotonic()
+                self.reports[report["name"]] = report
+        except BlockingIOError:
+            pass
+        except (OSError, ValueError, KeyError) as e:
+            print(f"Bad drift report: {e}")
+        return True
+
+    def drifts(self):
+        """{receiver: ms behind the earliest receiver} over recently reporting receivers"""
+        now = time.monotonic()
+        reports = [report for report in self.reports.values() if now - report["received"] < REPORT_EXPIRY]
+        if not reports:
+            return {}
+        reference = reports[0]
+        offsets = {report["name"]: drift_between(report, reference) for report in reports}
+        earliest = min(offsets.values())
+        return {name: (offset - earliest) / Gst.MSECOND for name, offset in sorted(offsets.items())}
+
+    def summary(self):
+        drifts = self.drifts()
+        if not drifts:
+            return "Network: no receivers"
+        lines = [f"Network: {len(drifts)} receivers, spread {max(drifts.values()):.1f} ms"]
+        for name, drift in drifts.items():
+            clock_offset = self.reports[name].get("clock_offset_ns", 0) / Gst.MSECOND
+            lines.append(f"  {name}: +{drift:.1f} ms (network clock off by {clock_offset:+.2f} ms)")
+        return "\n".join(lines)
+
+    def _print_summary(self):
+        if len(self.drifts()) > 1:
+            print(self.summary())
+        return True
+
+    def close(self):
+        GLib.source_remove(self.watch_id)
+        GLib.source_remove(self.print_id)
+        self.sock.close()
+
+
+class Receiver:
+    """Plays the RTP stream of a sender, slaved to the sender's network clock
+
+    Every REPORT_INTERVAL_MS it tells the sender which RTP timestamp its audio
+    sink is playing at which clock time, for inter-receiver drift measurements.
+    The playing position comes from the sink, so decoder and device latency are
+    part of the measurement, and the render time is corrected by the error of
+    the network clock, measured with pings to the sender.
+    """
+
+    def __init__(self, sender_host, network_settings, name=None):
+        self.sender_host = sender_host
+        self.settings = network_settings
+        self.name = name or f"{socket.gethostname()}-{os.getpid()}"
+        self.latency = int(network_settings["latency_ms"]) * Gst.MSECOND
+        self.report_address = (sender_host, int(network_settings["report_port"]))
+        self.report_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.report_socket.setblocking(False)
+        self.clock = None
+        self.segment = None
+        # (pts, RTP timestamp) of the latest packet out of the jitter buffer
+        self.anchor = None
+        self.pings = []
+        self.loop = GLib.MainLoop()
+
+        address = network_settings["address"]
+        port = int(network_settings["port"])
+        # Unicast receivers listen on every interface, multicast ones join the group
+        listen = address if is_multicast(address) else "0.0.0.0"
+        # The jitter buffer takes part of the latency, the rest is headroom for decoding and the sink
+        jitter_latency = int(network_settings["latency_ms"]) // 2
+        self.pipeline = Gst.parse_launch(
+            f"rtpbin name=rtpbin latency={jitter_latency} ntp-sync=true "
+            f"ntp-time-source={NTP_TIME_SOURCE_CLOCK_TIME} buffer-mode={BUFFER_MODE_SYNCED} "
+            f"udpsrc address={listen} port={port} caps=\"{RTP_CAPS}\" ! rtpbin.recv_rtp_sink_0 "
+            f"udpsrc address={listen} port={port + 1} ! rtpbin.recv_rtcp_sink_0 "
+            f"rtpbin. ! rtpopusdepay ! opusdec ! audioconvert ! audioresample ! autoaudiosink name=sink")
+        self.pipeline.get_by_name("rtpbin").connect("pad-added", self._on_pad_added)
+        self.sink = self.pipeline.get_by_name("sink")
+        # Every receiver renders at the same delay after the sender, whatever its sink's latency
+        self.pipeline.set_latency(self.latency)
+
+        bus = self.pipeline.get_bus()
+        bus.add_signal_watch()
+        bus.connect("message", self._on_message)
+
+    def run(self):
+        self.clock = GstNet.NetClientClock.new("sender-clock", self.sender_host,
+                                               int(self.settings["clock_port"]), 0)
+        print(f"Waiting for the clock of {self.sender_host}...")
+        if not self.clock.wait_for_sync(10 * Gst.SECOND):
+            print("Could not synchronize with the sender's clock")
+            return 1
+        self.pipeline.use_clock(self.clock)
+
+        GLib.unix_signal_add(GLib.PRIORITY_DEFAULT, signal.SIGINT, self.loop.quit)
+        GLib.unix_signal_add(GLib.PRIORITY_DEFAULT, signal.SIGTERM, self.loop.quit)
+        watch_id = GLib.io_add_watch(self.report_socket.fileno(), GLib.PRIORITY_DEFAULT, GLib.IO_IN,
+                                     self._on_pong)
+        report_id = GLib.timeout_add(REPORT_INTERVAL_MS, self._report)
+        self.pipeline.set_state(Gst.State.PLAYING)
+        print(f"Receiving as {self.name}")
+        self.loop.run()
+        GLib.source_remove(report_id)
+        GLib.source_remove(watch_id)
+        self.pipeline.set_state(Gst.State.NULL)
+        self.report_socket.close()
+        return 0
+
+    def _on_message(self, bus, message):
+        if message.type == Gst.MessageType.ERROR:
+            err, debug = message.parse_error()
+            print("Error:", err, debug)
+            self.loop.quit()
+
+    def _on_pad_added(self, rtpbin, pad):
+        if pad.get_name().startswith("recv_rtp_src_"):
+            pad.add_probe(Gst.PadProbeType.BUFFER | Gst.PadProbeType.EVENT_DOWNSTREAM, self._on_rtp_probe)
+
+    def _on_rtp_probe(self, pad, info):
+        if info.type & Gst.PadProbeType.EVENT_DOWNSTREAM:
+            event = info.get_event()
+            if event.type == Gst.EventType.SEGMENT:
+                # Depayloader and decoder pass this segment on to the sink unchanged
+                self.segment = event.parse_segment()
+            return Gst.PadProbeReturn.OK
+
+        buffer = info.get_buffer()
+        if buffer.pts != Gst.CLOCK_TIME_NONE:
+            # Bytes 4-7 of the RTP header are the timestamp
+            self.anchor = (buffer.pts, int.from_bytes(buffer.extract_dup(4, 4), "big"))
+        return Gst.PadProbeReturn.OK
+
+    def _send(self, message):
+        try:
+            self.report_socket.sendto(json.dumps(message).encode("utf-8"), self.report_address)
+        except OSError as e:
+            print(f"Error sending to the sender: {e}")
+
+    def _report(self):
+        self._send({"type": "ping", "name": self.name, "sent_ns": self.clock.get_time()})
+
+        segment, anchor = self.segment, self.anchor
+        if segment is None or anchor is None:
+            return True
+        # What the sink is playing right now, on the shared clock
+        success, stream_time = self.sink.query_position(Gst.Format.TIME)
+        render_ns = self.clock.get_time()
+        if not success:
+            return True
+        pts = segment.position_from_stream_time(Gst.Format.TIME, stream_time)
+        if pts == -1 or pts == Gst.CLOCK_TIME_NONE:
+            return True
+
+        anchor_pts, anchor_rtp_ts = anchor
+        ticks = (pts - anchor_pts) * CLOCK_RATE // Gst.SECOND
+        self._send({
+            "type": "report",
+            "name": self.name,
+            "rtp_ts": (anchor_rtp_ts + ticks) % 2 ** 32,
+            "render_ns": render_ns,
+            "clock_offset_ns": self.clock_offset(),
+        })
+        return True
+
+    def _on_pong(self, fd, condition):
+        try:
+            while True:
+                data, address = self.report_socket.recvfrom(2048)
+                received_ns = self.clock.get_time()
+                pong = json.loads(data)
+                round_trip = received_ns - pong["sent_ns"]
+                # Our clock read this much ahead of the sender's, assuming a symmetric path
+                offset = (pong["sent_ns"] + received_ns) // 2 - pong["sender_ns"]
+                self.pings = (self.pings + [(round_trip, offset)])[-CLOCK_PINGS:]
+        except BlockingIOError:
+            pass
+        except (OSError, ValueError, KeyError) as e:
+            print(f"Bad clock reply: {e}")
+        return True
+
+    def clock_offset(self):
+        """Current error of the network clock against the sender's, in ns"""
+        if not self.pings:
+            return 0
+        return min(self.pings)[1]
+
+
+def run_receiver(sender_host, network_settings):
+    """Entry point of `main.py --receive HOST`"""
+    Gst.init(None)
+    return Receiver(sender_host, network_settings).run()
@@ -0,0 +1,83 @@
+import gi
+
+gi.require_version('Gst', '1.0')
+from gi.repository import Gst, GLib
+
+
+# How long an asynchronous state change may take before the track counts as stuck
+TRANSITION_TIMEOUT_MS = 10000
+STREAM_TRANSITION_TIMEOUT_MS = 30000
+
+
+class PlayerStateMachine:
+    """Follows the pipeline state from bus messages instead of waiting on get_state()
+
+    request() only records the wanted state and starts the change; the state
+    actually reached comes from STATE_CHANGED and ASYNC_DONE messages. A change
+    that hasn't prerolled within the timeout is reported through on_stuck(target)
+    so the caller can rebuild the pipeline or move on, without the main loop
+    ever blocking on the pipeline.
+    """
+
+    def __init__(self, player, on_reached=None, on_stuck=None):
+        self.player = player
+        self.on_reached = on_reached
+        self.on_stuck = on_stuck
+        self.state = Gst.State.NULL
+        self.target = Gst.State.NULL
+        self.timeout_id = None
+
+    def set_player(self, player):
+        """Follow a rebuilt pipeline, which starts out in NULL"""
+        self.cancel_timeout()
+        self.player = player
+        self.state = Gst.State.NULL
+        self.target = Gst.State.NULL
+
+    def request(self, state, timeout_ms=TRANSITION_TIMEOUT_MS):
+        """Start a change to state; returns the Gst.StateChangeReturn"""
+        self.cancel_timeout()
+        self.target = state
+        ret = self.player.set_state(state)
+        if ret == Gst.StateChangeReturn.ASYNC:
+            self.timeout_id = GLib.timeout_add(timeout_ms, self._on_timeout)
+        elif ret != Gst.StateChangeReturn.FAILURE:
+            # SUCCESS and NO_PREROLL complete right away
+            self.state = state
+        return ret
+
+    @property
+    def playing(self):
+        """Whether the user wants audio, even while the pipeline is still prerolling"""
+        return self.target == Gst.State.PLAYING
+
+    @property
+    def settled(self):
+        return self.timeout_id is None and self.state == self.target
+
+    def handle_message(self, message):
+        """Feed STATE_CHANGED and ASYNC_DONE messages from the pipeline's bus"""
+        if message.type == Gst.MessageType.STATE_CHANGED:
+            # Every element posts these, only the pipeline's own matter
+            if message.src != self.player:
+                return
+            old, new, pending = message.parse_state_changed()
+            self.state = new
+            if pending == Gst.State.VOID_PENDING and new == self.target:
+                self.cancel_timeout()
+                if self.on_reached is not None:
+                    self.on_reached(new)
+        elif message.type == Gst.MessageType.ASYNC_DONE:
+            # Prerolled: whatever follows (buffering, PAUSED -> PLAYING) is not stuck
+            self.cancel_timeout()
+
+    def cancel_timeout(self):
+        if self.timeout_id is not None:
+            GLib.source_remove(self.timeout_id)
+            self.timeout_id = None
+
+    def _on_timeout(self):
+        self.timeout_id = None
+        if self.on_stuck is not None:
+            self.on_stuck(self.target)
+        return False
@@ -0,0 +1,277 @@
+import os
+import json
+from bisect import bisect_left
+from collections import Counter
+from difflib import SequenceMatcher
+
+
+# Compact once the journal holds this many edits or a quarter of the playlist's size
+MAX_JOURNAL_OPS = 1000
+MAX_JOURNAL_RATIO = 0.25
+# Most entries difflib may look at, reorders make it quadratic and saves run on the GTK
+# thread; larger edits get the O(n log n) anchored diff
+MAX_DIFF_ENTRIES = 5000
+
+
+def parse_m3u(lines):
+    """[(path, length, display)] from M3U lines; #EXTINF info is optional"""
+    entries = []
+    length, display = -1, ""
+    for line in lines:
+        line = line.strip()
+        if not line:
+            continue
+        if line.startswith("#EXTINF:"):
+            info, _, display = line[len("#EXTINF:"):].partition(",")
+            try:
+                length = int(info.split()[0]) if info.split() else -1
+            except ValueError:
+                length = -1
+        elif not line.startswith("#"):
+            entries.append((line, length, display))
+            length, display = -1, ""
+    return entries
+
+
+def format_m3u(entries):
+    lines = ["#EXTM3U\n"]
+    for path, length, display in entries:
+        lines.append(f"#EXTINF:{length},{display}\n")
+        lines.append(f"{path}\n")
+    return "".join(lines)
+
+
+def diff_entries(old, new, max_changed):
+    """Splices [(start, end, entries)] turning old into new, to be applied in order
+
+    None when more than max_changed entries would be written; rewriting the
+    whole playlist is the better deal then.
+    """
+    # Most edits touch one spot, trim the common head and tail first
+    head = 0
+    limit = min(len(old), len(new))
+    while head < limit and old[head] == new[head]:
+        head += 1
+    tail = 0
+    while tail < limit - head and old[len(old) - 1 - tail] == new[len(new) - 1 - tail]:
+        tail += 1
+    old_middle = old[head:len(old) - tail]
+    new_middle = new[head:len(new) - tail]
+    if not old_middle and not new_middle:
+        return []
+
+    if len(old_middle) + len(new_middle) <= MAX_DIFF_ENTRIES:
+        matcher = SequenceMatcher(None, old_middle, new_middle, autojunk=False)
+        splices = [(head + i1, head + i2, new_middle[j1:j2])
+                   for tag, i1, i2, j1, j2 in matcher.get_opcodes() if tag != "equal"]
+    else:
+        splices = [(head + start, head + end, entries)
+                   for start, end, entries in _anchored_splices(old_middle, new_middle)]
+
+    if sum(len(entries) for start, end, entries in splices) > max_changed:
+        return None
+    # Back to front, so earlier positions are still valid when a splice is applied
+    return splices[::-1]
+
+
+def _anchored_splices(old, new):
+    """Splices around the longest subsequence of entries, unique in both lists, that kept their order
+
+    Patience diff without the recursion: O(n log n) whatever the edits, and as
+    fine as difflib when the lists mostly agree. The splices are in ascending order.
+    """
+    counts = Counter(old)
+    new_counts = Counter(new)
+    new_index = {entry: j for j, entry in enumerate(new) if new_counts[entry] == 1}
+    pairs = [(i, new_index[entry]) for i, entry in enumerate(old)
+             if counts[entry] == 1 and entry in new_index]
+
+    # Longest increasing subsequence of the new positions
+    tails = []
+    tail_pairs = []
+    previous = [None] * len(pairs)
+    for k, (i, j) in enumerate(pairs):
+        slot = bisect_left(tails, j)
+        if slot == len(tails):
+            tails.append(j)
+            tail_pairs.append(k)
+        else:
+            tails[slot] = j
+            tail_pairs[slot] = k
+        previous[k] = tail_pairs[slot - 1] if slot else None
+    anchors = []
+    k = tail_pairs[-1] if tail_pairs else None
+    while k is not None:
+        anchors.append(pairs[k])
+        k = previous[k]
+    anchors.reverse()
+
+    splices = []
+    old_start = new_start = 0
+    for i, j in anchors + [(len(old), len(new))]:
+        if i > old_start or j > new_start:
+            splices.append((old_start, i, new[new_start:j]))
+        old_start, new_start = i + 1, j + 1
+    return splices
+
+
+def merge_groups(queued_paths, paths):
+    """Where to insert the paths not queued yet when merging paths into a queue
+
+    Returns [(position, [paths])] to insert in that order: each group goes after
+    its predecessor in paths, groups before the first queued path go in front
+    of it, and with nothing in common everything goes to the end.
+    """
+    queued = {path: index for index, path in enumerate(queued_paths)}
+    groups = []
+    pending = []
+    previous = None
+    for path in paths:
+        index = queued.get(path)
+        if index is None:
+            pending.append(path)
+            continue
+        if pending:
+            groups.append((index if previous is None else previous + 1, len(groups), pending))
+            pending = []
+        previous = index
+    if pending:
+        groups.append((len(queued_paths) if previous is None else previous + 1, len(groups), pending))
+
+    # Back to front, so the positions of the groups still to insert stay valid
+    return [(position, group) for position, order, group in sorted(groups, reverse=True)]
+
+
+def _signature(path):
+    st = os.stat(path)
+    return [st.st_size, st.st_mtime_ns]
+
+
+class PlaylistFile:
+    """An M3U playlist saved incrementally
+
+    Saves append the difference to the last saved version to a journal next to
+    the playlist (name.m3u.journal), so changing one track of a huge playlist
+    writes a few bytes. The journal is folded back into the M3U file once it
+    grows too long. Readers get the base file with the journal replayed.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.journal_path = path + ".journal"
+        self.entries = None
+        self.journal_ops = 0
+        self.journal_bytes = 0
+
+    def load(self):
+        """The playlist's entries, base file plus journal"""
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                entries = parse_m3u(f)
+        except FileNotFoundError:
+            entries = []
+        self.journal_ops = 0
+        self.journal_bytes = 0
+
+        try:
+            with open(self.journal_path, "rb") as f:
+                data = f.read()
+        except FileNotFoundError:
+            data = b""
+        if data:
+            entries, sound = self._replay(entries, data)
+            if sound == 0:
+                # The M3U file was replaced by someone else, the journal no longer applies to it
+                print(f"Dropping stale playlist journal {self.journal_path}")
+                os.unlink(self.journal_path)
+            elif sound < len(data):
+                # A save interrupted halfway; later saves must not append after the broken line
+                print(f"Dropping the unfinished end of {self.journal_path}")
+                os.truncate(self.journal_path, sound)
+            self.journal_bytes = sound
+
+        self.entries = entries
+        return list(entries)
+
+    def _replay(self, entries, data):
+        """Apply the journal in data to entries; returns them and how many bytes of data are sound"""
+        # Whatever follows the last newline is a torn write, split() leaves it last
+        lines = data.split(b"\n")
+        try:
+            header = json.loads(lines[0]) if len(lines) > 1 else None
+            current = _signature(self.path) if os.path.exists(self.path) else None
+        except (ValueError, OSError):
+            header, current = None, None
+        if not isinstance(header, dict) or header.get("base") != current:
+            return entries, 0
+
+        sound = len(lines[0]) + 1
+        for line in lines[1:-1]:
+            try:
+                op = json.loads(line)
+                entries[op["start"]:op["end"]] = [tuple(entry) for entry in op["entries"]]
+            except (ValueError, KeyError, TypeError):
+                break
+            sound += len(line) + 1
+            self.journal_ops += 1
+        return entries, sound
+
+    def save(self, entries):
+        """Write entries, appending only the difference to the last saved version; returns bytes written"""
+        entries = [tuple(entry) for entry in entries]
+        if self.entries is None:
+            if os.path.exists(self.path):
+                self.load()
+            else:
+                return self.compact(entries)
+
+        # Rewriting is cheaper once the edits are a good part of the playlist anyway
+        splices = diff_entries(self.entries, entries, int(MAX_JOURNAL_RATIO * len(entries)))
+        if splices == []:
+            return 0
+        if (splices is None or self.journal_ops + len(splices) > MAX_JOURNAL_OPS or
+                self.journal_bytes > MAX_JOURNAL_RATIO * max(1, os.path.getsize(self.path))):
+            return self.compact(entries)
+
+        lines = []
+        if not os.path.exists(self.journal_path):
+            lines.append(json.dumps({"base": _signature(self.path)}) + "\n")
+        for start, end, new in splices:
+            lines.append(json.dumps({"start": start, "end": end, "entries": new}) + "\n")
+        data = "".join(lines).encode("utf-8")
+        try:
+            with open(self.journal_path, "ab") as f:
+                f.write(data)
+                f.flush()
+                os.fsync(f.fileno())
+        except OSError:
+            # Part of the edit may be on disk, the next save reloads and trims it first
+            self.entries = None
+            raise
+
+        self.entries = entries
+        self.journal_ops += len(splices)
+        self.journal_bytes += len(data)
+        return len(data)
+
+    def compact(self, entries=None):
+        """Rewrite the M3U file with everything and drop the journal"""
+        if entries is None:
+            entries = self.load()
+        entries = [tuple(entry) for entry in entries]
+        data = format_m3u(entries).encode("utf-8")
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
+        try:
+            os.unlink(self.journal_path)
+        except FileNotFoundError:
+            pass
+
+        self.entries = entries
+        self.journal_ops = 0
+        self.journal_bytes = 0
+        return len(data)
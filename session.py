@@ -0,0 +1,79 @@
+import os
+import sqlite3
+
+from settings import get_config_directory
+from track import Track
+
+
+QUEUE_COLUMNS = Track.__slots__
+
+
+class SessionStore:
+    """Snapshots the play queue and player state to a small SQLite database"""
+
+    def __init__(self, path=None):
+        self.path = path or os.path.join(get_config_directory(), "session.db")
+        self.conn = sqlite3.connect(self.path)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS queue (
+                position INTEGER PRIMARY KEY,
+                path TEXT NOT NULL,
+                title TEXT, artist TEXT, album TEXT,
+                year INTEGER, track_no INTEGER, disc_no INTEGER,
+                duration_ms INTEGER, artwork_hash TEXT, gain REAL, genre TEXT
+            );
+            CREATE TABLE IF NOT EXISTS state (
+                key TEXT PRIMARY KEY,
+                value
+            );
+        """)
+        columns = [row[1] for row in self.conn.execute("PRAGMA table_info(queue)")]
+        if "genre" not in columns:
+            self.conn.execute("ALTER TABLE queue ADD COLUMN genre TEXT")
+        self.conn.commit()
+
+        # Paths as last written, so a save only touches rows that changed
+        self.saved_paths = [row[0] for row in self.conn.execute("SELECT path FROM queue ORDER BY position")]
+
+    def load_queue(self):
+        """Rebuild the saved queue as Track objects without reading any tags"""
+        rows = self.conn.execute(f"SELECT {', '.join(QUEUE_COLUMNS)} FROM queue ORDER BY position")
+        return [Track(*row) for row in rows]
+
+    def save_queue(self, tracks):
+        """Write the queue, rewriting only the rows after the first difference"""
+        paths = [track.path for track in tracks]
+
+        # Appends and edits near the end only rewrite the tail
+        common = 0
+        limit = min(len(paths), len(self.saved_paths))
+        while common < limit and paths[common] == self.saved_paths[common]:
+            common += 1
+        if common == len(paths) == len(self.saved_paths):
+            return 0
+
+        with self.conn:
+            self.conn.execute("DELETE FROM queue WHERE position >= ?", (common,))
+            self.conn.executemany(
+                f"INSERT INTO queue (position, {', '.join(QUEUE_COLUMNS)}) VALUES ({', '.join('?' * (len(QUEUE_COLUMNS) + 1))})",
+                ((position, *(getattr(track, column) for column in QUEUE_COLUMNS))
+                 for position, track in enumerate(tracks[common:], common))
+            )
+        self.saved_paths = paths
+        return len(paths) - common
+
+    def invalidate_queue(self):
+        """Force the next save_queue to rewrite every row (e.g. after tags changed)"""
+        self.saved_paths = []
+
+    def load_state(self):
+        return dict(self.conn.execute("SELECT key, value FROM state"))
+
+    def save_state(self, **values):
+        with self.conn:
+            self.conn.executemany("INSERT OR REPLACE INTO state (key, value) VALUES (?, ?)", values.items())
+
+    def close(self):
+        self.conn.close()
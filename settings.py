@@ -0,0 +1,101 @@
+import os
+import json
+import copy
+
+
+DEFAULT_SETTINGS = {
+    "audio_output": {
+        "sink": "auto",            # auto, pulse, pipewire, alsa, file, fake
+        "device": "",              # sink specific device, e.g. "hw:0,0" for alsa
+        "file_location": "",       # output path when sink is "file"
+        "buffer_time_ms": 200,     # total ring buffer size of the sink
+        "latency_time_ms": 10,     # size of one ring buffer segment
+        "passthrough": False,      # bit-perfect: no soft volume, no conversion
+    },
+    "streaming": {
+        "buffer_size_kb": -1,              # network buffer size, -1 for playbin default
+        "buffer_duration_ms": 5000,        # network buffer duration, -1 for playbin default
+        "ring_buffer_max_size_kb": 0,      # ring buffer for progressive files, 0 disables it
+        "progressive_download": False,     # download progressive http files while playing
+        "low_watermark": 0.10,             # pause when the buffer drops below this fill level
+        "high_watermark": 0.99,            # resume once the buffer is filled up to here
+    },
+    "dedup": {
+        "fingerprints": False,     # fingerprint tracks with GStreamer's chromaprint element
+        "fingerprint_workers": 2,  # background fingerprinting pipelines
+        "similarity": 0.85,        # fraction of equal fingerprint bits to call it a duplicate
+    },
+    "visualizer": {
+        "enabled": False,          # spectrum analyser in playbin's audio-filter
+        "bands": 32,               # number of frequency bars
+        "max_fps": 60,             # upper bound for spectrum messages and redraws
+    },
+    "dsp": {
+        "enabled": False,          # equalizer, compressor and balance in playbin's audio-filter
+        "preset": "Flat",          # default preset when a track or album has none assigned
+        "presets": {},             # user presets by name, same shape as dsp.BUILTIN_PRESETS
+    },
+    "network": {
+        "enabled": False,          # also send the decoded audio to receivers as RTP/Opus
+        "address": "239.255.42.42",  # multicast group, or a single receiver's address
+        "port": 5004,              # RTP port, RTCP uses the next one
+        "clock_port": 5006,        # network clock receivers slave their pipelines to
+        "report_port": 5007,       # receivers send their drift reports here
+        "latency_ms": 300,         # playout delay of receivers; local output is delayed as much
+        "bitrate": 128000,         # Opus bitrate in bits per second
+    },
+    "http_api": {
+        "enabled": False,          # HTTP/JSON control API with a server-sent event stream
+        "host": "127.0.0.1",       # listen address, 0.0.0.0 to allow other machines
+        "port": 8080,
+        "max_event_rate": 4,       # event batches per second and client at most
+    },
+}
+
+
+def get_config_directory():
+    """Get or create the application config directory in user's home folder"""
+    home = os.path.expanduser("~")
+    config_dir = os.path.join(home, ".ubuntu_music_player")
+    os.makedirs(config_dir, exist_ok=True)
+    return config_dir
+
+
+def get_settings_path():
+    return os.path.join(get_config_directory(), "settings.json")
+
+
+def _merge(defaults, values):
+    merged = copy.deepcopy(defaults)
+    for key, value in values.items():
+        if isinstance(merged.get(key), dict) and isinstance(value, dict):
+            merged[key] = _merge(merged[key], value)
+        else:
+            merged[key] = value
+    return merged
+
+
+def load_settings():
+    """Load settings from disk, filling in defaults for missing keys"""
+    try:
+        with open(get_settings_path(), 'r', encoding='utf-8') as f:
+            return _merge(DEFAULT_SETTINGS, json.load(f))
+    except FileNotFoundError:
+        return copy.deepcopy(DEFAULT_SETTINGS)
+    except Exception as e:
+        print(f"Error loading settings: {e}")
+        return copy.deepcopy(DEFAULT_SETTINGS)
+
+
+def save_settings(settings):
+    """Write settings to disk, replacing the previous file atomically"""
+    path = get_settings_path()
+    tmp_path = path + ".tmp"
+    try:
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(settings, f, indent=2)
+        os.replace(tmp_path, path)
+        return True
+    except Exception as e:
+        print(f"Error saving settings: {e}")
+        return False
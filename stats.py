@@ -0,0 +1,98 @@
+import time
+import queue
+import sqlite3
+import threading
+
+from gi.repository import GLib
+
+from library import get_library_path
+
+
+# A listen counts as a play past this fraction of the track (or after PLAY_SECONDS)
+PLAY_FRACTION = 0.5
+PLAY_SECONDS = 240
+
+UPSERT_PLAY = """
+    INSERT INTO play_stats (path, play_count, skip_count, last_played, listened) VALUES (?, 1, 0, ?, ?)
+    ON CONFLICT(path) DO UPDATE SET
+        play_count = play_count + 1,
+        last_played = excluded.last_played,
+        listened = listened + excluded.listened
+"""
+
+UPSERT_SKIP = """
+    INSERT INTO play_stats (path, play_count, skip_count, last_played, listened) VALUES (?, 0, 1, NULL, ?)
+    ON CONFLICT(path) DO UPDATE SET
+        skip_count = skip_count + 1,
+        listened = listened + excluded.listened
+"""
+
+
+def is_play(listened_seconds, duration_seconds):
+    if duration_seconds <= 0:
+        return listened_seconds >= PLAY_SECONDS
+    return listened_seconds >= min(duration_seconds * PLAY_FRACTION, PLAY_SECONDS)
+
+
+class PlayStatsRecorder:
+    """Queues play/skip events and writes them in batches on a background thread"""
+
+    def __init__(self, path=None, flush_interval=5.0, on_flushed=None):
+        self.path = path or get_library_path()
+        self.flush_interval = flush_interval
+        self.on_flushed = on_flushed
+        self.events = queue.Queue()
+        self.thread = threading.Thread(target=self._run, name="play-stats", daemon=True)
+        self.thread.start()
+
+    def record(self, path, listened_seconds, duration_seconds):
+        """Record one listen; never blocks on disk"""
+        fraction = min(1.0, listened_seconds / duration_seconds) if duration_seconds > 0 else 0.0
+        kind = "play" if is_play(listened_seconds, duration_seconds) else "skip"
+        self.events.put((kind, path, int(time.time()), fraction))
+
+    def close(self, timeout=2.0):
+        self.events.put(None)
+        self.thread.join(timeout)
+
+    def _run(self):
+        conn = sqlite3.connect(self.path)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+
+        running = True
+        while running:
+            # Wait for the first event, then give others time to pile up
+            event = self.events.get()
+            batch = []
+            deadline = time.monotonic() + self.flush_interval
+            while event is not None:
+                batch.append(event)
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    event = self.events.get(timeout=remaining)
+                except queue.Empty:
+                    break
+            if event is None:
+                running = False
+
+            if batch:
+                self._write(conn, batch)
+        conn.close()
+
+    def _write(self, conn, batch):
+        plays = [(path, played_at, fraction) for kind, path, played_at, fraction in batch if kind == "play"]
+        skips = [(path, fraction) for kind, path, played_at, fraction in batch if kind == "skip"]
+        try:
+            with conn:
+                conn.executemany(UPSERT_PLAY, plays)
+                conn.executemany(UPSERT_SKIP, skips)
+        except sqlite3.Error as e:
+            print(f"Error writing play statistics: {e}")
+            return
+
+        if self.on_flushed is not None:
+            paths = sorted({event[1] for event in batch})
+            GLib.idle_add(self.on_flushed, paths)
@@ -0,0 +1,124 @@
+import os
+import gi
+
+gi.require_version('Gst', '1.0')
+from gi.repository import Gst, GLib
+from urllib.parse import urlparse, unquote
+
+
+STREAM_SCHEMES = ("http", "https", "icy", "icyx")
+
+# GstPlayFlags value enabling progressive download buffering in playbin
+PLAY_FLAG_DOWNLOAD = 1 << 7
+
+
+def is_stream_uri(location):
+    """True for network locations (http(s)/Icecast) rather than local paths"""
+    scheme = location.split("://", 1)[0].lower() if "://" in location else ""
+    return scheme in STREAM_SCHEMES
+
+
+def to_uri(location):
+    """Turn a playlist entry into a URI playbin understands"""
+    if is_stream_uri(location):
+        return location
+    return GLib.filename_to_uri(location)
+
+
+def stream_display_name(location):
+    """Short name for a stream entry: last path component or the host name"""
+    parsed = urlparse(location)
+    name = unquote(os.path.basename(parsed.path.rstrip("/")))
+    return name or parsed.netloc or location
+
+
+def apply_stream_buffering(player, stream_settings):
+    """Configure playbin network buffering and progressive download"""
+    buffer_size_kb = int(stream_settings.get("buffer_size_kb", -1))
+    buffer_duration_ms = int(stream_settings.get("buffer_duration_ms", -1))
+    ring_buffer_kb = int(stream_settings.get("ring_buffer_max_size_kb", 0))
+
+    player.set_property("buffer-size", buffer_size_kb * 1024 if buffer_size_kb > 0 else -1)
+    player.set_property("buffer-duration",
+                        buffer_duration_ms * Gst.MSECOND if buffer_duration_ms > 0 else -1)
+    player.set_property("ring-buffer-max-size", max(0, ring_buffer_kb) * 1024)
+
+    flags = player.get_property("flags")
+    if stream_settings.get("progressive_download", False):
+        flags |= PLAY_FLAG_DOWNLOAD
+    else:
+        flags &= ~PLAY_FLAG_DOWNLOAD
+    player.set_property("flags", flags)
+
+
+def configure_queue_element(element, stream_settings):
+    """Apply buffering watermarks to the queue2 playbin inserts for network sources"""
+    factory = element.get_factory()
+    if factory is None or factory.get_name() != "queue2":
+        return False
+    low = float(stream_settings.get("low_watermark", 0.10))
+    high = float(stream_settings.get("high_watermark", 0.99))
+    element.set_property("low-watermark", max(0.0, min(low, high)))
+    element.set_property("high-watermark", min(1.0, max(low, high)))
+    return True
+
+
+def parse_icy_title(taglist):
+    """Return (title, artist, station) from an ICY/stream tag list, None if absent"""
+    title = artist = station = None
+
+    success, value = taglist.get_string(Gst.TAG_TITLE)
+    if success and value:
+        # Icecast sends "StreamTitle" as "Artist - Title"
+        if " - " in value:
+            artist, title = value.split(" - ", 1)
+        else:
+            title = value
+
+    success, value = taglist.get_string(Gst.TAG_ARTIST)
+    if success and value:
+        artist = value
+
+    success, value = taglist.get_string(Gst.TAG_ORGANIZATION)
+    if success and value:
+        station = value
+
+    return title, artist, station
+
+
+class StreamBufferController:
+    """Pauses the pipeline while the network buffer refills and resumes it afterwards"""
+
+    def __init__(self, player):
+        self.player = player
+        self.target_state = Gst.State.NULL
+        self.is_live = False
+        self.buffering = False
+        self.percent = 100
+
+    def reset(self, target_state, is_live=False):
+        self.target_state = target_state
+        self.is_live = is_live
+        self.buffering = False
+        self.percent = 100
+
+    def set_target_state(self, state):
+        self.target_state = state
+
+    def handle_buffering(self, message):
+        """Handle a BUFFERING message; returns the fill level in percent"""
+        self.percent = message.parse_buffering()
+
+        # Live sources can't be paused to wait for data
+        if self.is_live:
+            return self.percent
+
+        if self.percent < 100 and not self.buffering:
+            self.buffering = True
+            if self.target_state == Gst.State.PLAYING:
+                self.player.set_state(Gst.State.PAUSED)
+        elif self.percent >= 100 and self.buffering:
+            self.buffering = False
+            if self.target_state == Gst.State.PLAYING:
+                self.player.set_state(Gst.State.PLAYING)
+        return self.percent
@@ -0,0 +1,231 @@
+import os
+import base64
+import shutil
+import tempfile
+import threading
+from collections import OrderedDict
+
+from gi.repository import GLib
+
+from mutagen.id3 import ID3, TIT2, TPE1, TALB, TCON, TDRC, TRCK, APIC
+from mutagen.flac import FLAC, Picture
+from mutagen.mp4 import MP4Tags, MP4Cover
+from mutagen.apev2 import APEv2, APEValue, BINARY
+from mutagen._vorbis import VComment
+
+from metadata import open_audio, FRONT_COVER
+
+
+# Fields the writers understand; artwork is raw image bytes
+WRITABLE_FIELDS = ("title", "artist", "album", "genre", "year", "track_no", "artwork")
+
+# Copies being written sit next to the original under this prefix
+TEMP_PREFIX = ".tagwrite-"
+
+
+def check_fields(changes):
+    unknown = set(changes) - set(WRITABLE_FIELDS)
+    if unknown:
+        raise ValueError(f"Unknown tag fields: {', '.join(sorted(unknown))}")
+
+
+def is_temp_file(file_path):
+    return os.path.basename(file_path).startswith(TEMP_PREFIX)
+
+
+def image_mime(data):
+    return "image/png" if data[:8] == b"\x89PNG\r\n\x1a\n" else "image/jpeg"
+
+
+def write_id3(audio, changes):
+    if audio.tags is None:
+        audio.add_tags()
+    tags = audio.tags
+    for field, frame in (("title", TIT2), ("artist", TPE1), ("album", TALB), ("genre", TCON)):
+        if field in changes:
+            tags.setall(frame.__name__, [frame(encoding=3, text=changes[field])])
+    if "year" in changes:
+        tags.delall("TYER")
+        tags.setall("TDRC", [TDRC(encoding=3, text=str(changes["year"]))])
+    if "track_no" in changes:
+        tags.setall("TRCK", [TRCK(encoding=3, text=str(changes["track_no"]))])
+    if "artwork" in changes:
+        data = changes["artwork"]
+        tags.setall("APIC", [APIC(encoding=3, mime=image_mime(data), type=FRONT_COVER, desc="", data=data)])
+
+
+def write_vorbis(audio, changes):
+    if audio.tags is None:
+        audio.add_tags()
+    tags = audio.tags
+    for field, key in (("title", "title"), ("artist", "artist"), ("album", "album"), ("genre", "genre"),
+                       ("year", "date"), ("track_no", "tracknumber")):
+        if field in changes:
+            tags[key] = [str(changes[field])]
+
+    if "artwork" in changes:
+        picture = Picture()
+        picture.type = FRONT_COVER
+        picture.data = changes["artwork"]
+        picture.mime = image_mime(picture.data)
+        if isinstance(audio, FLAC):
+            audio.clear_pictures()
+            audio.add_picture(picture)
+        else:
+            tags["metadata_block_picture"] = [base64.b64encode(picture.write()).decode("ascii")]
+            if "coverart" in tags:
+                del tags["coverart"]
+
+
+def write_mp4(audio, changes):
+    if audio.tags is None:
+        audio.add_tags()
+    tags = audio.tags
+    for field, key in (("title", "\xa9nam"), ("artist", "\xa9ART"), ("album", "\xa9alb"), ("genre", "\xa9gen"),
+                       ("year", "\xa9day")):
+        if field in changes:
+            tags[key] = [str(changes[field])]
+    if "track_no" in changes:
+        total = tags.get("trkn", [(0, 0)])[0][1]
+        tags["trkn"] = [(int(changes["track_no"]), total)]
+    if "artwork" in changes:
+        data = changes["artwork"]
+        image_format = MP4Cover.FORMAT_PNG if image_mime(data) == "image/png" else MP4Cover.FORMAT_JPEG
+        tags["covr"] = [MP4Cover(data, imageformat=image_format)]
+
+
+def write_ape(audio, changes):
+    if audio.tags is None:
+        audio.add_tags()
+    tags = audio.tags
+    for field, key in (("title", "Title"), ("artist", "Artist"), ("album", "Album"), ("genre", "Genre"),
+                       ("year", "Year"), ("track_no", "Track")):
+        if field in changes:
+            tags[key] = str(changes[field])
+    if "artwork" in changes:
+        tags["Cover Art (Front)"] = APEValue(b"cover.jpg\x00" + changes["artwork"], BINARY)
+
+
+def writer_for(audio):
+    tags = getattr(audio, "tags", None)
+    if tags is None:
+        # No tags yet, pick by what the format would create
+        try:
+            audio.add_tags()
+        except Exception:
+            return None
+        tags = audio.tags
+    if isinstance(tags, ID3):
+        return write_id3
+    elif isinstance(tags, VComment):
+        return write_vorbis
+    elif isinstance(tags, MP4Tags):
+        return write_mp4
+    elif isinstance(tags, APEv2):
+        return write_ape
+    return None
+
+
+def apply_tags(file_path, changes):
+    """Write changes straight into a file (one nobody else is using yet)"""
+    check_fields(changes)
+    audio = open_audio(file_path)
+    if audio is None:
+        raise ValueError("unsupported file format")
+    writer = writer_for(audio)
+    if writer is None:
+        raise ValueError("unsupported tag format")
+    writer(audio, changes)
+    audio.save()
+
+
+def write_tags(file_path, changes):
+    """Apply changes to a copy of the file, then rename it over the original"""
+    directory = os.path.dirname(file_path)
+    fd, tmp_path = tempfile.mkstemp(prefix=TEMP_PREFIX, suffix=os.path.splitext(file_path)[1], dir=directory)
+    os.close(fd)
+    try:
+        shutil.copy2(file_path, tmp_path)
+        apply_tags(tmp_path, changes)
+        os.replace(tmp_path, file_path)
+    except BaseException:
+        try:
+            os.unlink(tmp_path)
+        except OSError:
+            pass
+        raise
+
+
+class TagWriteQueue:
+    """Writes tags on a background thread, merging queued edits of the same file"""
+
+    def __init__(self, on_written=None):
+        self.on_written = on_written
+        self.pending = OrderedDict()
+        self.condition = threading.Condition()
+        self.thread = None
+        self.closed = False
+        self.writing = False
+
+    def submit(self, file_path, changes):
+        """Queue changes ({field: value}) for a file; never blocks on disk"""
+        # Rejected here, where the caller can see it, rather than on the writer thread
+        check_fields(changes)
+        with self.condition:
+            if file_path in self.pending:
+                # Not written yet, later values win
+                self.pending[file_path].update(changes)
+            else:
+                self.pending[file_path] = dict(changes)
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._run, name="tag-writer", daemon=True)
+                self.thread.start()
+            self.condition.notify()
+
+    def pending_count(self):
+        with self.condition:
+            return len(self.pending)
+
+    def remove_leftover(self, tmp_path):
+        """Delete a temp copy left behind by a write that never finished; False while writes are running"""
+        with self.condition:
+            if self.pending or self.writing:
+                return False
+            try:
+                os.unlink(tmp_path)
+            except OSError as e:
+                print(f"Error removing {tmp_path}: {e}")
+                return False
+        return True
+
+    def close(self):
+        """Write everything still queued; the library already shows these edits"""
+        with self.condition:
+            self.closed = True
+            if self.pending:
+                print(f"Writing {len(self.pending)} pending tag edits")
+            self.condition.notify()
+        if self.thread is not None:
+            self.thread.join()
+
+    def _run(self):
+        while True:
+            with self.condition:
+                while not self.pending and not self.closed:
+                    self.condition.wait()
+                if not self.pending:
+                    return
+                file_path, changes = self.pending.popitem(last=False)
+                self.writing = True
+
+            error = None
+            try:
+                write_tags(file_path, changes)
+            except Exception as e:
+                error = e
+                print(f"Error writing tags to {file_path}: {e}")
+
+            with self.condition:
+                self.writing = False
+            if self.on_written is not None:
+                GLib.idle_add(self.on_written, file_path, changes, error)
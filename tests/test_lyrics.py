@@ -0,0 +1,72 @@
+import pytest
+
+pytest.importorskip("mutagen")
+
+from lyrics import Lyrics, parse_lrc
+
+
+LRC = """[ar:Someone]
+[ti:Something]
+[00:01.00]First
+[00:03.50]Second
+[00:07.25]Third
+"""
+
+
+def test_parse_lrc_sorts_lines_and_skips_metadata_tags():
+    lyrics = parse_lrc(LRC)
+    assert lyrics.synced
+    assert lyrics.lines == ["First", "Second", "Third"]
+    assert lyrics.times == [1000, 3500, 7250]
+
+
+def test_parse_lrc_applies_offset():
+    # A positive offset shows lines sooner, none goes below zero
+    lyrics = parse_lrc("[offset:+1500]\n" + LRC)
+    assert lyrics.times == [0, 2000, 5750]
+    assert parse_lrc("[offset: -500]\n" + LRC).times == [1500, 4000, 7750]
+
+
+def test_parse_lrc_repeats_lines_with_several_stamps():
+    lyrics = parse_lrc("[00:05.00]Verse\n[00:02.00][00:10.00]Chorus\n")
+    assert lyrics.lines == ["Chorus", "Verse", "Chorus"]
+    assert lyrics.times == [2000, 5000, 10000]
+
+
+def test_parse_lrc_without_stamps_is_plain():
+    lyrics = parse_lrc("[ar:Someone]\nJust words\n\nMore words\n")
+    assert not lyrics.synced
+    assert lyrics.lines == ["Just words", "", "More words"]
+    assert lyrics.line_at(5000) == -1
+
+
+def test_line_at():
+    lyrics = parse_lrc(LRC)
+    assert lyrics.line_at(0) == -1
+    assert lyrics.line_at(999) == -1
+    assert lyrics.line_at(1000) == 0
+    assert lyrics.line_at(3499) == 0
+    assert lyrics.line_at(3500) == 1
+    assert lyrics.line_at(60000) == 2
+
+
+def test_one_text_line_per_lrc_line():
+    lyrics = parse_lrc(LRC)
+    assert lyrics.text == "First\nSecond\nThird"
+    assert lyrics.rows == [0, 1, 2]
+
+
+def test_sylt_entries_with_their_own_breaks():
+    # Syllables as taggers write them: a line break leads each new line
+    lyrics = Lyrics(["\nNever", " gonna", "\ngive", " you", " up", "\r\nNever"],
+                    [0, 500, 1000, 1500, 2000, 2500])
+    assert lyrics.text == "Never gonna\ngive you up\nNever"
+    assert lyrics.rows == [0, 0, 1, 1, 1, 2]
+    lines = lyrics.text.split("\n")
+    assert lines[lyrics.rows[lyrics.line_at(1700)]] == "give you up"
+
+
+def test_sylt_lines_with_trailing_breaks():
+    lyrics = Lyrics(["One\n", "Two\n", "\n", "Four"], [0, 1000, 2000, 3000])
+    assert lyrics.text == "One\nTwo\n\nFour"
+    assert lyrics.rows == [0, 1, 3, 3]
@@ -0,0 +1,85 @@
+import os
+import sys
+import subprocess
+
+import pytest
+
+gi = pytest.importorskip("gi")
+gi.require_version('Gst', '1.0')
+from gi.repository import Gst, GLib
+
+from settings import DEFAULT_SETTINGS
+from network import NetworkOutput, REPORT_INTERVAL_MS
+
+Gst.init(None)
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RECEIVERS = 3
+MAX_SPREAD_MS = 10
+PLUGINS = ("audiotestsrc", "fakesink", "opusenc", "opusdec", "rtpopuspay", "rtpopusdepay", "rtpbin",
+           "udpsrc", "udpsink", "autoaudiosink")
+
+
+def start_receiver(home):
+    # A fresh HOME gives every receiver the default network settings the sender uses
+    return subprocess.Popen([sys.executable, os.path.join(REPO, "main.py"), "--receive", "127.0.0.1"],
+                            env=dict(os.environ, HOME=str(home)),
+                            stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+
+
+def stop(process):
+    process.terminate()
+    try:
+        return process.communicate(timeout=5)[0].decode("utf-8", "replace")
+    except subprocess.TimeoutExpired:
+        process.kill()
+        return process.communicate()[0].decode("utf-8", "replace")
+
+
+def test_receivers_on_localhost_play_in_step(tmp_path):
+    """Several receiver processes on this machine report (nearly) the same playout
+
+    Uses the default multicast group, so loopback needs multicast enabled.
+    """
+    missing = [name for name in PLUGINS if Gst.ElementFactory.find(name) is None]
+    if missing:
+        pytest.skip(f"missing GStreamer elements: {', '.join(missing)}")
+
+    output = NetworkOutput(dict(DEFAULT_SETTINGS["network"]))
+    pipeline = Gst.Pipeline.new("sender")
+    source = Gst.ElementFactory.make("audiotestsrc", None)
+    convert = Gst.ElementFactory.make("audioconvert", None)
+    local_sink = Gst.ElementFactory.make("fakesink", None)
+    local_sink.set_property("sync", True)
+    sink = output.attach(pipeline, local_sink)
+    for element in (source, convert, sink):
+        pipeline.add(element)
+    source.link(convert)
+    convert.link(sink)
+
+    loop = GLib.MainLoop()
+
+    def wait_for_receivers():
+        if len(output.drift.drifts()) < RECEIVERS:
+            return True
+        # Let every receiver report a few more times once they all play
+        GLib.timeout_add(3 * REPORT_INTERVAL_MS, loop.quit)
+        return False
+
+    receivers = []
+    logs = []
+    pipeline.set_state(Gst.State.PLAYING)
+    try:
+        receivers = [start_receiver(tmp_path) for _ in range(RECEIVERS)]
+        GLib.timeout_add(500, wait_for_receivers)
+        GLib.timeout_add_seconds(60, loop.quit)
+        loop.run()
+        drifts = output.drift.drifts()
+        summary = output.drift.summary()
+    finally:
+        pipeline.set_state(Gst.State.NULL)
+        logs = [stop(process) for process in receivers]
+        output.close()
+
+    assert len(drifts) == RECEIVERS, f"{summary}\n" + "\n".join(logs)
+    assert max(drifts.values()) < MAX_SPREAD_MS, summary
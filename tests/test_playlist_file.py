@@ -0,0 +1,170 @@
+import os
+import time
+import random
+
+import pytest
+
+import playlist_file
+from playlist_file import PlaylistFile, parse_m3u, format_m3u, merge_groups
+
+SIZE = 100000
+
+
+def make_entries(count=SIZE):
+    return [(f"/music/{i:06d}.mp3", 200, f"Artist {i % 97} - Title {i}") for i in range(count)]
+
+
+@pytest.fixture
+def path(tmp_path):
+    return str(tmp_path / "big.m3u")
+
+
+def journal_size(path):
+    try:
+        return os.path.getsize(path + ".journal")
+    except FileNotFoundError:
+        return 0
+
+
+def test_m3u_round_trip():
+    entries = [("/a.mp3", 10, "A - One"), ("http://radio.example/live", -1, "Radio")]
+    assert parse_m3u(format_m3u(entries).splitlines()) == entries
+    # Plain M3U without #EXTINF lines
+    assert parse_m3u(["/a.mp3", "", "# comment", "/b.mp3"]) == [("/a.mp3", -1, ""), ("/b.mp3", -1, "")]
+
+
+def test_one_change_writes_bytes_proportional_to_it(path):
+    entries = make_entries()
+    playlist = PlaylistFile(path)
+    playlist.save(entries)
+    base_size = os.path.getsize(path)
+
+    entries[5000] = ("/music/new.mp3", 100, "New - Track")
+    written = playlist.save(entries)
+    assert 0 < written < 200
+    assert os.path.getsize(path) == base_size
+    assert PlaylistFile(path).load() == entries
+
+
+def test_scattered_edits_stay_small(path):
+    entries = make_entries()
+    playlist = PlaylistFile(path)
+    playlist.save(entries)
+
+    del entries[10]
+    entries.insert(90000, ("/music/inserted.mp3", 1, "In - Serted"))
+    entries.append(("/music/last.mp3", 1, "Last - One"))
+    assert playlist.save(entries) < 500
+
+    # Retagging far apart tracks keeps the length, diffed position by position
+    for index in (3, 40000, 99990):
+        entries[index] = entries[index][:2] + ("Retagged",)
+    assert playlist.save(entries) < 1000
+    assert PlaylistFile(path).load() == entries
+
+
+def test_sorting_a_huge_playlist_compacts_quickly(path):
+    entries = make_entries()
+    playlist = PlaylistFile(path)
+    playlist.save(entries)
+
+    entries.sort(key=lambda entry: entry[2])
+    start = time.perf_counter()
+    playlist.save(entries)
+    assert time.perf_counter() - start < 5
+    assert journal_size(path) == 0
+    assert PlaylistFile(path).load() == entries
+
+
+def test_journal_is_compacted(path, monkeypatch):
+    monkeypatch.setattr(playlist_file, "MAX_JOURNAL_OPS", 5)
+    entries = make_entries(1000)
+    playlist = PlaylistFile(path)
+    playlist.save(entries)
+    for i in range(10):
+        entries[i * 50] = (f"/music/edit{i}.mp3", 1, "Edit")
+        playlist.save(entries)
+        assert playlist.journal_ops <= 5
+    assert PlaylistFile(path).load() == entries
+
+
+def test_torn_journal_line_is_dropped_before_appending(path):
+    entries = make_entries(1000)
+    playlist = PlaylistFile(path)
+    playlist.save(entries)
+    entries[1] = ("/music/saved.mp3", 1, "Saved")
+    playlist.save(entries)
+    saved = list(entries)
+
+    # A crash in the middle of the next save
+    with open(path + ".journal", "ab") as f:
+        f.write(b'{"start": 7, "end": 8, "entr')
+
+    playlist = PlaylistFile(path)
+    assert playlist.load() == saved
+    entries = list(saved)
+    entries[2] = ("/music/after.mp3", 1, "After")
+    playlist.save(entries)
+    assert PlaylistFile(path).load() == entries
+
+
+def test_stale_journal_is_dropped(path):
+    entries = make_entries(1000)
+    playlist = PlaylistFile(path)
+    playlist.save(entries)
+    entries[1] = ("/music/journaled.mp3", 1, "Journaled")
+    playlist.save(entries)
+
+    # Someone else rewrote the playlist
+    replaced = make_entries(10)
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(format_m3u(replaced))
+
+    playlist = PlaylistFile(path)
+    assert playlist.load() == replaced
+    assert journal_size(path) == 0
+    replaced[0] = ("/music/edited.mp3", 1, "Edited")
+    playlist.save(replaced)
+    assert PlaylistFile(path).load() == replaced
+
+
+def apply_merge(queue, paths):
+    queue = list(queue)
+    for position, group in merge_groups(queue, paths):
+        queue[position:position] = group
+    return queue
+
+
+def test_merge_places_new_tracks_next_to_their_neighbours():
+    assert apply_merge(["a", "b", "c"], ["x", "a", "y", "c", "z"]) == ["x", "a", "y", "b", "c", "z"]
+    assert apply_merge(["a", "b"], ["a", "p", "q", "b"]) == ["a", "p", "q", "b"]
+
+
+def test_merge_without_common_tracks_appends():
+    assert apply_merge(["a", "b"], ["x", "y"]) == ["a", "b", "x", "y"]
+    assert apply_merge([], ["x", "y"]) == ["x", "y"]
+
+
+def test_merge_adds_nothing_already_queued():
+    assert apply_merge(["a", "b", "c"], ["c", "a"]) == ["a", "b", "c"]
+
+
+def test_random_edits_replay_exactly():
+    rng = random.Random(46)
+    for size in (0, 3, 200, 20000):
+        old = make_entries(size)
+        new = list(old)
+        for _ in range(rng.randint(1, 30)):
+            action = rng.random()
+            if action < 0.4 or not new:
+                new.insert(rng.randint(0, len(new)), (f"/music/new{rng.random()}.mp3", 1, "New"))
+            elif action < 0.7:
+                del new[rng.randrange(len(new))]
+            else:
+                # Moves and duplicates
+                new.insert(rng.randint(0, len(new)), new[rng.randrange(len(new))])
+        splices = playlist_file.diff_entries(old, new, len(new) + 1)
+        replayed = list(old)
+        for start, end, entries in splices:
+            replayed[start:end] = entries
+        assert replayed == new
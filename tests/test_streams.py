@@ -0,0 +1,215 @@
+import io
+import time
+import wave
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+gi = pytest.importorskip("gi")
+gi.require_version('Gst', '1.0')
+from gi.repository import Gst
+
+from streams import (is_stream_uri, to_uri, stream_display_name, apply_stream_buffering,
+                     parse_icy_title, StreamBufferController)
+
+Gst.init(None)
+
+METAINT = 4096
+
+
+def make_wav(seconds=3, rate=8000):
+    data = io.BytesIO()
+    with wave.open(data, "wb") as f:
+        f.setnchannels(1)
+        f.setsampwidth(2)
+        f.setframerate(rate)
+        f.writeframes(b"\0\0" * rate * seconds)
+    return data.getvalue()
+
+
+def icy_metadata(title):
+    text = f"StreamTitle='{title}';".encode("utf-8")
+    blocks = (len(text) + 15) // 16
+    return bytes([blocks]) + text.ljust(blocks * 16, b"\0")
+
+
+class StreamHandler(BaseHTTPRequestHandler):
+    """Serves the payload slowly; /icy interleaves Icecast metadata when asked for it"""
+
+    def do_GET(self):
+        data = self.server.payload
+        icy = self.path == "/icy" and self.headers.get("Icy-MetaData") == "1"
+        self.send_response(200)
+        self.send_header("Content-Type", "audio/x-wav")
+        if icy:
+            self.send_header("icy-metaint", str(METAINT))
+            self.send_header("icy-name", "Test Station")
+        else:
+            self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        try:
+            for offset in range(0, len(data), METAINT):
+                self.wfile.write(data[offset:offset + METAINT])
+                if icy:
+                    self.wfile.write(icy_metadata("Some Artist - Some Song"))
+                self.wfile.flush()
+                # A stall after the first chunk, so the client's buffer runs low
+                time.sleep(0.5 if offset == 0 else 0.02)
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), StreamHandler)
+    httpd.payload = make_wav()
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{httpd.server_address[1]}"
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def make_playbin(uri):
+    if Gst.ElementFactory.find("souphttpsrc") is None:
+        pytest.skip("souphttpsrc not available")
+    player = Gst.ElementFactory.make("playbin", None)
+    player.set_property("uri", uri)
+    player.set_property("audio-sink", Gst.ElementFactory.make("fakesink", None))
+    player.set_property("video-sink", Gst.ElementFactory.make("fakesink", None))
+    apply_stream_buffering(player, {"buffer_duration_ms": 1000})
+    return player
+
+
+class RecordingPlayer:
+    def __init__(self, pipeline=None):
+        self.pipeline = pipeline
+        self.states = []
+
+    def set_state(self, state):
+        self.states.append(state)
+        if self.pipeline is not None:
+            return self.pipeline.set_state(state)
+        return Gst.StateChangeReturn.SUCCESS
+
+
+class FakeBufferingMessage:
+    def __init__(self, percent):
+        self.percent = percent
+
+    def parse_buffering(self):
+        return self.percent
+
+
+def test_stream_uris(server):
+    assert is_stream_uri(server + "/radio.wav")
+    assert is_stream_uri("icy://example.org/live")
+    assert not is_stream_uri("/music/song.flac")
+    assert to_uri(server + "/radio.wav") == server + "/radio.wav"
+    assert to_uri("/music/song.flac") == "file:///music/song.flac"
+    assert stream_display_name(server + "/radio.wav") == "radio.wav"
+    assert stream_display_name(server + "/") == server.split("://", 1)[1]
+
+
+def test_buffering_pauses_and_resumes():
+    player = RecordingPlayer()
+    controller = StreamBufferController(player)
+    controller.reset(Gst.State.PLAYING)
+
+    for percent in (10, 50, 99):
+        controller.handle_buffering(FakeBufferingMessage(percent))
+    assert controller.buffering
+    assert player.states == [Gst.State.PAUSED]
+
+    controller.handle_buffering(FakeBufferingMessage(100))
+    assert not controller.buffering
+    assert player.states == [Gst.State.PAUSED, Gst.State.PLAYING]
+
+
+def test_buffering_keeps_user_pause():
+    player = RecordingPlayer()
+    controller = StreamBufferController(player)
+    controller.reset(Gst.State.PLAYING)
+    controller.handle_buffering(FakeBufferingMessage(20))
+    # The user paused while the buffer refilled, it must not start playing on its own
+    controller.set_target_state(Gst.State.PAUSED)
+    controller.handle_buffering(FakeBufferingMessage(100))
+    assert player.states == [Gst.State.PAUSED]
+
+
+def test_live_streams_are_not_paused():
+    player = RecordingPlayer()
+    controller = StreamBufferController(player)
+    controller.reset(Gst.State.PLAYING, is_live=True)
+    controller.handle_buffering(FakeBufferingMessage(5))
+    controller.handle_buffering(FakeBufferingMessage(100))
+    assert player.states == []
+
+
+def run_until(pipeline, handler, timeout=15):
+    bus = pipeline.get_bus()
+    deadline = time.monotonic() + timeout
+    try:
+        while time.monotonic() < deadline:
+            message = bus.timed_pop(100 * Gst.MSECOND)
+            if message is None:
+                continue
+            if message.type == Gst.MessageType.ERROR:
+                err, debug = message.parse_error()
+                pytest.fail(f"{err.message} {debug}")
+            if message.type == Gst.MessageType.EOS or handler(message):
+                return True
+        return False
+    finally:
+        pipeline.set_state(Gst.State.NULL)
+
+
+def test_http_stream_buffering(server):
+    pipeline = make_playbin(server + "/song.wav")
+    player = RecordingPlayer(pipeline)
+    controller = StreamBufferController(player)
+    controller.reset(Gst.State.PLAYING)
+    percents = []
+
+    def on_message(message):
+        if message.type == Gst.MessageType.BUFFERING:
+            percents.append(controller.handle_buffering(message))
+            return percents[-1] >= 100 and any(percent < 100 for percent in percents)
+        return False
+
+    pipeline.set_state(Gst.State.PAUSED)
+    assert run_until(pipeline, on_message), f"no buffering cycle, saw {percents}"
+    assert not controller.buffering
+    assert player.states[0] == Gst.State.PAUSED
+    assert player.states[-1] == Gst.State.PLAYING
+
+
+def test_icy_tags_from_http_stream(server):
+    pipeline = make_playbin(server + "/icy")
+    tags = {}
+
+    def on_message(message):
+        if message.type == Gst.MessageType.TAG:
+            title, artist, station = parse_icy_title(message.parse_tag())
+            tags.update({key: value for key, value in
+                         (("title", title), ("artist", artist), ("station", station)) if value})
+        return "title" in tags and "station" in tags
+
+    pipeline.set_state(Gst.State.PLAYING)
+    assert run_until(pipeline, on_message), f"no stream title, saw {tags}"
+    assert tags == {"title": "Some Song", "artist": "Some Artist", "station": "Test Station"}
+
+
+def test_parse_icy_title():
+    tags = Gst.TagList.new_empty()
+    tags.add_value(Gst.TagMergeMode.REPLACE, Gst.TAG_TITLE, "Band - Track")
+    tags.add_value(Gst.TagMergeMode.REPLACE, Gst.TAG_ORGANIZATION, "Station")
+    assert parse_icy_title(tags) == ("Track", "Band", "Station")
+
+    tags = Gst.TagList.new_empty()
+    tags.add_value(Gst.TagMergeMode.REPLACE, Gst.TAG_TITLE, "Just a title")
+    assert parse_icy_title(tags) == ("Just a title", None, None)
@@ -0,0 +1,123 @@
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import gi
+
+gi.require_version('GdkPixbuf', '2.0')
+from gi.repository import GdkPixbuf, GLib
+
+from settings import get_config_directory
+from metadata import read_artwork
+
+
+THUMBNAIL_SIZE = 128
+
+
+def get_thumbnail_directory():
+    thumbnail_dir = os.path.join(get_config_directory(), "thumbnails")
+    os.makedirs(thumbnail_dir, exist_ok=True)
+    return thumbnail_dir
+
+
+def load_pixbuf_at_size(data, size):
+    """Decode image bytes straight to fit within size x size, keeping the aspect ratio
+
+    Scaling happens while decoding, so a 3000px cover never exists at full size.
+    """
+    loader = GdkPixbuf.PixbufLoader()
+
+    def on_size_prepared(loader, width, height):
+        if width > size or height > size:
+            scale = size / max(width, height)
+            loader.set_size(max(1, int(width * scale)), max(1, int(height * scale)))
+
+    loader.connect("size-prepared", on_size_prepared)
+    try:
+        loader.write(data)
+    finally:
+        loader.close()
+    return loader.get_pixbuf()
+
+
+def thumbnail_file(key, path, size=THUMBNAIL_SIZE):
+    """Path of the cached PNG thumbnail for artwork key, made from path's artwork if needed
+
+    Returns None when the file has no artwork. Safe to call from any thread.
+    """
+    cache_file = os.path.join(get_thumbnail_directory(), f"{key}-{size}.png")
+    if os.path.exists(cache_file):
+        return cache_file
+    artwork = read_artwork(path)
+    if not artwork:
+        return None
+    pixbuf = load_pixbuf_at_size(artwork, size)
+    if pixbuf is None:
+        return None
+    tmp_file = f"{cache_file}.{threading.get_ident()}.tmp"
+    pixbuf.savev(tmp_file, "png", [], [])
+    os.replace(tmp_file, cache_file)
+    return cache_file
+
+
+class ThumbnailStore:
+    """Album art thumbnails keyed by artwork hash, from memory, the disk cache or the audio file"""
+
+    def __init__(self, size=THUMBNAIL_SIZE, memory_entries=256):
+        self.size = size
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="thumbnail")
+        self.memory = OrderedDict()
+        self.memory_entries = memory_entries
+        self.wanted = set()
+        self.lock = threading.Lock()
+
+    def cached(self, key):
+        """The thumbnail if it is already in memory, else None"""
+        pixbuf = self.memory.get(key)
+        if pixbuf is not None:
+            self.memory.move_to_end(key)
+        return pixbuf
+
+    def request(self, items, callback):
+        """Load thumbnails for [(artwork hash, audio path)]; callback(key, pixbuf) on the main loop
+
+        Each call replaces the previous wish list, so tiles scrolled out of view
+        before their turn are never decoded.
+        """
+        with self.lock:
+            self.wanted = {key for key, path in items}
+
+        for key, path in items:
+            pixbuf = self.cached(key)
+            if pixbuf is not None:
+                callback(key, pixbuf)
+            else:
+                self.executor.submit(self._load, key, path, callback)
+
+    def _load(self, key, path, callback):
+        with self.lock:
+            if key not in self.wanted:
+                return
+
+        try:
+            cache_file = thumbnail_file(key, path, self.size)
+            if cache_file is None:
+                return
+            pixbuf = GdkPixbuf.Pixbuf.new_from_file(cache_file)
+        except Exception as e:
+            print(f"Error loading thumbnail for {path}: {e}")
+            return
+
+        GLib.idle_add(self._deliver, key, pixbuf, callback)
+
+    def _deliver(self, key, pixbuf, callback):
+        self.memory[key] = pixbuf
+        self.memory.move_to_end(key)
+        while len(self.memory) > self.memory_entries:
+            self.memory.popitem(last=False)
+        callback(key, pixbuf)
+        return False
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
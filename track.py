@@ -0,0 +1,69 @@
+import os
+import sys
+import hashlib
+
+from streams import is_stream_uri, stream_display_name
+
+
+def artwork_hash(artwork):
+    """Short content hash identifying a piece of artwork"""
+    if not artwork:
+        return None
+    return hashlib.blake2b(artwork, digest_size=8).hexdigest()
+
+
+def parse_year(date):
+    """Year as int from "2001", "2001-05-01" or an ID3 timestamp; 0 when unknown"""
+    text = str(date or "").strip()[:4]
+    return int(text) if text.isdigit() else 0
+
+
+def _intern(value):
+    # Artist/album names repeat across a library, share one string per name
+    return sys.intern(value) if value else value
+
+
+class Track:
+    """One playlist entry with typed fields"""
+    __slots__ = ("path", "title", "artist", "album", "year", "track_no", "disc_no",
+                 "duration_ms", "artwork_hash", "gain", "genre")
+
+    def __init__(self, path, title="Unknown", artist="Unknown", album="Unknown", year=0,
+                 track_no=0, disc_no=0, duration_ms=0, artwork_hash=None, gain=None, genre=""):
+        self.path = path
+        self.title = title
+        self.artist = _intern(artist)
+        self.album = _intern(album)
+        self.year = year
+        self.track_no = track_no
+        self.disc_no = disc_no
+        self.duration_ms = duration_ms
+        self.artwork_hash = artwork_hash
+        self.gain = gain
+        self.genre = _intern(genre or "")
+
+    @classmethod
+    def from_record(cls, path, record):
+        """Build a track from a metadata.TagRecord"""
+        return cls(path, record.title, record.artist, record.album, parse_year(record.date),
+                   record.track_no, record.disc_no, int(record.duration * 1000),
+                   artwork_hash(record.artwork), record.gain, record.genre)
+
+    @classmethod
+    def for_stream(cls, uri):
+        name = stream_display_name(uri)
+        return cls(uri, title=name, artist="Internet Radio")
+
+    @property
+    def filename(self):
+        """Display name: file name without extension, or the stream name"""
+        if is_stream_uri(self.path):
+            return stream_display_name(self.path)
+        return os.path.splitext(os.path.basename(self.path))[0]
+
+    @property
+    def is_stream(self):
+        return is_stream_uri(self.path)
+
+    def __repr__(self):
+        return f"Track({self.path!r})"
@@ -0,0 +1,164 @@
+import time
+
+import gi
+
+gi.require_version('Gst', '1.0')
+gi.require_version('Gtk', '3.0')
+from gi.repository import Gst, Gtk, GLib
+
+MIN_FPS = 10
+THRESHOLD_DB = -80
+
+
+def create_spectrum_element(visualizer_settings):
+    """Spectrum analyser for playbin's audio-filter, posting at most max_fps messages a second"""
+    spectrum = Gst.ElementFactory.make("spectrum", "visualizer-spectrum")
+    if spectrum is None:
+        print("GStreamer 'spectrum' element is not available, visualizer disabled")
+        return None
+
+    max_fps = max(MIN_FPS, int(visualizer_settings.get("max_fps", 60)))
+    spectrum.set_property("bands", int(visualizer_settings.get("bands", 32)))
+    spectrum.set_property("threshold", THRESHOLD_DB)
+    spectrum.set_property("interval", Gst.SECOND // max_fps)
+    spectrum.set_property("message-phase", False)
+    spectrum.set_property("post-messages", True)
+    return spectrum
+
+
+class FrameStats:
+    """Frame-time instrumentation for the visualizer"""
+
+    def __init__(self):
+        self.frames = 0
+        self.skipped = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+        self.window_frames = 0
+        self.window_ms = 0.0
+
+    def add(self, frame_ms):
+        self.frames += 1
+        self.total_ms += frame_ms
+        self.max_ms = max(self.max_ms, frame_ms)
+        self.window_frames += 1
+        self.window_ms += frame_ms
+
+    def take_window(self):
+        """Average frame time since the last call"""
+        average = self.window_ms / self.window_frames if self.window_frames else 0.0
+        self.window_frames = 0
+        self.window_ms = 0.0
+        return average
+
+    def summary(self, fps):
+        average = self.total_ms / self.frames if self.frames else 0.0
+        return (f"Target {fps} fps, {self.frames} frames drawn, {self.skipped} skipped\n"
+                f"Frame time: avg {average:.2f} ms, max {self.max_ms:.2f} ms")
+
+
+class SpectrumVisualizer(Gtk.DrawingArea):
+    """Bar spectrum drawn with Cairo from the latest spectrum message"""
+
+    def __init__(self, visualizer_settings):
+        Gtk.DrawingArea.__init__(self)
+        self.set_size_request(-1, 60)
+        self.max_fps = max(MIN_FPS, int(visualizer_settings.get("max_fps", 60)))
+        self.fps = self.max_fps
+        self.element = None
+        self.magnitudes = None
+        self.bars = []
+        self.dirty = False
+        self.active = True
+        self.last_frame_time = 0
+        self.stats = FrameStats()
+        self.adapt_id = None
+
+        self.set_has_tooltip(True)
+        self.connect('query-tooltip', self.on_query_tooltip)
+        self.connect('draw', self.on_draw)
+        self.connect('map', lambda widget: self.update_posting())
+        self.connect('unmap', lambda widget: self.update_posting())
+        self.add_tick_callback(self.on_tick)
+
+    def set_element(self, element):
+        self.element = element
+        self.magnitudes = None
+        self.bars = []
+        self.update_posting()
+        self.queue_draw()
+
+    def set_active(self, active):
+        """Pause analysis while nobody can see it (e.g. the window is minimized)"""
+        self.active = active
+        self.update_posting()
+
+    def update_posting(self):
+        # No bus traffic and no timers at all while the bars are not on screen
+        running = self.element is not None and self.active and self.get_mapped()
+        if self.element is not None:
+            self.element.set_property("post-messages", running)
+        if running and self.adapt_id is None:
+            self.adapt_id = GLib.timeout_add_seconds(1, self.adapt_rate)
+        elif not running and self.adapt_id is not None:
+            GLib.source_remove(self.adapt_id)
+            self.adapt_id = None
+
+    def handle_message(self, message):
+        """Keep only the newest spectrum; returns True if the message was used"""
+        structure = message.get_structure()
+        if structure is None or structure.get_name() != "spectrum":
+            return False
+        if message.src is not self.element:
+            return False
+        self.magnitudes = list(structure.get_value("magnitude"))
+        if self.dirty:
+            self.stats.skipped += 1
+        self.dirty = True
+        return True
+
+    def on_tick(self, widget, frame_clock):
+        # The frame clock stops ticking for hidden windows, so this also idles then
+        now = frame_clock.get_frame_time()
+        if self.dirty and now - self.last_frame_time >= 1000000 // self.fps:
+            self.last_frame_time = now
+            self.dirty = False
+            self.queue_draw()
+        return GLib.SOURCE_CONTINUE
+
+    def adapt_rate(self):
+        """Halve the frame rate when drawing gets expensive, creep back when it is cheap"""
+        average_ms = self.stats.take_window()
+        budget_ms = 1000.0 / self.fps
+        if average_ms > budget_ms * 0.25 and self.fps > MIN_FPS:
+            self.fps = max(MIN_FPS, self.fps // 2)
+        elif average_ms < budget_ms * 0.05 and self.fps < self.max_fps:
+            self.fps = min(self.max_fps, self.fps * 2)
+        return True
+
+    def on_draw(self, widget, cr):
+        start = time.perf_counter()
+        width = self.get_allocated_width()
+        height = self.get_allocated_height()
+
+        if self.magnitudes:
+            if len(self.bars) != len(self.magnitudes):
+                self.bars = [0.0] * len(self.magnitudes)
+            # Rise immediately, fall off smoothly
+            for i, magnitude in enumerate(self.magnitudes):
+                level = max(0.0, min(1.0, (magnitude - THRESHOLD_DB) / -THRESHOLD_DB))
+                self.bars[i] = max(level, self.bars[i] - 0.05)
+
+            bar_width = width / len(self.bars)
+            cr.set_source_rgba(0.2, 0.5, 0.9, 0.9)
+            for i, level in enumerate(self.bars):
+                bar_height = level * height
+                cr.rectangle(i * bar_width + 1, height - bar_height, max(bar_width - 2, 1), bar_height)
+            cr.fill()
+
+        self.stats.add((time.perf_counter() - start) * 1000)
+        return False
+
+    def on_query_tooltip(self, widget, x, y, keyboard_mode, tooltip):
+        tooltip.set_text(self.stats.summary(self.fps))
+        return True
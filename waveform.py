@@ -0,0 +1,322 @@
+import os
+import sqlite3
+import threading
+from array import array
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import gi
+
+gi.require_version('Gst', '1.0')
+gi.require_version('Gtk', '3.0')
+from gi.repository import Gst, Gtk, Gdk, GLib, GObject
+
+from library import get_library_path
+from audio_output import renice_streaming_threads
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+WAVEFORM_BUCKETS = 1500
+DECODE_RATE = 8000
+
+
+class PeakAccumulator:
+    """Running (min, max) per bucket over a stream of 16-bit samples
+
+    The bucket width comes from the expected sample count. If more samples
+    arrive than expected, neighbouring buckets are merged and the width
+    doubled, so memory stays at most `buckets` pairs whatever the length.
+    """
+
+    def __init__(self, total_samples, buckets=WAVEFORM_BUCKETS):
+        self.buckets = buckets
+        self.width = max(1, -(-total_samples // buckets))
+        self.lows = array("h")
+        self.highs = array("h")
+        self.count = 0
+
+    def add(self, data):
+        if np is not None:
+            samples = np.frombuffer(data, dtype=np.int16, count=len(data) // 2)
+        else:
+            samples = array("h")
+            samples.frombytes(data[:len(data) // 2 * 2])
+
+        position = 0
+        while position < len(samples):
+            offset = self.count % self.width
+            take = min(self.width - offset, len(samples) - position)
+            chunk = samples[position:position + take]
+            if np is not None:
+                low, high = int(chunk.min()), int(chunk.max())
+            else:
+                low, high = min(chunk), max(chunk)
+            if offset == 0:
+                self.lows.append(low)
+                self.highs.append(high)
+            else:
+                self.lows[-1] = min(self.lows[-1], low)
+                self.highs[-1] = max(self.highs[-1], high)
+            position += take
+            self.count += take
+            if len(self.lows) > self.buckets:
+                self._fold()
+
+    def _fold(self):
+        lows, highs = self.lows, self.highs
+        self.lows = array("h", (min(lows[i:i + 2]) for i in range(0, len(lows), 2)))
+        self.highs = array("h", (max(highs[i:i + 2]) for i in range(0, len(highs), 2)))
+        self.width *= 2
+
+    def peaks(self):
+        """Interleaved int8 (min, max) pairs"""
+        peaks = array("b")
+        for low, high in zip(self.lows, self.highs):
+            peaks.append(low * 127 // 32768)
+            peaks.append(high * 127 // 32768)
+        return peaks
+
+
+def compute_peaks(path, buckets=WAVEFORM_BUCKETS, timeout_seconds=30):
+    """Decode a file to mono 8 kHz PCM through an appsink and reduce it to peaks as it arrives"""
+    pipeline = Gst.parse_launch(
+        "uridecodebin name=source ! audioconvert ! audioresample ! "
+        f"audio/x-raw,format=S16LE,channels=1,rate={DECODE_RATE} ! "
+        "appsink name=sink sync=false max-buffers=64")
+    pipeline.get_by_name("source").set_property("uri", GLib.filename_to_uri(path))
+    sink = pipeline.get_by_name("sink")
+    renice_streaming_threads(pipeline)
+
+    accumulator = None
+    try:
+        pipeline.set_state(Gst.State.PLAYING)
+        while True:
+            sample = sink.emit("try-pull-sample", timeout_seconds * Gst.SECOND)
+            if sample is None:
+                break
+            if accumulator is None:
+                # Prerolled by now, so the duration is known for most files
+                success, duration = pipeline.query_duration(Gst.Format.TIME)
+                total = duration * DECODE_RATE // Gst.SECOND if success and duration > 0 else 0
+                accumulator = PeakAccumulator(total, buckets)
+            buffer = sample.get_buffer()
+            accumulator.add(buffer.extract_dup(0, buffer.get_size()))
+
+        message = pipeline.get_bus().pop_filtered(Gst.MessageType.ERROR)
+        if message is not None:
+            err, debug = message.parse_error()
+            print(f"Error computing waveform for {path}: {err}")
+            return None
+    finally:
+        pipeline.set_state(Gst.State.NULL)
+
+    return accumulator.peaks() if accumulator is not None else array("b")
+
+
+class WaveformStore:
+    """Loads waveform peaks from the library database or computes them in the background
+
+    Peaks are stored next to the track metadata, in the library's waveforms
+    table keyed by path and invalidated when the file's size or mtime changes.
+    """
+
+    def __init__(self, memory_entries=4, db_path=None):
+        self.db_path = db_path or get_library_path()
+        self.conn = None
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="waveform")
+        self.memory = OrderedDict()
+        self.memory_entries = memory_entries
+        self.wanted = set()
+        self.lock = threading.Lock()
+
+    def request(self, paths, callback):
+        """Get peaks for paths (e.g. current and next track); callback(path, peaks) on the main loop"""
+        with self.lock:
+            # Anything no longer current or next is dropped before it is decoded
+            self.wanted = set(paths)
+
+        for path in paths:
+            peaks = self.memory.get(path)
+            if peaks is not None:
+                self.memory.move_to_end(path)
+                callback(path, peaks)
+            else:
+                self.executor.submit(self._load, path, callback)
+
+    def _load(self, path, callback):
+        with self.lock:
+            if path not in self.wanted:
+                return
+
+        try:
+            peaks = self._cached(path)
+            if peaks is None:
+                peaks = compute_peaks(path)
+                if peaks is None:
+                    return
+                self._store(path, peaks)
+        except Exception as e:
+            print(f"Error loading waveform for {path}: {e}")
+            return
+
+        GLib.idle_add(self._deliver, path, peaks, callback)
+
+    def _connection(self):
+        # Opened by the worker thread, which is the only one using it
+        if self.conn is None:
+            self.conn = sqlite3.connect(self.db_path)
+            self.conn.execute("PRAGMA journal_mode=WAL")
+        return self.conn
+
+    def _cached(self, path):
+        st = os.stat(path)
+        row = self._connection().execute(
+            "SELECT peaks FROM waveforms WHERE path = ? AND size = ? AND mtime_ns = ?",
+            (path, st.st_size, st.st_mtime_ns)).fetchone()
+        if row is None:
+            return None
+        return array("b", row[0])
+
+    def _store(self, path, peaks):
+        st = os.stat(path)
+        conn = self._connection()
+        with conn:
+            conn.execute("INSERT OR REPLACE INTO waveforms (path, size, mtime_ns, peaks) VALUES (?, ?, ?, ?)",
+                         (path, st.st_size, st.st_mtime_ns, peaks.tobytes()))
+
+    def _close(self):
+        if self.conn is not None:
+            self.conn.close()
+            self.conn = None
+
+    def _deliver(self, path, peaks, callback):
+        self.memory[path] = peaks
+        self.memory.move_to_end(path)
+        while len(self.memory) > self.memory_entries:
+            self.memory.popitem(last=False)
+        callback(path, peaks)
+        return False
+
+    def shutdown(self):
+        with self.lock:
+            # Queued loads return right away, then the worker closes the database
+            self.wanted = set()
+        self.executor.submit(self._close)
+        self.executor.shutdown(wait=False)
+
+
+class WaveformSeekBar(Gtk.DrawingArea):
+    """Seek bar drawing the track's waveform, played part highlighted"""
+
+    __gsignals__ = {
+        'seek': (GObject.SignalFlags.RUN_FIRST, None, (float,)),
+    }
+
+    def __init__(self):
+        Gtk.DrawingArea.__init__(self)
+        self.set_size_request(-1, 48)
+        self.add_events(Gdk.EventMask.BUTTON_PRESS_MASK | Gdk.EventMask.BUTTON_RELEASE_MASK |
+                        Gdk.EventMask.POINTER_MOTION_MASK)
+        self.value = 0.0
+        self.peaks = None
+        self.columns = None
+        self.dragging = False
+
+        self.connect('draw', self.on_draw)
+        self.connect('size-allocate', lambda widget, allocation: self.invalidate_columns())
+        self.connect('button-press-event', self.on_button_press)
+        self.connect('motion-notify-event', self.on_motion)
+        self.connect('button-release-event', self.on_button_release)
+
+    def set_value(self, value):
+        # Don't fight the user while they drag
+        if not self.dragging:
+            self.value = max(0.0, min(100.0, value))
+            self.queue_draw()
+
+    def get_value(self):
+        return self.value
+
+    def set_peaks(self, peaks):
+        self.peaks = peaks
+        self.invalidate_columns()
+
+    def invalidate_columns(self):
+        self.columns = None
+        self.queue_draw()
+
+    def _build_columns(self, width):
+        """Fold the peaks into one (min, max) per pixel column, once per size change"""
+        buckets = len(self.peaks) // 2
+        columns = []
+        for x in range(width):
+            start = x * buckets // width
+            end = max((x + 1) * buckets // width, start + 1)
+            lows = self.peaks[start * 2:end * 2:2]
+            highs = self.peaks[start * 2 + 1:end * 2:2]
+            columns.append((min(lows) / 127.0, max(highs) / 127.0))
+        return columns
+
+    def on_draw(self, widget, cr):
+        width = self.get_allocated_width()
+        height = self.get_allocated_height()
+        middle = height / 2
+        played_x = width * self.value / 100
+
+        color = self.get_style_context().get_color(Gtk.StateFlags.NORMAL)
+
+        if not self.peaks:
+            # No waveform (yet): draw a plain progress line
+            cr.set_source_rgba(color.red, color.green, color.blue, 0.25)
+            cr.rectangle(0, middle - 2, width, 4)
+            cr.fill()
+            cr.set_source_rgba(0.2, 0.5, 0.9, 1.0)
+            cr.rectangle(0, middle - 2, played_x, 4)
+            cr.fill()
+            return False
+
+        if self.columns is None or len(self.columns) != width:
+            self.columns = self._build_columns(width)
+
+        cr.set_line_width(1.0)
+        for played in (True, False):
+            if played:
+                cr.set_source_rgba(0.2, 0.5, 0.9, 1.0)
+            else:
+                cr.set_source_rgba(color.red, color.green, color.blue, 0.35)
+            for x, (low, high) in enumerate(self.columns):
+                if (x < played_x) != played:
+                    continue
+                cr.move_to(x + 0.5, middle - max(high, 0.01) * middle)
+                cr.line_to(x + 0.5, middle - min(low, -0.01) * middle)
+            cr.stroke()
+        return False
+
+    def _value_at(self, x):
+        width = self.get_allocated_width()
+        return max(0.0, min(100.0, x / width * 100)) if width > 0 else 0.0
+
+    def on_button_press(self, widget, event):
+        if event.button == 1:
+            self.dragging = True
+            self.value = self._value_at(event.x)
+            self.queue_draw()
+        return True
+
+    def on_motion(self, widget, event):
+        if self.dragging:
+            self.value = self._value_at(event.x)
+            self.queue_draw()
+        return True
+
+    def on_button_release(self, widget, event):
+        if self.dragging and event.button == 1:
+            self.dragging = False
+            self.value = self._value_at(event.x)
+            self.emit('seek', self.value)
+        return True
+